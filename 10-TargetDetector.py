@@ -0,0 +1,175 @@
+#
+#  10-TargetDetector.py
+#
+#  Tenth lesson in a tutorial for detecting a target in opencv using python on a raspberry pi.
+#  This lesson does exactly what 09-AspectRatio.py does, but the detection algorithim now lives in
+#  TargetDetector.py so it can be imported by other programs (and run without a camera or window).
+#
+#		* Also there is an auto-exposure algorithim running to keep the image with a constant average pixel value
+#		  (see AutoExposure.py), it works out the whole shutter change at once instead of 10% a frame.
+#		* The trackbars start at the values saved in profile.json (see Profile.py), "s" saves them.
+#		* Every stage of the loop is timed with a StageTimer, and the percentiles are printed every 100 frames.
+#		* "r" starts (and stops) recording the raw frames to a folder (see FrameRecorder.py), to replay later.
+#
+
+# import the necessary packages
+from picamera.array import PiRGBArray
+from picamera import PiCamera
+import time
+import os
+import cv2
+import numpy as np
+from TargetDetector import TargetDetector, DetectorParams, CreateTrackbars, ReadTrackbars, GetCentroid, GetAzEl
+from StageTimer import StageTimer
+from AutoExposure import ExposureController, PiCameraBackend
+from Profile import LoadProfile, SaveProfile
+from FrameSource import Frame
+from FrameRecorder import FrameRecorder
+
+print('press "q" or "esc" to quit!  press "s" to save the trackbar values to profile.json, "r" to record')
+
+#some color values we'll be using
+red = (0, 0, 255)
+green = (0, 255, 0)
+blue = (255, 0, 0)
+
+# the resoultion of the camera... common values: (1296,972), (640,480), (320,240), (240, 180)
+# smaller resolutions work best when viewed remotely, however they all work great natively
+resolution = (320,240)
+
+# create the named window and the trackbars...
+winName = 'Target Detect'
+cv2.namedWindow(winName)
+
+# the trackbars start at the values in the profile file (if there is one), press "s" to save them to it
+profilePath = 'profile.json'
+params = DetectorParams()
+if os.path.exists(profilePath):
+	LoadProfile(profilePath, params)
+CreateTrackbars(winName, params)
+
+# create the timer and the detector
+timer = StageTimer()
+detector = TargetDetector(params, resolution, timer=timer)
+
+# initialize the camera and grab a reference to the raw camera capture
+camera = PiCamera()
+camera.resolution = resolution
+camera.shutter_speed = 10000
+camera.exposure_mode = 'off'
+
+# the auto exposure, it keeps the average pixel value at the autoShutter trackbar value
+exposure = ExposureController(PiCameraBackend(camera), target=params.autoShutter)
+
+rawCapture = PiRGBArray(camera, size=resolution)
+
+# allow the camera to warmup
+time.sleep(0.1)
+
+# capture frames from the camera
+frameCount = 0
+recorder = None		# the FrameRecorder, while we're recording
+timer.Reset()
+for frame in camera.capture_continuous(rawCapture, format="bgr", use_video_port=True):
+	# get the trackbar values...
+	ReadTrackbars(winName, params)
+
+	ss = camera.shutter_speed	# also, while we're at it, get the shutter speed.
+
+	# copy the raw frame for the recorder, it writes it to disk in another thread
+	if recorder is not None:
+		recorder.Record(Frame(frame.array, frameCount, time.time(), seq=camera.frame.index, shutter=ss))
+
+	# the time we spent waiting for the camera (and reading the trackbars)
+	timer.Mark('capture')
+
+	#start timer
+	t = cv2.getTickCount()
+
+	# grab the raw NumPy array representing the image
+	drawnImage = image = frame.array
+
+	# run the detector
+	finalTargets = detector.Detect(image)
+	avg = detector.avg
+
+	# end the timer
+	t = cv2.getTickCount() - t
+	detectTime = t / cv2.getTickFrequency() * 1000
+
+	# Find the center of each target, and it's angles:
+	centers = [GetCentroid(target) for target in finalTargets]
+	angles = [GetAzEl(center, resolution) for center in centers]
+	timer.Mark('centroids')
+
+	# if the trackbar is set to 1, use the threshold image to draw on instead of the original
+	if params.drawThresh == 1:
+		# convert the threshold image back to color so we can draw on it with colorful lines
+		drawnImage = cv2.cvtColor(detector.threshImg, cv2.COLOR_GRAY2RGB)
+
+	# draw all the detected hulls back on the original image
+	cv2.drawContours(drawnImage, finalTargets, -1, blue, 3)
+
+	for (cx, cy), azel in zip(centers, angles):
+		# draw the angles on the screen
+		text = '(%.0f,%0.f)' % azel
+		cv2.putText(drawnImage, text, (cx + 5, cy + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.33, green, 1)
+
+		# draw a little crosshair at the center of the target
+		cv2.line(drawnImage, (cx-2, cy), (cx+2, cy), red, 1)	# little horizontal line
+		cv2.line(drawnImage, (cx, cy-2), (cx, cy+2), red, 1)	# little vertical line
+
+	# draw some text with status...
+	text = 'Detect Time: %.0f ms' % (detectTime)
+	cv2.putText(drawnImage, text, (10, 10), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+	text = 'Avg Pixel: %.0f' % (avg[0])
+	cv2.putText(drawnImage, text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+	text = 'shutter speed: %d' % (ss)
+	cv2.putText(drawnImage, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+	text = '# Detections: %d' % (len(finalTargets))
+	cv2.putText(drawnImage, text, (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+	timer.Mark('annotate')
+
+	# show the frame
+	cv2.imshow(winName, drawnImage)
+
+	# Important!  Clear the stream in preparation for the next frame
+	rawCapture.truncate(0)
+
+	# set the shutter speed for the next frame
+	exposure.target = params.autoShutter
+	exposure.Update(avg)
+
+	# get the key from the keyboard
+	key = cv2.waitKey(1) & 0xFF
+
+	# save the trackbar values
+	if key == ord("s"):
+		SaveProfile(profilePath, params)
+		print('saved %s' % profilePath)
+
+	# start or stop recording
+	if key == ord("r"):
+		if recorder is None:
+			recorder = FrameRecorder(time.strftime('recording-%Y%m%d-%H%M%S'))
+			print('recording to %s' % recorder.path)
+		else:
+			recorder.Close()
+			print(recorder.Report())
+			recorder = None
+	timer.Mark('display')
+	timer.EndFrame()
+
+	# print where the time is going every 100 frames
+	frameCount += 1
+	if frameCount % 100 == 0:
+		print(timer.Report())
+
+	# if the `q` or 'esc' key was pressed, break from the loop
+	if key == ord("q") or key == 27:
+		break
+
+# finish writing the recording
+if recorder is not None:
+	recorder.Close()
+	print(recorder.Report())
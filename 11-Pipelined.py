@@ -0,0 +1,140 @@
+#
+#  11-Pipelined.py
+#
+#  Eleventh lesson in a tutorial for detecting a target in opencv using python on a raspberry pi.
+#  This lesson runs the same detector as 10-TargetDetector.py, but capture, detection and display each get
+#  their own thread (see Pipeline.py).  The frame rate is now limited by the slowest stage instead of the
+#  sum of all of them, and when a stage falls behind the stale frames are dropped instead of piling up.
+#
+#		* Also there is an auto-exposure algorithim running to keep the image with a constant average pixel value
+#		  (see AutoExposure.py), it works out the whole shutter change at once instead of 10% a frame.
+#		* The trackbars start at the values saved in profile.json (see Profile.py), "s" saves them.
+#		* The camera, gray, binary and annotation images are all written into preallocated FrameBuffers.
+#		* The camera captures YUV and the detector uses the Y plane as it's gray image, the color image is
+#		  only made when the original image is being shown.
+#		* Set streamPort to also stream the annotated frames to a browser (see MjpegStreamer.py).
+#
+
+# import the necessary packages
+import os
+import cv2
+import numpy as np
+from TargetDetector import TargetDetector, DetectorParams, CreateTrackbars, ReadTrackbars, GetCentroid, GetAzEl
+from FrameSource import PiCameraSource
+from Pipeline import Pipeline
+from FrameBuffers import FrameBuffers, CameraPaddedResolution
+from AutoExposure import ExposureController, PiCameraBackend
+from Profile import LoadProfile, SaveProfile
+from MjpegStreamer import MjpegStreamer
+
+print('press "q" or "esc" to quit!  press "s" to save the trackbar values to profile.json')
+
+#some color values we'll be using
+red = (0, 0, 255)
+green = (0, 255, 0)
+blue = (255, 0, 0)
+
+# the resoultion of the camera... common values: (1296,972), (640,480), (320,240), (240, 180)
+# smaller resolutions work best when viewed remotely, however they all work great natively
+resolution = (320,240)
+
+# set this to a port (like 5801) to watch the annotated frames at http://<pi>:<port>/ from the driver station
+streamPort = None
+streamer = None
+if streamPort is not None:
+	streamer = MjpegStreamer(port=streamPort, skip=2).Start()
+
+# create the named window and the trackbars...
+winName = 'Target Detect'
+cv2.namedWindow(winName)
+
+# the trackbars start at the values in the profile file (if there is one), press "s" to save them to it
+profilePath = 'profile.json'
+params = DetectorParams()
+if os.path.exists(profilePath):
+	LoadProfile(profilePath, params)
+CreateTrackbars(winName, params)
+
+# the camera, and the detector, each with a pool of buffers.  a frame holds on to it's buffers until the
+# pipeline is done with it (or drops it), so a stage that falls behind never sees them written over.
+# 5 camera buffers covers one being captured, one in each queue, one being detected and one being
+# displayed, if they're still all held the camera skips frames until one is given back.
+cameraBuffers = FrameBuffers(resolution, depth=5, kinds=('yuv',), paddedResolution=CameraPaddedResolution(resolution), pooled=True)
+source = PiCameraSource(resolution, buffers=cameraBuffers, gray=True, keepColor=True)
+camera = source.camera
+exposure = ExposureController(PiCameraBackend(camera), target=params.autoShutter, holdFrames=4)
+detector = TargetDetector(params, resolution, buffers=FrameBuffers(resolution, depth=4, pooled=True))
+
+# the display thread's image to draw on
+annotation = np.zeros((resolution[1], resolution[0], 3), np.uint8)
+
+# the display sink, it runs in the main thread for every frame the detector finishes
+def Display(result):
+	# read the trackbar values over a copy of the params (so the ones without a trackbar, like a profile's
+	# minFill, are kept), and hand them to the detector thread all at once (it sees them on it's next
+	# frame).  changing the params it's using would let it see half fixed up values.
+	global params
+	params = ReadTrackbars(winName, params.Copy())
+	detector.params = params
+
+	ss = camera.shutter_speed	# also, while we're at it, get the shutter speed.
+	avg = result.avg
+
+	# if the trackbar is set to 1, use the threshold image to draw on instead of the original
+	if params.drawThresh == 1:
+		drawnImage = cv2.cvtColor(result.threshImg, cv2.COLOR_GRAY2RGB, dst=annotation)
+	else:
+		drawnImage = result.frame.Bgr(annotation)
+
+	# draw all the detected hulls back on the original image
+	cv2.drawContours(drawnImage, result.targets, -1, blue, 3)
+
+	# Find the center of each target:
+	for target in result.targets:
+		cx, cy = GetCentroid(target)
+
+		# draw the angles on the screen
+		text = '(%.0f,%0.f)' % GetAzEl((cx, cy), resolution)
+		cv2.putText(drawnImage, text, (cx + 5, cy + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.33, green, 1)
+
+		# draw a little crosshair at the center of the target
+		cv2.line(drawnImage, (cx-2, cy), (cx+2, cy), red, 1)	# little horizontal line
+		cv2.line(drawnImage, (cx, cy-2), (cx, cy+2), red, 1)	# little vertical line
+
+	# draw some text with status...
+	text = 'Detect Time: %.0f ms' % (result.detectTime)
+	cv2.putText(drawnImage, text, (10, 10), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+	text = 'Avg Pixel: %.0f' % (avg[0])
+	cv2.putText(drawnImage, text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+	text = 'shutter speed: %d' % (ss)
+	cv2.putText(drawnImage, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+	text = '# Detections: %d' % (len(result.targets))
+	cv2.putText(drawnImage, text, (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+	text = 'Dropped: %d' % (pipeline.Dropped() + pipeline.sourceSequence.dropped)
+	cv2.putText(drawnImage, text, (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+	text = 'Latency: %.0f ms' % (result.frame.Latency('detected'))	# from the sensor's capture to the detector being done
+	cv2.putText(drawnImage, text, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+
+	# show the frame, and stream it
+	cv2.imshow(winName, drawnImage)
+	if streamer is not None:
+		streamer.Offer(drawnImage)
+
+	# set the shutter speed, the camera is a few frames behind the display so wait for the change to show up
+	exposure.target = params.autoShutter
+	exposure.Update(avg)
+
+	# get the key from the keyboard
+	key = cv2.waitKey(1) & 0xFF
+
+	# save the trackbar values
+	if key == ord("s"):
+		SaveProfile(profilePath, params)
+		print('saved %s' % profilePath)
+
+	# if the `q` or 'esc' key was pressed, stop the pipeline
+	return not (key == ord("q") or key == 27)
+
+# run it until "q" is pressed
+pipeline = Pipeline(source, detector, [Display])
+pipeline.Run()
@@ -0,0 +1,156 @@
+#
+#  AdaptiveThreshold.py
+#
+#  A replacement for cv2.adaptiveThreshold(..., cv2.ADAPTIVE_THRESH_MEAN_C, ...) that gives the exact same
+#  binary image, but writes everything into buffers that are allocated once, and whose cost doesn't grow
+#  with the adaptiveThreshSize trackbar.
+#
+#  The adaptive threshold compares each pixel to the mean of the blockSize x blockSize block around it.
+#  There are two engines for getting that mean:
+#		'integral'	- an integral image (https://en.wikipedia.org/wiki/Summed-area_table), any block's sum is
+#					  then just 4 lookups, so every block size costs the same.
+#		'box'		- opencv's separable box filter, which keeps running sums along the rows and columns.
+#
+#  Then the pixel is compared to the mean (minus C) the same way opencv does it, so the output matches
+#  cv2.adaptiveThreshold bit for bit (run this file to check, and to see how fast each one is).
+#
+#    Example:
+#		threshold = AdaptiveThreshold(resolution)
+#		detector = TargetDetector(params, resolution, adaptiveThreshold=threshold)
+#
+#    Compare it with opencv at every block size the trackbar allows:
+#		python AdaptiveThreshold.py [WxH]
+#
+
+# import the necessary packages
+import sys
+import time
+import cv2
+import numpy as np
+
+# the biggest block the adaptiveThreshSize trackbar allows
+MaxBlockSize = 55
+
+
+class AdaptiveThreshold(object):
+	def __init__(self, resolution=(320,240), engine='integral', maxBlockSize=MaxBlockSize):
+		if engine not in ('integral', 'box'):
+			raise ValueError('unknown adaptive threshold engine: %s' % engine)
+		self.engine = engine
+		self.maxBlockSize = maxBlockSize
+		self.Allocate(resolution)
+
+	# allocate all the buffers for a resolution
+	def Allocate(self, resolution):
+		w, h = resolution
+		self.resolution = resolution
+		r = self.maxBlockSize // 2
+
+		# the image padded by the biggest block's radius (replicating the edges, like opencv does), and it's
+		# integral image.  smaller blocks just use the part of the padding they need.
+		self.padded = np.zeros((h + 2 * r, w + 2 * r), np.uint8)
+		self.integral = np.zeros((h + 2 * r + 1, w + 2 * r + 1), np.int32)
+
+		# the block sums, and the means
+		self.sums = np.zeros((h, w), np.int32)
+		self.scratch = np.zeros((h, w), np.int32)
+		self.mean = np.zeros((h, w), np.uint8)
+
+		# mean - pixel, it can be negative
+		self.diff = np.zeros((h, w), np.int16)
+
+	# the mean of the block around every pixel, rounded to the nearest integer (into self.mean)
+	def Mean(self, gray, blockSize):
+		if self.engine == 'box':
+			return cv2.boxFilter(gray, -1, (blockSize, blockSize), dst=self.mean, normalize=True,
+				borderType=cv2.BORDER_REPLICATE | cv2.BORDER_ISOLATED)
+
+		h, w = gray.shape
+		R = self.maxBlockSize // 2
+		cv2.copyMakeBorder(gray, R, R, R, R, cv2.BORDER_REPLICATE, dst=self.padded)
+		cv2.integral(self.padded, sum=self.integral, sdepth=cv2.CV_32S)
+
+		# the sum of the block is bottom right - top right - bottom left + top left
+		o = R - blockSize // 2		# where the smaller block's padding starts
+		b = o + blockSize			# one past where the block ends
+		I = self.integral
+		sums = self.sums
+		np.subtract(I[b:b+h, b:b+w], I[o:o+h, b:b+w], out=sums)
+		np.subtract(sums, I[b:b+h, o:o+w], out=sums)
+		np.add(sums, I[o:o+h, o:o+w], out=sums)
+
+		# round(sum / n) in integers: (2 * sum + n) // (2 * n).  n is odd so there's never a tie to break.
+		n = blockSize * blockSize
+		np.multiply(sums, 2, out=sums)
+		np.add(sums, n, out=sums)
+		np.floor_divide(sums, 2 * n, out=self.scratch)
+		np.copyto(self.mean, self.scratch, casting='unsafe')
+		return self.mean
+
+	# the same arguments as cv2.adaptiveThreshold
+	def __call__(self, gray, maxValue, adaptiveMethod, thresholdType, blockSize, C, dst=None):
+		# we only do the mean, let opencv do the gaussian
+		if adaptiveMethod != cv2.ADAPTIVE_THRESH_MEAN_C or blockSize > self.maxBlockSize:
+			return cv2.adaptiveThreshold(gray, maxValue, adaptiveMethod, thresholdType, blockSize, C, dst=dst)
+
+		h, w = gray.shape
+		if (w, h) != self.resolution:
+			self.Allocate((w, h))
+		if dst is None or dst.shape != gray.shape:
+			dst = np.empty_like(gray)
+
+		mean = self.Mean(gray, blockSize)
+
+		# opencv compares pixel - mean to -C, with C rounded up for THRESH_BINARY and down for THRESH_BINARY_INV
+		cv2.subtract(mean, gray, dst=self.diff, dtype=cv2.CV_16S)
+		if thresholdType == cv2.THRESH_BINARY:
+			# pixel - mean > -C  is  mean - pixel < C
+			cv2.compare(self.diff, np.array([float(np.ceil(C))]), cv2.CMP_LT, dst=dst)
+		else:
+			# pixel - mean <= -C  is  mean - pixel >= C
+			cv2.compare(self.diff, np.array([float(np.floor(C))]), cv2.CMP_GE, dst=dst)
+
+		# compare gives 255, scale it if they asked for something else
+		if maxValue != 255:
+			np.copyto(dst, np.uint8(min(max(int(round(maxValue)), 0), 255)), where=dst != 0)
+		return dst
+
+
+# compare with cv2.adaptiveThreshold at every block size
+if __name__ == '__main__':
+	from Benchmark import SyntheticFrames
+
+	resolution = (320,240)
+	if len(sys.argv) > 1:
+		resolution = tuple(int(v) for v in sys.argv[1].split('x'))
+
+	frames = [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) for image, truth in SyntheticFrames(resolution, 'cluttered', 20)]
+	engines = [('integral', AdaptiveThreshold(resolution, 'integral')), ('box', AdaptiveThreshold(resolution, 'box'))]
+	dst = np.zeros((resolution[1], resolution[0]), np.uint8)
+	repeat = 5
+
+	print('%dx%d, ms per frame:' % resolution)
+	print('%5s %9s %9s %9s %12s' % ('size', 'opencv', 'integral', 'box', 'mismatches'))
+	for size in range(3, MaxBlockSize + 1, 2):
+		times = []
+		mismatches = 0
+
+		t = time.time()
+		for i in range(repeat):
+			expected = [cv2.adaptiveThreshold(g, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, size, 4) for g in frames]
+		times.append((time.time() - t) / (repeat * len(frames)) * 1000)
+
+		for name, engine in engines:
+			t = time.time()
+			for i in range(repeat):
+				for g in frames:
+					engine(g, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, size, 4, dst=dst)
+			times.append((time.time() - t) / (repeat * len(frames)) * 1000)
+
+			# check every frame, with both threshold types
+			for g, e in zip(frames, expected):
+				mismatches += np.count_nonzero(engine(g, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, size, 4, dst=dst) != e)
+				e2 = cv2.adaptiveThreshold(g, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, size, 4)
+				mismatches += np.count_nonzero(engine(g, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, size, 4, dst=dst) != e2)
+
+		print('%5d %9.3f %9.3f %9.3f %12d' % (size, times[0], times[1], times[2], mismatches))
@@ -0,0 +1,190 @@
+#
+#  AutoExposure.py
+#
+#  Keeps the average pixel value of the image at the autoShutter trackbar value by changing the camera's
+#  shutter speed.  The lessons do it by stepping the shutter 10% a frame toward the target, which is fine
+#  when the lighting doesn't change, but coming from a bright scene to a dark one it takes dozens of frames
+#  to settle, and the targets can be lost the whole time.
+#
+#  The image brightness is (roughly) proportional to the shutter speed, so the ExposureController works
+#  out the whole change at once:
+#
+#		newShutter = shutter * (target / avg) ^ gain
+#
+#  it's a proportional controller on the log of the brightness.  The step is limited to maxStep times (or
+#  1 / maxStep) per update, for when the image is all black or all white and avg doesn't say how far off
+#  it really is, and it waits holdFrames frames after a change for the camera to apply it.
+#
+#  The camera is a backend with a Shutter() and a SetShutter(), so it can be the pi camera or the
+#  SimulatedSensor below (which is what running this file uses).
+#
+#    Example:
+#		exposure = ExposureController(PiCameraBackend(camera), target=params.autoShutter)
+#		...
+#		exposure.target = params.autoShutter
+#		exposure.Update(detector.avg)
+#
+#    Compare it with the old 10% steps on a simulated camera with the lights going up and down:
+#		python AutoExposure.py
+#
+
+# import the necessary packages
+import time
+import cv2
+import numpy as np
+
+
+# the average pixel value of every stride'th pixel in each direction, a stride of 4 only reads 1/16th
+# of the image and is plenty for setting the exposure
+def StridedMean(gray, stride=4):
+	return cv2.mean(gray[::stride, ::stride])[0]
+
+
+# the pi camera, the shutter speed is in microseconds
+class PiCameraBackend(object):
+	def __init__(self, camera):
+		self.camera = camera
+
+	def Shutter(self):
+		return self.camera.shutter_speed
+
+	def SetShutter(self, shutter):
+		self.camera.shutter_speed = int(shutter)
+
+
+# the proportional, log domain exposure controller
+class ExposureController(object):
+	# target is the average pixel value we want, it's left alone when it's within deadband of it.
+	# the shutter is kept between minShutter and maxShutter (33333 is a whole frame at 30 fps).
+	def __init__(self, backend, target=22, gain=0.8, deadband=2, maxStep=4.0, holdFrames=1, minShutter=10, maxShutter=33333):
+		self.backend = backend
+		self.target = target
+		self.gain = gain
+		self.deadband = deadband
+		self.maxStep = maxStep
+		self.holdFrames = holdFrames
+		self.minShutter = minShutter
+		self.maxShutter = maxShutter
+
+		self.hold = 0			# frames left to wait for the last change to show up
+		self.lastAvg = None		# the last average pixel value we were given
+		self.changes = 0		# how many times the shutter was changed
+
+	# is the last average within the deadband of the target?
+	def Settled(self):
+		return self.lastAvg is not None and abs(self.lastAvg - self.target) <= self.deadband
+
+	# the shutter speed to go to from shutter, when the image's average pixel value is avg
+	def NextShutter(self, avg, shutter):
+		# a black image would divide by zero, and the 255 of a white one is only a lower limit
+		ratio = self.target / max(float(avg), 0.5)
+		ratio = min(max(ratio ** self.gain, 1.0 / self.maxStep), self.maxStep)
+		return min(max(shutter * ratio, self.minShutter), self.maxShutter)
+
+	# give it the average pixel value of each frame (a number, or what cv2.mean returns), it sets the
+	# camera's shutter speed and returns it
+	def Update(self, avg):
+		if not np.isscalar(avg):
+			avg = avg[0]
+		self.lastAvg = avg
+		shutter = self.backend.Shutter()
+
+		# wait for the last change to take effect
+		if self.hold > 0:
+			self.hold -= 1
+			return shutter
+		if self.Settled():
+			return shutter
+
+		newShutter = int(round(self.NextShutter(avg, shutter)))
+		if newShutter != shutter:
+			self.backend.SetShutter(newShutter)
+			self.changes += 1
+			self.hold = self.holdFrames
+		return newShutter
+
+
+# the 10% a frame steps the lessons use, for comparing
+class StepController(ExposureController):
+	def NextShutter(self, avg, shutter):
+		inc = max(int(shutter * 0.10), 2)  # if it's less than 2 use 2
+		if avg > self.target:
+			inc = -inc
+		return min(max(shutter + inc, self.minShutter), self.maxShutter)
+
+	def Update(self, avg):
+		# the lessons change it every frame, without waiting
+		self.hold = 0
+		return ExposureController.Update(self, avg)
+
+
+# a pretend camera for testing the controllers without a pi: the pixel values are the scene's brightness
+# times the shutter speed (plus some noise), clipped to 0 - 255.  Like the real camera a new shutter speed
+# only shows up delay frames after it's set.
+class SimulatedSensor(object):
+	def __init__(self, resolution=(320,240), brightness=1.0, shutter=10000, delay=1, noise=1.0, seed=0):
+		w, h = resolution
+		rng = np.random.RandomState(seed)
+		self.brightness = brightness
+		self.noise = noise
+		self.rng = rng
+
+		# a dim, blotchy background with a couple of bright rectangles (the targets' tape) in it
+		scene = cv2.resize(rng.uniform(0.2, 1.0, (h // 16, w // 16)), (w, h), interpolation=cv2.INTER_LINEAR)
+		scene[h // 3:h // 3 + h // 8, w // 5:w // 5 + w // 6] = 8.0
+		scene[h // 2:h // 2 + h // 8, w // 2:w // 2 + w // 6] = 8.0
+		self.scene = (scene * (22.0 / 10000) / scene.mean()).astype(np.float32)	# 22 average at 10000 us
+
+		self.pending = [shutter] * (delay + 1)	# the shutter speeds of the next few frames
+		self.shutter = shutter					# the last shutter speed that was set
+
+	def Shutter(self):
+		return self.shutter
+
+	def SetShutter(self, shutter):
+		self.shutter = shutter
+		self.pending[-1] = shutter
+
+	# the next frame, as a grayscale image
+	def Capture(self):
+		exposure = self.pending.pop(0)
+		self.pending.append(self.pending[-1])
+		image = self.scene * (self.brightness * exposure)
+		if self.noise:
+			image += self.rng.normal(0, self.noise, image.shape).astype(np.float32)
+		return np.clip(image, 0, 255).astype(np.uint8)
+
+
+# turn the simulated lights up and down, and see how long each controller takes to settle
+if __name__ == '__main__':
+	# the brightness of the scene, it changes every 60 frames (a lot darker than 0.33 needs a longer shutter than 30 fps allows)
+	lighting = [1.0, 8.0, 0.4, 3.0, 0.5]
+	framesPerLight = 60
+
+	for name, Controller in (('10% steps', StepController), ('proportional', ExposureController)):
+		sensor = SimulatedSensor(brightness=lighting[0])
+		controller = Controller(sensor, target=22)
+		settleFrames = []
+		outOfBand = 0
+		for brightness in lighting:
+			sensor.brightness = brightness
+			settled = None
+			for i in range(framesPerLight):
+				avg = StridedMean(sensor.Capture())
+				if abs(avg - controller.target) > controller.deadband:
+					outOfBand += 1
+				elif settled is None:
+					settled = i
+				controller.Update(avg)
+			settleFrames.append(settled)
+
+		print('%-13s settled after %s frames, %d of %d frames out of band, %d shutter changes' % (name,
+			', '.join('never' if s is None else str(s) for s in settleFrames), outOfBand, len(lighting) * framesPerLight, controller.changes))
+
+	# the strided mean is a lot cheaper than the whole image's
+	gray = SimulatedSensor((1296,972)).Capture()
+	for stride in (1, 2, 4, 8):
+		t = time.time()
+		for i in range(100):
+			avg = StridedMean(gray, stride)
+		print('stride %d: average %.2f, %.3f ms' % (stride, avg, (time.time() - t) * 10))
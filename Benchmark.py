@@ -0,0 +1,313 @@
+#
+#  Benchmark.py
+#
+#  A reproducible benchmark for the target detector.  It draws synthetic frames with U shaped
+#  Stronghold targets in them (at different resolutions, poses, noise levels and clutter), runs them
+#  through TargetDetector and times each stage of the algorithim:
+#
+#		cvtColor, threshold (or adaptiveThreshold), findContours, earlyReject (the cheap tests before the
+#		hull), convexHull, approxPolyDP, CheckAnglesAndAspect and moments
+#
+#    It reports the p50/p95/p99 latency of each stage (in ms), the frame rate and how many contours each
+#    of the detector's tests rejected (see TargetDetector.RejectionReport()) as JSON.  The frames
+#    are made from a fixed random seed, so two runs on the same computer see exactly the same images.
+#
+#    Examples:
+#		python Benchmark.py                                    # everything, printed to the screen
+#		python Benchmark.py --resolutions 320x240 --out base.json
+#		python Benchmark.py --resolutions 320x240 --compare base.json   # fails if it got slower
+#		python Benchmark.py --threshold adaptive --adaptive-sizes 11,31,55 --engines opencv,integral,box
+#
+
+# import the necessary packages
+import argparse
+import json
+import math
+import sys
+import cv2
+import numpy as np
+from TargetDetector import TargetDetector, DetectorParams, FindContours
+from StageTimer import StageTotals
+from FrameBuffers import FrameBuffers
+from AdaptiveThreshold import AdaptiveThreshold
+
+# the resolutions we benchmark at (the common pi camera values)
+Resolutions = [(240,180), (320,240), (640,480), (1296,972)]
+
+# the stages we time, in the order they run
+Stages = ['cvtColor', 'threshold', 'findContours', 'earlyReject', 'convexHull', 'approxPolyDP', 'CheckAnglesAndAspect', 'moments']
+
+# the Stronghold target is a U made of 2" wide tape, 20" wide and 14" tall.
+# these are the corners of the U in inches, with the opening at the top, centered on (0,0)
+TargetWidth = 20.0
+TargetHeight = 14.0
+TapeWidth = 2.0
+TargetU = np.array([
+	(-10, -7), (-8, -7), (-8, 5), (8, 5), (8, -7), (10, -7), (10, 7), (-10, 7)
+], np.float32)
+
+# the scenes we draw, each one is a different mix of pose, noise and clutter
+Scenes = {
+	'clean':     dict(targets=1, noise=2.0,  clutter=0,  maxRotation=0,  maxSkew=0.0),
+	'posed':     dict(targets=2, noise=4.0,  clutter=0,  maxRotation=10, maxSkew=0.15),
+	'noisy':     dict(targets=1, noise=20.0, clutter=0,  maxRotation=5,  maxSkew=0.1),
+	'cluttered': dict(targets=2, noise=6.0,  clutter=40, maxRotation=5,  maxSkew=0.1),
+}
+
+
+# the current tick count, in milliseconds
+def Millis():
+	return cv2.getTickCount() * 1000.0 / cv2.getTickFrequency()
+
+
+# draws one U shaped target into the image.
+# center is in pixels, width is the width of the target in pixels, rotation is in degrees,
+# and skew squeezes the target horizontally (like looking at it from the side) 0 is head on.
+# returns the 4 outside corners of the target (top-left, top-right, bottom-right, bottom-left)
+def DrawTarget(image, center, width, rotation=0.0, skew=0.0, color=(80,255,80)):
+	scale = width / TargetWidth
+	c = math.cos(math.radians(rotation))
+	s = math.sin(math.radians(rotation))
+	transform = np.array([[c * scale * (1 - skew), -s * scale], [s * scale * (1 - skew), c * scale]], np.float32)
+
+	def Place(points):
+		return points.dot(transform.T) + np.array(center, np.float32)
+
+	u = Place(TargetU)
+	cv2.fillPoly(image, [np.round(u * 16).astype(np.int32)], color, cv2.LINE_AA, 4)
+
+	corners = np.array([(-10, -7), (10, -7), (10, 7), (-10, 7)], np.float32)
+	return Place(corners)
+
+
+# draws random things that aren't targets: lights, specks, bars and squares that are the wrong shape
+def DrawClutter(image, rng, count):
+	h, w = image.shape[:2]
+	for i in range(count):
+		kind = rng.randint(4)
+		color = tuple(int(v) for v in rng.randint(60, 256, 3))
+		x, y = int(rng.randint(w)), int(rng.randint(h))
+		size = max(2, int(rng.uniform(0.005, 0.08) * w))
+		if kind == 0:
+			# a little speck
+			cv2.circle(image, (x, y), max(1, size // 4), color, -1)
+		elif kind == 1:
+			# a long thin bar
+			cv2.line(image, (x, y), (x + size * 3, y + int(rng.randint(-size, size + 1))), color, max(1, size // 6))
+		elif kind == 2:
+			# a solid square (the wrong aspect ratio)
+			cv2.rectangle(image, (x, y), (x + size, y + size), color, -1)
+		else:
+			# a bright light
+			cv2.circle(image, (x, y), size, color, -1)
+
+
+# makes one synthetic frame.  returns the BGR image and a list of the true corners of each target
+def SyntheticFrame(resolution, rng, targets=1, noise=2.0, clutter=0, maxRotation=0, maxSkew=0.0):
+	w, h = resolution
+
+	# a dark background with a little gradient (the camera runs with a short shutter)
+	gradient = np.linspace(10, 35, w, dtype=np.float32)
+	image = np.empty((h, w, 3), np.uint8)
+	image[:] = gradient[np.newaxis, :, np.newaxis].astype(np.uint8)
+
+	DrawClutter(image, rng, clutter)
+
+	truth = []
+	for i in range(targets):
+		width = rng.uniform(0.12, 0.3) * w
+		# keep the whole target in the frame
+		margin = width * 0.75
+		center = (rng.uniform(margin, w - margin), rng.uniform(margin, h - margin))
+		rotation = rng.uniform(-maxRotation, maxRotation)
+		skew = rng.uniform(0, maxSkew)
+		truth.append(DrawTarget(image, center, width, rotation, skew))
+
+	# add some sensor noise
+	if noise > 0:
+		noisy = image.astype(np.float32) + rng.normal(0, noise, image.shape).astype(np.float32)
+		image = np.clip(noisy, 0, 255).astype(np.uint8)
+
+	return image, truth
+
+# makes a list of frames for a scene
+def SyntheticFrames(resolution, scene, count, seed=0):
+	rng = np.random.RandomState(seed)
+	return [SyntheticFrame(resolution, rng, **Scenes[scene]) for i in range(count)]
+
+
+# the stages FilterContours() adds up for each frame
+ContourStages = ['earlyReject', 'convexHull', 'approxPolyDP', 'CheckAnglesAndAspect']
+
+# runs the detector on one image, timing every stage.  times is a dict of stage name -> list,
+# and the ms for this frame are appended to each one.  returns the targets.
+# the per contour tests are the detector's own FilterContours(), timed with a StageTotals
+def TimedDetect(detector, image, times, totals=None):
+	if totals is None:
+		totals = StageTotals(ContourStages)
+	frame = dict((stage, 0.0) for stage in Stages)
+
+	bufs = detector.NextBuffers()
+
+	t = Millis()
+	gray = detector.ToGray(image, bufs and bufs.gray)
+	frame['cvtColor'] = Millis() - t
+
+	t = Millis()
+	threshImg = detector.Threshold(gray, bufs and bufs.binary)
+	frame['threshold'] = Millis() - t
+
+	t = Millis()
+	contours = FindContours(threshImg)
+	frame['findContours'] = Millis() - t
+
+	# the per contour stages are added up over all the contours in the frame
+	totals.Start()
+	finalTargets = detector.FilterContours(contours, totals)
+	frame.update(totals.totals)
+
+	t = Millis()
+	for target in finalTargets:
+		cv2.moments(target)
+	frame['moments'] = Millis() - t
+
+	for stage in Stages:
+		times[stage].append(frame[stage])
+	times['total'].append(sum(frame.values()))
+	return finalTargets
+
+
+# the p50/p95/p99 and mean of a list of times in ms
+def Percentiles(values):
+	values = np.asarray(values, np.float64)
+	p50, p95, p99 = np.percentile(values, [50, 95, 99])
+	return dict(p50=round(p50, 4), p95=round(p95, 4), p99=round(p99, 4), mean=round(values.mean(), 4))
+
+
+# runs one benchmark case and returns it's results as a dict
+# gray=True feeds the detector luma frames, like the pi camera's YUV capture does
+# engine is the adaptive threshold to use: 'opencv' or one of AdaptiveThreshold's engines ('integral', 'box')
+def RunCase(resolution, scene, params, frames=100, seed=0, warmup=5, buffers=False, gray=False, engine='opencv'):
+	images = SyntheticFrames(resolution, scene, frames, seed)
+	if gray:
+		images = [(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), truth) for image, truth in images]
+	adaptiveThreshold = None if engine == 'opencv' else AdaptiveThreshold(resolution, engine)
+	detector = TargetDetector(params, resolution, buffers=FrameBuffers(resolution) if buffers else None, adaptiveThreshold=adaptiveThreshold)
+
+	# warm up the caches (and opencv's thread pool) before we start timing
+	for image, truth in images[:warmup]:
+		detector.Detect(image)
+
+	times = dict((stage, []) for stage in Stages + ['total'])
+	detections = 0
+	detector.ResetRejections()
+	for image, truth in images:
+		detections += len(TimedDetect(detector, image, times))
+
+	stats = dict((stage, Percentiles(times[stage])) for stage in times)
+	return dict(
+		resolution='%dx%d' % resolution,
+		scene=scene,
+		buffers=buffers,
+		gray=gray,
+		engine=engine,
+		params=dict(params.__dict__),
+		frames=frames,
+		detections=detections,
+		targets=sum(len(truth) for image, truth in images),
+		contours=detector.contourCount,
+		rejections=dict(detector.rejections),
+		stages=stats,
+		fps=round(1000.0 / max(stats['total']['mean'], 1e-6), 1),
+	)
+
+
+# a name for a case, used to match up the cases when comparing against an older run
+def CaseKey(case):
+	p = case['params']
+	key = '%s/%s/adaptive=%d/size=%d/thresh=%d' % (case['resolution'], case['scene'], p['useAdaptive'], p['adaptiveSize'], p['thresh'])
+	if case.get('buffers'):
+		key += '/buffers'
+	if case.get('gray'):
+		key += '/gray'
+	if case.get('engine', 'opencv') != 'opencv' and case['params']['useAdaptive']:
+		key += '/' + case['engine']
+	return key
+
+# compares a run to an older one, returns a list of the cases that got slower than the tolerance
+def Compare(results, baseline, tolerance):
+	old = dict((CaseKey(case), case) for case in baseline['cases'])
+	slower = []
+	for case in results['cases']:
+		key = CaseKey(case)
+		if key not in old:
+			continue
+		before = old[key]['stages']['total']['p50']
+		after = case['stages']['total']['p50']
+		if after > before * (1 + tolerance):
+			slower.append('%s: p50 %.3f ms -> %.3f ms' % (key, before, after))
+	return slower
+
+
+# parses '320x240,640x480' into a list of tuples
+def ParseResolutions(text):
+	return [tuple(int(v) for v in r.split('x')) for r in text.split(',')]
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='benchmark the target detector on synthetic frames')
+	parser.add_argument('--resolutions', default=','.join('%dx%d' % r for r in Resolutions), help='comma separated WxH list')
+	parser.add_argument('--scenes', default=','.join(sorted(Scenes)), help='comma separated list of: %s' % ', '.join(sorted(Scenes)))
+	parser.add_argument('--frames', type=int, default=100, help='frames per case')
+	parser.add_argument('--seed', type=int, default=0, help='random seed for the synthetic frames')
+	parser.add_argument('--threshold', default='adaptive,global', help='the threshold modes to run: adaptive, global or both')
+	parser.add_argument('--adaptive-sizes', default='11', help='comma separated adaptiveThreshSize values')
+	parser.add_argument('--thresh', type=int, default=None, help='the threshold value (default is 4 for adaptive, 128 for global)')
+	parser.add_argument('--min-perim', type=int, default=None, help='the minimum perimiter (default scales 100 at 320x240 with the resolution)')
+	parser.add_argument('--buffers', action='store_true', help='write into preallocated FrameBuffers')
+	parser.add_argument('--gray', action='store_true', help='feed the detector gray (luma) frames instead of BGR')
+	parser.add_argument('--engines', default='opencv', help='comma separated adaptive threshold engines: opencv, integral, box')
+	parser.add_argument('--out', help='write the JSON here instead of to the screen')
+	parser.add_argument('--compare', help='an older JSON run to compare against')
+	parser.add_argument('--tolerance', type=float, default=0.20, help='allowed p50 slow down when comparing (0.2 = 20%%)')
+	args = parser.parse_args(argv)
+
+	cases = []
+	for resolution in ParseResolutions(args.resolutions):
+		# scale the minimum perimiter with the resolution, so the same targets are kept at every size
+		minPerim = args.min_perim if args.min_perim is not None else int(100 * resolution[0] / 320.0)
+		for scene in args.scenes.split(','):
+			for mode in args.threshold.split(','):
+				if mode == 'adaptive':
+					sizes = [int(s) for s in args.adaptive_sizes.split(',')]
+					thresh = args.thresh if args.thresh is not None else 4
+				else:
+					sizes = [11]
+					thresh = args.thresh if args.thresh is not None else 128
+				# the engines only matter for the adaptive threshold
+				engines = args.engines.split(',') if mode == 'adaptive' else ['opencv']
+				for size in sizes:
+					for engine in engines:
+						params = DetectorParams(useAdaptive=int(mode == 'adaptive'), adaptiveSize=size, thresh=thresh, minPerim=minPerim)
+						case = RunCase(resolution, scene, params, args.frames, args.seed, buffers=args.buffers, gray=args.gray, engine=engine)
+						sys.stderr.write('%s: %.2f ms p50, %.1f fps\n' % (CaseKey(case), case['stages']['total']['p50'], case['fps']))
+						cases.append(case)
+
+	results = dict(opencv=cv2.__version__, seed=args.seed, cases=cases)
+	text = json.dumps(results, indent=2, sort_keys=True)
+	if args.out:
+		with open(args.out, 'w') as f:
+			f.write(text)
+	else:
+		print(text)
+
+	if args.compare:
+		with open(args.compare) as f:
+			slower = Compare(results, json.load(f), args.tolerance)
+		for line in slower:
+			sys.stderr.write('SLOWER %s\n' % line)
+		if slower:
+			return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
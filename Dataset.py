@@ -0,0 +1,199 @@
+#
+#  Dataset.py
+#
+#  A set of recorded frames with the true corners of every target in them (labels), so the detector can be
+#  scored offline: how many of the real targets it found (recall), how many of the things it found were
+#  real targets (precision), and how far off the centroids and angles of the ones it found are.
+#
+#  A dataset is a folder with two files:
+#		frames.npy		- the frames, a (N,H,W,3) BGR or (N,H,W) gray stack (FrameSource.py can replay it too)
+#		labels.json		- {"version": 1, "resolution": [w, h], "frames": [[target, ...], ...]}, where each target
+#						  is it's 4 outside corners [[x, y], ...] (top-left, top-right, bottom-right, bottom-left)
+#
+#  A detection matches a label when it's centroid is within a quarter of the label's width of the label's
+#  centroid.  The inside and outside edges of the tape are often both found, so a second detection of a
+#  label that was already matched is counted as a duplicate instead of a false positive.
+#
+#    Example:
+#		dataset = Dataset('practice')
+#		score = Evaluate(TargetDetector(params, dataset.resolution), dataset)
+#		print(score['precision'], score['recall'], score['ms'])
+#
+#    Make a dataset out of synthetic frames (see Benchmark.py for the scenes):
+#		python Dataset.py make synthetic --scene posed --frames 100 --resolution 320x240
+#
+
+# import the necessary packages
+import argparse
+import json
+import os
+import sys
+import cv2
+import numpy as np
+from TargetDetector import TargetDetector, DetectorParams, GetAzEl
+
+# the version of the labels we write, and the newest one we can read
+DatasetVersion = 1
+
+
+class Dataset(object):
+	def __init__(self, path):
+		self.path = path
+		with open(os.path.join(path, 'labels.json')) as f:
+			labels = json.load(f)
+		if labels.get('version', 0) > DatasetVersion:
+			raise ValueError('%s is a version %d dataset, this version only reads up to %d' % (path, labels['version'], DatasetVersion))
+
+		# the frames stay in the file until they're used
+		self.frames = np.load(os.path.join(path, 'frames.npy'), mmap_mode='r')
+		self.labels = [[np.array(target, np.float32).reshape(4, 2) for target in frame] for frame in labels['frames']]
+		if len(self.frames) != len(self.labels):
+			raise ValueError('%s has %d frames but %d labels' % (path, len(self.frames), len(self.labels)))
+		self.resolution = tuple(labels.get('resolution', (self.frames.shape[2], self.frames.shape[1])))
+
+	def __len__(self):
+		return len(self.frames)
+
+	# each frame (copied out of the file) and it's labels
+	def __iter__(self):
+		for i in range(len(self.frames)):
+			yield np.array(self.frames[i]), self.labels[i]
+
+
+# write a dataset: frames is a list (or stack) of images, labels is a list of each frame's targets' corners
+def SaveDataset(path, frames, labels):
+	if not os.path.isdir(path):
+		os.makedirs(path)
+	frames = np.asarray(frames, np.uint8)
+	np.save(os.path.join(path, 'frames.npy'), frames)
+	with open(os.path.join(path, 'labels.json'), 'w') as f:
+		json.dump(dict(
+			version=DatasetVersion,
+			resolution=[frames.shape[2], frames.shape[1]],
+			frames=[[np.round(np.asarray(t, np.float64).reshape(4, 2), 2).tolist() for t in frame] for frame in labels],
+		), f)
+
+
+# the centroid of a set of corners, as floats.  the detections are measured with it too, not with
+# GetCentroid() which truncates to whole pixels (that would be most of the error we're trying to measure)
+def Centroid(corners):
+	M = cv2.moments(np.asarray(corners, np.float32).reshape(-1, 1, 2))
+	if M['m00'] == 0:
+		return tuple(np.asarray(corners, np.float32).reshape(-1, 2).mean(axis=0))
+	return (M['m10'] / M['m00'], M['m01'] / M['m00'])
+
+
+# match the targets found in a frame to it's labels, the closest pairs first.  returns a list of
+# (target index, label index, centroid distance) for the matches, and the number of duplicates
+def MatchTargets(targets, labels, gate=0.25):
+	pairs = []
+	for i, target in enumerate(targets):
+		cx, cy = Centroid(target)
+		for j, label in enumerate(labels):
+			lx, ly = Centroid(label)
+			distance = np.hypot(cx - lx, cy - ly)
+			width = np.linalg.norm(label[1] - label[0])
+			if distance <= gate * width:
+				pairs.append((distance, i, j))
+	pairs.sort()
+
+	matches = []
+	usedTargets = set()
+	matchedLabels = set()
+	duplicates = set()
+	for distance, i, j in pairs:
+		if i in usedTargets:
+			continue
+		usedTargets.add(i)
+		if j in matchedLabels:
+			duplicates.add(i)
+			continue
+		matchedLabels.add(j)
+		matches.append((i, j, distance))
+	return matches, len(duplicates)
+
+
+# the precision and recall from the counts
+def PrecisionRecall(truePositives, falsePositives, falseNegatives):
+	precision = truePositives / float(max(truePositives + falsePositives, 1))
+	recall = truePositives / float(max(truePositives + falseNegatives, 1))
+	return precision, recall
+
+
+# the p50/p95/max and mean of a list of values
+def Summary(values):
+	if len(values) == 0:
+		return dict(p50=0.0, p95=0.0, max=0.0, mean=0.0)
+	p50, p95 = np.percentile(values, [50, 95])
+	return dict(p50=float(p50), p95=float(p95), max=float(np.max(values)), mean=float(np.mean(values)))
+
+
+# run the detector over every frame of a dataset, returns a dict with the counts, precision, recall, f1,
+# the centroid error (pixels) and az/el error (degrees, the worse of the two) of the matched targets, and
+# the ms per frame (the mean is 'ms').  warmup frames are run first (and not counted) so the caches are warm.
+def Evaluate(detector, dataset, warmup=2):
+	for i, (image, labels) in enumerate(dataset):
+		if i >= warmup:
+			break
+		detector.Detect(image)
+
+	truePositives = falsePositives = falseNegatives = duplicates = 0
+	times = []
+	centroidErrors = []
+	azElErrors = []
+	for image, labels in dataset:
+		t = cv2.getTickCount()
+		targets = detector.Detect(image)
+		times.append((cv2.getTickCount() - t) / cv2.getTickFrequency() * 1000)
+
+		matches, dups = MatchTargets(targets, labels)
+		truePositives += len(matches)
+		duplicates += dups
+		falsePositives += len(targets) - len(matches) - dups
+		falseNegatives += len(labels) - len(matches)
+
+		for i, j, distance in matches:
+			centroidErrors.append(distance)
+			az, el = GetAzEl(Centroid(targets[i]), detector.resolution, detector.cameraFOV)
+			trueAz, trueEl = GetAzEl(Centroid(labels[j]), detector.resolution, detector.cameraFOV)
+			azElErrors.append(max(abs(az - trueAz), abs(el - trueEl)))
+
+	precision, recall = PrecisionRecall(truePositives, falsePositives, falseNegatives)
+	f1 = 2 * precision * recall / max(precision + recall, 1e-9)
+	latency = Summary(times)
+	return dict(truePositives=truePositives, falsePositives=falsePositives, falseNegatives=falseNegatives,
+		duplicates=duplicates, precision=precision, recall=recall, f1=f1, ms=latency['mean'], latency=latency,
+		centroidError=Summary(centroidErrors), azElError=Summary(azElErrors))
+
+
+def main(argv=None):
+	from Benchmark import SyntheticFrames, Scenes, ParseResolutions
+
+	parser = argparse.ArgumentParser(description='Make or score a labeled dataset.')
+	commands = parser.add_subparsers(dest='command')
+	make = commands.add_parser('make', help='make a dataset out of synthetic frames')
+	make.add_argument('path')
+	make.add_argument('--scene', default='posed', help='one of: %s' % ', '.join(sorted(Scenes)))
+	make.add_argument('--frames', type=int, default=100)
+	make.add_argument('--resolution', default='320x240')
+	make.add_argument('--seed', type=int, default=0)
+	score = commands.add_parser('score', help='score the detector (with the default params) on a dataset')
+	score.add_argument('path')
+	args = parser.parse_args(argv)
+
+	if args.command == 'make':
+		resolution = ParseResolutions(args.resolution)[0]
+		frames = SyntheticFrames(resolution, args.scene, args.frames, args.seed)
+		SaveDataset(args.path, [image for image, truth in frames], [truth for image, truth in frames])
+		print('wrote %d frames to %s' % (len(frames), args.path))
+	elif args.command == 'score':
+		dataset = Dataset(args.path)
+		print(json.dumps(Evaluate(TargetDetector(DetectorParams(), dataset.resolution), dataset), indent=2, sort_keys=True))
+	else:
+		parser.print_help()
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
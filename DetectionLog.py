@@ -0,0 +1,407 @@
+#
+#  DetectionLog.py
+#
+#  A record of what the detector saw during a match: one binary record per frame with it's targets (the
+#  DetectionResult fields, see DetectionResult.py), the average pixel value, the shutter speed and how
+#  long the frame took to get through each stage of the pipeline.  It can also keep every Nth frame,
+#  shrunk down, in a second file next to it (path + '.frames').
+#
+#  Logging never slows the detector down: Log() copies the frame's record into a preallocated ring, and a
+#  background thread writes them to the file.  If the disk falls behind and the ring fills up, the new
+#  records are dropped (and counted) instead of waiting.
+#
+#  Every record is the same size, so the reader doesn't parse anything: it memory maps the file as a
+#  NumPy structured array, and any frame (or column, like every target's az/el) is right there.
+#
+#  The file is a 64 byte header (magic 'SDLOG', version, the record size, the most targets a record
+#  holds, the resolution and field of view, and when the log was started) followed by the records,
+#  all little endian.  The frames file is a header (magic 'SDFRM', version, the image shape) followed by
+#  (seq, timestamp, image) records.
+#
+#    Example:
+#		log = DetectionLog('match1.log', detector.resolution, frameEvery=15, frameScale=0.25)
+#		runner = HeadlessRunner(source, params)
+#		runner.Run(onResult=log.Log)
+#		log.Close()
+#
+#		log = ReadLog('match1.log')
+#		t, az, el = log.AzEl()
+#		counts, edges = log.LatencyHistogram('detected')
+#
+#    From the command line:
+#		python DetectionLog.py record match1.avi match1.log --frame-every 15
+#		python DetectionLog.py show match1.log
+#
+
+# import the necessary packages
+import argparse
+import os
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+from DetectionResult import DetectionResult, TargetDtype
+from TargetDetector import CameraFOV
+
+LogVersion = 1
+
+# the stages the latencies are logged for (ms from the capture, see Frame.Latency())
+Stages = ('arrival', 'detected', 'published', 'sunk')
+
+HeaderDtype = np.dtype([
+	('magic', 'S5'),
+	('version', 'u1'),
+	('maxTargets', '<u2'),
+	('recordSize', '<u4'),
+	('resolution', '<u2', (2,)),
+	('cameraFOV', '<f4', (2,)),
+	('startTime', '<f8'),
+	('reserved', 'u1', (32,)),
+])
+assert HeaderDtype.itemsize == 64
+
+FramesHeaderDtype = np.dtype([
+	('magic', 'S5'),
+	('version', 'u1'),
+	('ndim', 'u1'),
+	('reserved', 'u1'),
+	('shape', '<u4', (3,)),
+])
+
+
+# a frame's record, with room for maxTargets targets
+def RecordDtype(maxTargets):
+	return np.dtype([
+		('seq', '<u4'),
+		('index', '<u4'),
+		('timestamp', '<f8'),					# when it was captured
+		('shutter', '<f4'),						# the exposure time in microseconds (0 if we don't know)
+		('avg', '<f4'),							# the average pixel value
+		('latency', '<f4', (len(Stages),)),		# ms from the capture to each of the Stages (NaN if it didn't get there before it was logged)
+		('found', '<u2'),						# how many targets were found
+		('count', '<u2'),						# how many of them are in targets (no more than maxTargets)
+		('targets', TargetDtype, (maxTargets,)),
+	])
+
+
+# a frame's (shrunk) image
+def FrameDtype(shape):
+	return np.dtype([('seq', '<u4'), ('timestamp', '<f8'), ('image', 'u1', tuple(shape))])
+
+
+# a ring of records that one thread puts in and another one takes out, without ever blocking the one
+# putting them in
+class RecordRing(object):
+	def __init__(self, dtype, size):
+		self.records = np.zeros(size, dtype)
+		self.condition = threading.Condition()
+		self.head = 0		# how many were put in
+		self.tail = 0		# how many were taken out
+		self.dropped = 0	# how many didn't fit
+		self.closed = False
+
+	# the next free record to fill in (a view of it, an array of 1), or None if the ring is full.
+	# call Commit() when it's filled in.
+	def Next(self):
+		if self.head - self.tail >= len(self.records):
+			self.dropped += 1
+			return None
+		i = self.head % len(self.records)
+		return self.records[i:i+1]
+
+	def Commit(self):
+		with self.condition:
+			self.head += 1
+			self.condition.notify()
+
+	# waits for records, returns the ones that are in a row in the ring (call Release(n) when they're
+	# written), or None once it's closed and empty
+	def Take(self):
+		with self.condition:
+			while self.head == self.tail and not self.closed:
+				self.condition.wait()
+			if self.head == self.tail:
+				return None
+			start = self.tail % len(self.records)
+			end = min(start + self.head - self.tail, len(self.records))
+			return self.records[start:end]
+
+	def Release(self, n):
+		with self.condition:
+			self.tail += n
+
+	def Close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify()
+
+
+# writes the log.  ringSize is how many records can wait for the disk.  with frameEvery set, every
+# frameEvery'th frame is kept too, shrunk by frameScale (and in gray if frameGray is set).
+class DetectionLog(object):
+	def __init__(self, path, resolution, cameraFOV=CameraFOV, maxTargets=8, ringSize=256, frameEvery=0, frameScale=0.25, frameGray=True, frameRingSize=8):
+		self.path = path
+		self.maxTargets = maxTargets
+		self.dtype = RecordDtype(maxTargets)
+		self.frameEvery = frameEvery
+		self.frameScale = frameScale
+		self.frameGray = frameGray
+		self.frameRingSize = frameRingSize
+
+		self.file = open(path, 'wb')
+		header = np.zeros(1, HeaderDtype)
+		header['magic'] = b'SDLOG'
+		header['version'] = LogVersion
+		header['maxTargets'] = maxTargets
+		header['recordSize'] = self.dtype.itemsize
+		header['resolution'] = resolution
+		header['cameraFOV'] = cameraFOV
+		header['startTime'] = time.time()
+		self.file.write(header.tobytes())
+
+		self.ring = RecordRing(self.dtype, ringSize)
+		self.frames = None			# the ring of frames, made when the first one is logged (when we know it's size)
+		self.framesFile = None
+		self.detections = DetectionResult(maxTargets)	# for frames that don't have their detections yet
+
+		self.logged = 0		# records logged
+		self.truncated = 0	# records that had more than maxTargets targets
+		self.written = 0	# records written to the file
+
+		self.threads = [threading.Thread(target=self.WriteLoop, args=(self.ring, self.file))]
+		self.threads[0].daemon = True
+		self.threads[0].start()
+
+	# records that were dropped because the disk fell behind
+	@property
+	def dropped(self):
+		return self.ring.dropped
+
+	# frames that were dropped because the disk fell behind
+	@property
+	def droppedFrames(self):
+		return 0 if self.frames is None else self.frames.dropped
+
+	# log a frame, use it as a HeadlessRunner onResult (after any others, so their stamps are in it)
+	def Log(self, frame, targets, detector):
+		record = self.ring.Next()
+		if record is not None:
+			detections = frame.detections
+			if detections is None:
+				detections = self.detections.Fill(targets, detector, frame)
+			count = min(detections.count, self.maxTargets)
+			if count < detections.count:
+				self.truncated += 1
+
+			record['seq'] = frame.seq
+			record['index'] = frame.index
+			record['timestamp'] = frame.timestamp
+			record['shutter'] = frame.shutter or 0
+			record['avg'] = detector.avg[0] if detector.avg is not None else 0
+			latency = record['latency'][0]
+			for i, stage in enumerate(Stages):
+				ms = frame.Latency(stage)
+				latency[i] = np.nan if ms is None else ms
+			record['found'] = detections.count
+			record['count'] = count
+			record['targets'][0, :count] = detections.targets[:count]
+			self.ring.Commit()
+			self.logged += 1
+
+		if self.frameEvery and frame.index % self.frameEvery == 0:
+			self.LogFrame(frame)
+
+	# use it as a Pipeline sink
+	def Sink(self, detector):
+		def Log(result):
+			self.Log(result.frame, result.targets, detector)
+		return Log
+
+	# keep a shrunk copy of the frame
+	def LogFrame(self, frame):
+		if self.frames is not None and self.frames.Next() is None:
+			return
+		image = frame.image
+		h, w = image.shape[:2]
+		size = (max(1, int(w * self.frameScale)), max(1, int(h * self.frameScale)))
+		image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+		if self.frameGray and image.ndim == 3:
+			image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+		if self.frames is None:
+			self.frames = RecordRing(FrameDtype(image.shape), self.frameRingSize)
+			self.framesFile = open(self.path + '.frames', 'wb')
+			header = np.zeros(1, FramesHeaderDtype)
+			header['magic'] = b'SDFRM'
+			header['version'] = LogVersion
+			header['ndim'] = image.ndim
+			header['shape'][0, :image.ndim] = image.shape
+			self.framesFile.write(header.tobytes())
+			thread = threading.Thread(target=self.WriteLoop, args=(self.frames, self.framesFile))
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+		record = self.frames.Next()
+		record['seq'] = frame.seq
+		record['timestamp'] = frame.timestamp
+		record['image'][0] = image
+		self.frames.Commit()
+
+	# the writer thread: writes the records straight out of the ring
+	def WriteLoop(self, ring, f):
+		while True:
+			records = ring.Take()
+			if records is None:
+				break
+			f.write(records.data)
+			f.flush()
+			if ring is self.ring:
+				self.written += len(records)
+			ring.Release(len(records))
+
+	# write what's left and close the files
+	def Close(self):
+		self.ring.Close()
+		if self.frames is not None:
+			self.frames.Close()
+		for thread in self.threads:
+			thread.join()
+		self.file.close()
+		if self.framesFile is not None:
+			self.framesFile.close()
+
+
+# a log opened for reading, the records are memory mapped (a record that was only partly written when
+# the log was cut off is left out)
+class LogReader(object):
+	def __init__(self, path):
+		self.path = path
+		self.header = np.fromfile(path, HeaderDtype, 1)
+		if len(self.header) == 0 or self.header['magic'][0] != b'SDLOG':
+			raise ValueError('%s is not a detection log' % path)
+		self.header = self.header[0]
+		if self.header['version'] > LogVersion:
+			raise ValueError('%s is a version %d log, this version only reads up to %d' % (path, self.header['version'], LogVersion))
+		self.maxTargets = int(self.header['maxTargets'])
+		self.resolution = tuple(int(x) for x in self.header['resolution'])
+		self.cameraFOV = tuple(float(x) for x in self.header['cameraFOV'])
+		self.startTime = float(self.header['startTime'])
+		dtype = RecordDtype(self.maxTargets)
+		if dtype.itemsize != self.header['recordSize']:
+			raise ValueError('%s has %d byte records, expected %d' % (path, self.header['recordSize'], dtype.itemsize))
+
+		self.records = self.Map(path, HeaderDtype.itemsize, dtype)
+		self.frames = None
+		if os.path.exists(path + '.frames'):
+			header = np.fromfile(path + '.frames', FramesHeaderDtype, 1)[0]
+			shape = tuple(int(x) for x in header['shape'][:header['ndim']])
+			self.frames = self.Map(path + '.frames', FramesHeaderDtype.itemsize, FrameDtype(shape))
+
+	@staticmethod
+	def Map(path, offset, dtype):
+		count = (os.path.getsize(path) - offset) // dtype.itemsize
+		if count <= 0:
+			return np.zeros(0, dtype)
+		return np.memmap(path, dtype, 'r', offset, (count,))
+
+	def __len__(self):
+		return len(self.records)
+
+	def __getitem__(self, i):
+		return self.records[i]
+
+	# every logged target's capture time, az and el (the time is repeated for each target in a frame)
+	def AzEl(self):
+		counts = self.records['count']
+		valid = np.arange(self.maxTargets) < counts[:, None]
+		azel = self.records['targets']['azel'][valid]
+		t = np.repeat(self.records['timestamp'], counts)
+		return t, azel[:, 0], azel[:, 1]
+
+	# the latencies (ms) from the capture to one of the Stages, for the frames that got there
+	def Latencies(self, stage):
+		latencies = self.records['latency'][:, Stages.index(stage)]
+		return latencies[~np.isnan(latencies)]
+
+	# a histogram of the latencies to one of the Stages, like np.histogram()
+	def LatencyHistogram(self, stage='detected', bins=20):
+		return np.histogram(self.Latencies(stage), bins)
+
+	# the frames that were dropped on the way (gaps in the sequence numbers), not counting the ones
+	# the log itself dropped
+	def Gaps(self):
+		seq = self.records['seq'].astype(np.int64)
+		return int(np.maximum(np.diff(seq) - 1, 0).sum()) if len(seq) > 1 else 0
+
+
+def ReadLog(path):
+	return LogReader(path)
+
+
+# print a summary of a log, with a text histogram of the capture to detected latency
+def ShowLog(path):
+	log = ReadLog(path)
+	print('%s: %d frames, %dx%d, started %s' % (path, len(log), log.resolution[0], log.resolution[1], time.ctime(log.startTime)))
+	if len(log) == 0:
+		return
+	records = log.records
+	duration = records['timestamp'][-1] - records['timestamp'][0]
+	print('%.1f s, %.1f fps, %d frames missing, %d targets (%d frames had none)' % (duration, (len(log) - 1) / max(duration, 1e-9),
+		log.Gaps(), records['found'].sum(), (records['found'] == 0).sum()))
+	t, az, el = log.AzEl()
+	if len(az):
+		print('az %.1f to %.1f deg, el %.1f to %.1f deg' % (az.min(), az.max(), el.min(), el.max()))
+	for stage in Stages:
+		latencies = log.Latencies(stage)
+		if len(latencies):
+			p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+			print('capture -> %-10s p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms' % (stage, p50, p95, p99))
+	counts, edges = log.LatencyHistogram('detected')
+	if counts.sum():
+		for count, low, high in zip(counts, edges[:-1], edges[1:]):
+			print('%7.2f - %7.2f ms %6d %s' % (low, high, count, '#' * int(50 * count / counts.max())))
+	if log.frames is not None:
+		print('%d frames kept, %s' % (len(log.frames), 'x'.join(str(x) for x in log.frames['image'].shape[1:])))
+
+
+def main(argv=None):
+	from FrameSource import OpenFrameSource
+	from Headless import HeadlessRunner
+
+	parser = argparse.ArgumentParser(description='Record or show a detection log.')
+	commands = parser.add_subparsers(dest='command')
+	record = commands.add_parser('record', help='run the detector on a source and log it')
+	record.add_argument('source', help='a video, an image folder, a .npy stack of frames, or picamera')
+	record.add_argument('path')
+	record.add_argument('--frame-every', type=int, default=0, help='keep every Nth frame')
+	record.add_argument('--frame-scale', type=float, default=0.25)
+	record.add_argument('--frames', type=int, default=None, help='stop after this many frames')
+	show = commands.add_parser('show', help='print a summary of a log')
+	show.add_argument('path')
+	args = parser.parse_args(argv)
+
+	if args.command == 'record':
+		source = OpenFrameSource(args.source, realtime=args.source != 'picamera')
+		runner = HeadlessRunner(source)
+		logs = []
+		def Log(frame, targets, detector):
+			if not logs:
+				logs.append(DetectionLog(args.path, detector.resolution, detector.cameraFOV, frameEvery=args.frame_every, frameScale=args.frame_scale))
+			logs[0].Log(frame, targets, detector)
+		runner.Run(Log, args.frames)
+		if logs:
+			logs[0].Close()
+			print('%d frames logged, %d dropped, %d had more than %d targets' % (logs[0].logged, logs[0].dropped, logs[0].truncated, logs[0].maxTargets))
+		ShowLog(args.path)
+	elif args.command == 'show':
+		ShowLog(args.path)
+	else:
+		parser.print_help()
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
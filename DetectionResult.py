@@ -0,0 +1,212 @@
+#
+#  DetectionResult.py
+#
+#  The targets of a frame in one preallocated NumPy structured array, instead of a list of (4,1,2) contour
+#  arrays that everything downstream computes the centroids, angles and sizes of all over again.
+#
+#  The header (the frame's sequence number, capture time and the number of targets) and the targets are all
+#  in one buffer of bytes, so:
+#		* filling it for a new frame is a handful of vectorized numpy operations, and no Python objects are
+#		  made for each target,
+#		* result.targets is a view of the buffer (targets['azel'][:, 0] is every target's az),
+#		* result.ToBytes() is a view of the buffer too, ready to send or write, and FromBytes() wraps bytes
+#		  back into a DetectionResult without copying them.
+#
+#  The publisher, logger and filter all read the same result.  It's reused for the next frame, so anything
+#  that keeps it around longer has to Copy() it.
+#
+#  Each target has:
+#		corners		- the 4 corners (x, y) in pixels, int32
+#		centroid	- the centroid (x, y) in pixels
+#		azel		- the azmuith and elevation in degrees
+#		width		- the average width of the top and bottom sides in pixels
+#		height		- the average height of the left and right sides in pixels
+#		aspect		- width / height
+#		angleError	- the worst side's angle off horizontal or vertical in degrees
+#		score		- 1 for perfectly square sides and the perfect aspect ratio, down to 0 at the limits
+#
+#  Everything is little endian (the pi's byte order, so no byte swapping) and packed with no padding.
+#
+#    Example:
+#		result = DetectionResult()
+#		for frame in source:
+#			targets = detector.Detect(frame.image)
+#			result.Fill(targets, detector, frame)
+#			for az, el in result.targets['azel']:
+#				...
+#
+
+# import the necessary packages
+import numpy as np
+from TargetDetector import CheckAnglesAndAspectBatch, GetAzEl, CameraFOV, resolution as DefaultResolution
+
+HeaderDtype = np.dtype([
+	('magic', 'S2'),
+	('version', 'u1'),
+	('flags', 'u1'),
+	('seq', '<u4'),			# the frame's sequence number
+	('timestamp', '<f8'),	# when the frame was captured (time.time() seconds)
+	('sendTime', '<f8'),	# when it was sent (set by the publisher)
+	('count', '<u2'),		# how many targets follow
+])
+
+TargetDtype = np.dtype([
+	('corners', '<i4', (4, 2)),
+	('centroid', '<f4', (2,)),
+	('azel', '<f4', (2,)),
+	('width', '<f4'),
+	('height', '<f4'),
+	('aspect', '<f4'),
+	('angleError', '<f4'),
+	('score', '<f4'),
+])
+
+Magic = b'SR'
+Version = 1
+
+# the next corner of each corner, going around the quad
+Next = np.array([1, 2, 3, 0])
+
+
+# the centroids of a (N,4,2) stack of quadrilaterals, the same as cv2.moments() of each one
+# (https://en.wikipedia.org/wiki/Centroid#Of_a_polygon)
+def QuadCentroids(corners):
+	x = corners[:, :, 0]
+	y = corners[:, :, 1]
+	x1 = x[:, Next]
+	y1 = y[:, Next]
+	cross = x * y1 - x1 * y
+	area6 = 3 * cross.sum(axis=1)
+	centroids = np.empty((len(corners), 2))
+	centroids[:, 0] = ((x + x1) * cross).sum(axis=1)
+	centroids[:, 1] = ((y + y1) * cross).sum(axis=1)
+
+	# a degenerate quad has no area, use the average of it's corners
+	degenerate = np.abs(area6) < 1e-9
+	if degenerate.any():
+		area6[degenerate] = 1.0
+		centroids[degenerate] = corners[degenerate].mean(axis=1)
+	centroids /= area6[:, None]
+	return centroids
+
+
+class DetectionResult(object):
+	# maxTargets is how many targets there's room for, it grows if a frame has more (which allocates)
+	def __init__(self, maxTargets=16):
+		self.Allocate(maxTargets)
+
+	def Allocate(self, maxTargets):
+		self.maxTargets = maxTargets
+		self.Wrap(np.zeros(HeaderDtype.itemsize + maxTargets * TargetDtype.itemsize, np.uint8))
+		self.header['magic'] = Magic
+		self.header['version'] = Version
+
+	# point the header and targets views at a buffer
+	def Wrap(self, buffer):
+		self.buffer = buffer
+		self.header = buffer[:HeaderDtype.itemsize].view(HeaderDtype)
+		self.all = buffer[HeaderDtype.itemsize:].view(TargetDtype)
+
+	# the number of targets
+	@property
+	def count(self):
+		return int(self.header['count'][0])
+
+	# a view of just the targets of this frame
+	@property
+	def targets(self):
+		return self.all[:self.count]
+
+	@property
+	def seq(self):
+		return int(self.header['seq'][0])
+
+	@property
+	def timestamp(self):
+		return float(self.header['timestamp'][0])
+
+	@property
+	def sendTime(self):
+		return float(self.header['sendTime'][0])
+
+	def __len__(self):
+		return self.count
+
+	# fill it with a frame's targets (a list of (4,1,2) contours, like Detect() returns).  when they're the
+	# detector's last targets, the sizes and angle errors it already worked out for them are used.  frame is
+	# where the sequence number and capture time come from.  detector can be any detector with params,
+	# resolution and cameraFOV (a TargetDetector, PyramidDetector or RoiTracker).
+	def Fill(self, targets, detector, frame=None):
+		metrics = None
+		if getattr(detector, 'metrics', None) is not None and targets is detector.targets:
+			mask = detector.metrics[0]
+			metrics = (detector.candidateCorners[mask],) + tuple(m[mask] for m in detector.metrics[1:])
+		return self.FillCorners(targets, detector.params, detector.resolution, detector.cameraFOV, frame, metrics)
+
+	# the same as Fill(), without a detector.  the sizes and angle errors come from params (eps, aspect and
+	# aspectTol), or from metrics: the (corners, widths, heights, angleErrors) of the targets if they're known
+	def FillCorners(self, targets, params, resolution=DefaultResolution, cameraFOV=CameraFOV, frame=None, metrics=None):
+		count = len(targets)
+		if count > self.maxTargets:
+			self.Allocate(max(count, 2 * self.maxTargets))
+		header = self.header
+		header['count'] = count
+		header['seq'] = 0 if frame is None else frame.seq
+		header['timestamp'] = 0.0 if frame is None else frame.timestamp
+		header['sendTime'] = 0.0
+		if count == 0:
+			return self
+
+		if metrics is None:
+			corners = np.asarray(targets).reshape(count, 4, 2)
+			mask, widths, heights, angleErrors = CheckAnglesAndAspectBatch(corners, params.eps, params.aspect, params.aspectTol)
+		else:
+			corners, widths, heights, angleErrors = metrics
+			corners = corners.reshape(count, 4, 2)
+
+		t = self.all[:count]
+		t['corners'] = corners
+		centroids = QuadCentroids(corners.astype(np.float64))
+		t['centroid'] = centroids
+		az, el = GetAzEl((centroids[:, 0], centroids[:, 1]), resolution, cameraFOV)
+		t['azel'][:, 0] = az
+		t['azel'][:, 1] = el
+		t['width'] = widths
+		t['height'] = heights
+		t['aspect'] = widths / np.maximum(heights, 1e-6)
+		t['angleError'] = angleErrors
+
+		# how far inside the angle and aspect limits it is
+		expectedHeights = np.maximum(widths / params.aspect, 1e-6)
+		aspectErrors = np.abs(expectedHeights - heights) / expectedHeights
+		t['score'] = np.clip(1 - angleErrors / max(params.eps, 1e-6), 0, 1) * np.clip(1 - aspectErrors / max(params.aspectTol, 1e-6), 0, 1)
+		return self
+
+	# the header and targets as bytes, a view of the buffer (it changes when the result is filled again)
+	def ToBytes(self):
+		return memoryview(self.buffer[:HeaderDtype.itemsize + self.count * TargetDtype.itemsize])
+
+	# a copy that won't change when this one is filled again
+	def Copy(self):
+		copy = DetectionResult.__new__(DetectionResult)
+		copy.maxTargets = self.maxTargets
+		copy.Wrap(self.buffer.copy())
+		return copy
+
+
+# wrap bytes made by ToBytes() back into a (read only) DetectionResult, without copying them.
+# raises ValueError if they aren't a detection result.
+def FromBytes(data):
+	buffer = np.frombuffer(data, np.uint8)
+	if len(buffer) < HeaderDtype.itemsize:
+		raise ValueError('too short for a detection result: %d bytes' % len(buffer))
+	header = buffer[:HeaderDtype.itemsize].view(HeaderDtype)
+	if header['magic'][0] != Magic or header['version'][0] != Version:
+		raise ValueError('not a detection result (magic %r, version %d)' % (header['magic'][0], header['version'][0]))
+	count = int(header['count'][0])
+	if len(buffer) != HeaderDtype.itemsize + count * TargetDtype.itemsize:
+		raise ValueError('%d bytes, expected %d for %d targets' % (len(buffer), HeaderDtype.itemsize + count * TargetDtype.itemsize, count))
+	result = DetectionResult.__new__(DetectionResult)
+	result.maxTargets = count
+	result.Wrap(buffer)
+	return result
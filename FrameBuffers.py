@@ -0,0 +1,115 @@
+#
+#  FrameBuffers.py
+#
+#  A ring of preallocated image buffers, so the frame loop doesn't allocate new images every frame.
+#
+#  Without it every frame gets a new BGR array from the camera, a new gray image from cv2.cvtColor, a new
+#  binary image from cv2.threshold and another color image to draw on.  With it each of those is written
+#  into a buffer that was allocated once (using the dst= argument of the opencv functions), which saves
+#  the pi's limited memory from being churned through 30 times a second.
+#
+#  It's a ring instead of a single set so a frame can still be in use (say by the display thread) while
+#  the next one is being written.  Next() just goes around the ring, which is fine when one loop does
+#  everything with a frame before it gets the next one.  When the frames are handed between threads that
+#  can fall behind (like Pipeline.py) make it with pooled=True instead: Acquire() only gives out sets that
+#  aren't in use, and each one has to be given back with Release() when it's frame is done with.
+#
+#    Example:
+#		buffers = FrameBuffers((320,240), depth=4)
+#		bufs = buffers.Next()
+#		gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=bufs.gray)
+#
+#		pool = FrameBuffers((320,240), depth=5, pooled=True)
+#		bufs = pool.Acquire()		# None if all 5 are in use
+#		...
+#		bufs.Release()
+#
+
+# import the necessary packages
+import collections
+import cv2
+import numpy as np
+
+# the kinds of buffers: their number of channels
+Kinds = {
+	'bgr': 3,			# the image from the camera
+	'gray': 1,			# the grayscale image (or the Y plane from the camera)
+	'binary': 1,		# the thresholded image
+	'annotation': 3,	# the color image we draw on
+	'yuv': 1,			# a whole YUV420 image from the camera, the Y plane is the 'luma' view of it
+}
+
+
+# one set of buffers, each kind is an attribute (bufs.gray, bufs.binary...)
+class BufferSet(object):
+	def __init__(self, resolution, kinds, paddedResolution=None, pool=None):
+		w, h = resolution
+		pw, ph = paddedResolution or resolution
+		self.resolution = resolution
+		self.pool = pool		# the pooled FrameBuffers it's given back to (None for a ring)
+		for kind in kinds:
+			channels = Kinds[kind]
+			shape = (ph, pw) if channels == 1 else (ph, pw, channels)
+			if kind == 'yuv':
+				# the Y plane, followed by the quarter sized U and V planes
+				shape = (ph + ph // 2, pw)
+			# a padded buffer (the pi camera wants widths that are a multiple of 32) and a view of the real image
+			padded = np.zeros(shape, np.uint8)
+			setattr(self, kind + 'Padded', padded)
+			setattr(self, 'luma' if kind == 'yuv' else kind, padded[:h, :w])
+
+	# the BGR image from the 'yuv' buffer, converted when it's asked for
+	def Bgr(self, dst=None):
+		w, h = self.resolution
+		bgr = cv2.cvtColor(self.yuvPadded, cv2.COLOR_YUV2BGR_I420)[:h, :w]
+		if dst is None:
+			return bgr
+		dst[:] = bgr
+		return dst
+
+	# give it back to it's pool, so it can be written over (does nothing for a ring)
+	def Release(self):
+		if self.pool is not None:
+			self.pool.Release(self)
+
+
+# the ring of buffer sets
+class FrameBuffers(object):
+	def __init__(self, resolution, depth=4, kinds=('gray', 'binary', 'annotation'), paddedResolution=None, pooled=False):
+		self.resolution = resolution
+		self.depth = depth
+		self.kinds = kinds
+		self.paddedResolution = paddedResolution
+		self.pooled = pooled
+		self.sets = [BufferSet(resolution, kinds, paddedResolution, self if pooled else None) for i in range(depth)]
+		self.next = 0
+		self.free = collections.deque(self.sets)	# the sets that aren't in use, when pooled
+
+	# the next set of buffers in the ring
+	def Next(self):
+		bufs = self.sets[self.next]
+		self.next = (self.next + 1) % self.depth
+		return bufs
+
+	# a set that isn't in use, or None if they all are.  pooled buffers only
+	def Acquire(self):
+		try:
+			return self.free.popleft()
+		except IndexError:
+			return None
+
+	# give back a set from Acquire()
+	def Release(self, bufs):
+		self.free.append(bufs)
+
+	# the next set to write a frame into: a free one when pooled (None if there aren't any), otherwise the next in the ring
+	def Take(self):
+		if self.pooled:
+			return self.Acquire()
+		return self.Next()
+
+
+# the resolution the pi camera really captures at, it rounds the width up to 32 and the height up to 16
+def CameraPaddedResolution(resolution):
+	w, h = resolution
+	return ((w + 31) // 32 * 32, (h + 15) // 16 * 16)
@@ -0,0 +1,241 @@
+#
+#  FrameRecorder.py
+#
+#  Records the raw frames from the camera to disk at the full frame rate, to make regression datasets
+#  (see Dataset.py) out of real matches.  Writing a frame with cv2.imwrite() right in the capture loop
+#  takes longer than the frame time, so instead:
+#		* Record() copies the frame into the next slot of a preallocated ring and returns right away,
+#		* a background thread writes the ring out a chunk at a time (chunkFrames frames per file), and since
+#		  the ring is a whole number of chunks long each chunk is one contiguous piece of it, saved as it is,
+#		* if the disk falls behind and the ring fills up, new frames are dropped (and counted) instead of
+#		  making the capture loop wait.
+#
+#  A recording is a folder with:
+#		recording.json			- the version, frame shape, chunk size and (once it's closed) the counters
+#		frames_00000.npy		- each chunk's frames, a (N,H,W,3) or (N,H,W) stack
+#		meta_00000.npy			- each chunk's frame metadata (seq, index, capture time, arrival time, shutter)
+#  or with compress=True, chunk_00000.npz files holding both (zlib compressed, lossless, and much smaller
+#  for the mostly black frames we get with the shutter turned down, but slower to write).
+#
+#  Play it back with OpenFrameSource(folder, realtime=True): the frames come out with the same spacing in
+#  time they were captured with, and the same sequence numbers (so the frames that were dropped while
+#  recording are still missing).  The next chunk is loaded (and decompressed) in the background while one
+#  plays, so compressed recordings keep their timing too, as long as a chunk decompresses faster than it
+#  plays (on a slow pi with big chunks the raw format is the safer choice for timing).
+#
+#    Example:
+#		recorder = FrameRecorder('match1')
+#		for frame in OpenFrameSource('picamera', gray=True):
+#			recorder.Record(frame)
+#			...
+#		recorder.Close()
+#
+#    From the command line:
+#		python FrameRecorder.py record picamera match1 --seconds 30 --gray
+#		python FrameRecorder.py replay match1				# replay it in realtime, and check the timing
+#
+
+# import the necessary packages
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+from FrameSource import SequenceMonitor
+
+RecordingVersion = 1
+
+# the metadata of each frame
+MetaDtype = np.dtype([
+	('seq', '<u4'),
+	('index', '<u4'),
+	('timestamp', '<f8'),	# when it was captured
+	('arrival', '<f8'),		# when we got it from the source
+	('shutter', '<f4'),		# the exposure time in microseconds (0 if we didn't know)
+])
+
+
+class FrameRecorder(object):
+	# chunkFrames is how many frames go in each file, ringChunks how many chunks can wait for the disk
+	def __init__(self, path, chunkFrames=64, ringChunks=4, compress=False):
+		self.path = path
+		self.chunkFrames = chunkFrames
+		self.ringChunks = ringChunks
+		self.compress = compress
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+		self.ring = None		# the frames, made when the first one is recorded (when we know it's shape)
+		self.meta = np.zeros(chunkFrames * ringChunks, MetaDtype)
+		self.condition = threading.Condition()
+		self.head = 0			# frames put in the ring
+		self.tail = 0			# frames written out of it
+		self.closed = False
+		self.thread = None
+		self.error = None		# the exception that stopped the writer thread
+
+		self.recorded = 0		# frames recorded
+		self.dropped = 0		# frames dropped because the disk fell behind
+		self.written = 0		# frames written
+		self.chunks = 0			# chunk files written
+		self.maxBacklog = 0		# the most frames that were waiting for the disk
+		self.writeTime = 0.0	# seconds spent writing
+		self.sequence = SequenceMonitor()	# the frames the source dropped
+
+	# the first frame: make the ring and start the writer
+	def Start(self, image):
+		self.ring = np.zeros((self.chunkFrames * self.ringChunks,) + image.shape, np.uint8)
+		self.shape = image.shape
+		self.WriteInfo()
+		self.thread = threading.Thread(target=self.WriteLoop)
+		self.thread.daemon = True
+		self.thread.start()
+
+	# copy a frame into the ring, returns False if it had to be dropped
+	def Record(self, frame):
+		if self.ring is None:
+			self.Start(frame.image)
+		self.sequence.Update(frame.seq)
+
+		backlog = self.head - self.tail
+		if backlog >= len(self.ring) or self.error is not None:
+			self.dropped += 1
+			return False
+		self.maxBacklog = max(self.maxBacklog, backlog + 1)
+
+		i = self.head % len(self.ring)
+		np.copyto(self.ring[i], frame.image)
+		meta = self.meta[i:i+1]
+		meta['seq'] = frame.seq
+		meta['index'] = frame.index
+		meta['timestamp'] = frame.timestamp
+		meta['arrival'] = frame.arrival
+		meta['shutter'] = frame.shutter or 0
+		self.recorded += 1
+
+		with self.condition:
+			self.head += 1
+			if self.head % self.chunkFrames == 0:
+				self.condition.notify()
+		return True
+
+	# use it as a HeadlessRunner onResult
+	def OnResult(self, frame, targets, detector):
+		self.Record(frame)
+
+	# the writer thread: waits for a whole chunk (or the last part of one when we're closing) and writes it.
+	# anything that goes wrong stops it, and is kept in self.error so Record() stops and Close() raises it
+	def WriteLoop(self):
+		try:
+			while True:
+				with self.condition:
+					while self.head - self.tail < self.chunkFrames and not self.closed:
+						self.condition.wait()
+					count = min(self.head - self.tail, self.chunkFrames)
+				if count == 0:
+					break
+
+				start = self.tail % len(self.ring)
+				t = time.time()
+				self.WriteChunk(self.ring[start:start + count], self.meta[start:start + count])
+				self.writeTime += time.time() - t
+				self.written += count
+				self.chunks += 1
+				with self.condition:
+					self.tail += count
+		except Exception as e:
+			self.error = e
+		finally:
+			with self.condition:
+				self.condition.notify_all()
+
+	def WriteChunk(self, frames, meta):
+		name = os.path.join(self.path, '%s_%05d')
+		if self.compress:
+			np.savez_compressed(name % ('chunk', self.chunks) + '.npz', frames=frames, meta=meta)
+		else:
+			np.save(name % ('frames', self.chunks) + '.npy', frames)
+			np.save(name % ('meta', self.chunks) + '.npy', meta)
+
+	def WriteInfo(self):
+		info = dict(version=RecordingVersion, shape=list(getattr(self, 'shape', ())), chunkFrames=self.chunkFrames,
+			compress=self.compress, recorded=self.recorded, dropped=self.dropped, written=self.written,
+			sourceDropped=self.sequence.dropped)
+		with open(os.path.join(self.path, 'recording.json'), 'w') as f:
+			json.dump(info, f, indent=2, sort_keys=True)
+
+	# write what's left, and the counters.  raises the error that stopped the writer, if there was one
+	def Close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify()
+		if self.thread is not None:
+			self.thread.join()
+		if self.ring is not None:
+			self.WriteInfo()
+		if self.error is not None:
+			raise self.error
+
+	def Report(self):
+		return '%d frames recorded, %d written in %d chunks, %d dropped (disk too slow), %d dropped by the source, most waiting %d of %d, %.2f ms per frame to write' % (
+			self.recorded, self.written, self.chunks, self.dropped, self.sequence.dropped, self.maxBacklog,
+			0 if self.ring is None else len(self.ring), self.writeTime * 1000 / max(self.written, 1))
+
+
+def main(argv=None):
+	from FrameSource import OpenFrameSource
+
+	parser = argparse.ArgumentParser(description='Record raw frames, or replay a recording.')
+	commands = parser.add_subparsers(dest='command')
+	record = commands.add_parser('record', help='record the frames of a source')
+	record.add_argument('source', help='a video, an image folder, a .npy stack of frames, or picamera')
+	record.add_argument('path')
+	record.add_argument('--seconds', type=float, default=None, help='stop after this long')
+	record.add_argument('--frames', type=int, default=None, help='stop after this many frames')
+	record.add_argument('--gray', action='store_true', help='record just the luma')
+	record.add_argument('--compress', action='store_true', help='write zlib compressed chunks')
+	record.add_argument('--chunk-frames', type=int, default=64)
+	replay = commands.add_parser('replay', help='replay a recording in realtime and check the timing')
+	replay.add_argument('path')
+	args = parser.parse_args(argv)
+
+	if args.command == 'record':
+		source = OpenFrameSource(args.source, gray=args.gray, maxFrames=args.frames, realtime=args.source != 'picamera')
+		recorder = FrameRecorder(args.path, args.chunk_frames, compress=args.compress)
+		start = time.time()
+		worst = 0
+		for frame in source:
+			t = time.time()
+			recorder.Record(frame)
+			worst = max(worst, time.time() - t)
+			if args.seconds is not None and time.time() - start > args.seconds:
+				break
+		source.Close()
+		recorder.Close()
+		print(recorder.Report())
+		print('the longest Record() took %.2f ms' % (worst * 1000))
+	elif args.command == 'replay':
+		source = OpenFrameSource(args.path, realtime=True)
+		sequence = SequenceMonitor()
+		lateness = []
+		count = 0
+		for frame in source:
+			sequence.Update(frame.seq)
+			lateness.append(frame.Latency('arrival'))
+			count += 1
+		if count == 0:
+			print('no frames in %s' % args.path)
+			return 1
+		p50, p99 = np.percentile(lateness, [50, 99])
+		print('%d frames replayed, %d missing (dropped while recording), frames came %.2f ms late at p50, %.2f ms at p99' % (
+			count, sequence.dropped, p50, p99))
+	else:
+		parser.print_help()
+		return 1
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,511 @@
+#
+#  FrameSource.py
+#
+#  Pluggable sources of frames, so the detector can be fed by something other than the pi camera.
+#  Every source is iterated the same way and gives back Frame objects:
+#
+#		source = OpenFrameSource('match1.avi')		# or 'picamera', a folder of images, or a .npy stack
+#		for frame in source:
+#			targets = detector.Detect(frame.image)
+#
+#    The sources:
+#		PiCameraSource		- the raspberry pi camera, using capture_continuous() like the lessons do
+#		VideoFileSource		- any video file cv2.VideoCapture can read
+#		ImageFolderSource	- a folder of .png / .jpg frames, played back in sorted order
+#		NumpyStackSource	- a .npy file holding a (N,H,W,3) or (N,H,W) stack of frames
+#		RecordingSource		- a folder recorded by FrameRecorder.py
+#
+#    Recorded sources play back as fast as they can be read, unless realtime=True is given, in which case
+#    they are throttled to the frame rate they were recorded at (or the fps argument).  A RecordingSource
+#    knows when each frame was captured, so it plays them back with the same spacing in time.
+#
+#    Give any source gray=True to get single channel (luma) frames.  The detector throws the color away
+#    anyway, so the pi camera then only copies the Y plane of it's YUV output (a third of the memory of BGR,
+#    and no cvtColor), and image folders are decoded straight to grayscale.  The color image is only made
+#    if something asks for it with frame.Bgr(), like the "original image" view.
+#
+#    Every Frame carries it's metadata: the source's sequence number, when it was captured (the pi camera's
+#    sensor timestamp) and arrived, and the shutter speed, so the latency from the photons hitting the sensor
+#    to each later stage can be measured (Frame.Stamp() and Frame.Latency()), and dropped frames found from
+#    the gaps in the sequence numbers (SequenceMonitor).
+#
+#    Run this file directly to replay a source through the detector and print how fast each stage goes:
+#		python FrameSource.py match1.avi
+#
+
+# import the necessary packages
+import json
+import os
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+
+# a single frame from a source, and it's metadata
+class Frame(object):
+	def __init__(self, image, index, timestamp, color=None, seq=None, arrival=None, shutter=None):
+		self.image = image			# the NumPy array of the image (BGR, or just the luma for gray sources)
+		self.index = index			# the frame number, starting at 0
+		self.timestamp = timestamp	# when the frame was captured (time.time() in seconds), from the sensor if we know it
+		self.color = color			# for gray frames, a function(dst) that makes the BGR image (or None)
+		self.seq = index if seq is None else seq					# the source's sequence number, a gap means frames were dropped
+		self.arrival = timestamp if arrival is None else arrival	# when we got it from the source
+		self.shutter = shutter		# the exposure time it was captured with in microseconds (None if we don't know)
+		self.stamps = {}			# when the frame got through each stage, see Stamp()
+		self.detections = None		# the DetectionResult of it's targets, once they're found
+		self.held = []				# the pooled buffer sets (see FrameBuffers.py) it's images are in, see Release()
+
+	# record when the frame got through a stage ('detected', 'published'...), t defaults to now
+	def Stamp(self, stage, t=None):
+		self.stamps[stage] = time.time() if t is None else t
+
+	# ms from the capture to a stage (to the arrival for 'arrival'), None if it hasn't got there
+	def Latency(self, stage):
+		t = self.arrival if stage == 'arrival' else self.stamps.get(stage)
+		if t is None:
+			return None
+		return (t - self.timestamp) * 1000
+
+	# done with the frame: give back the buffers it's images are in, so they can be written over.
+	# after this the image (and anything else that was in those buffers) can change under you
+	def Release(self):
+		held, self.held = self.held, []
+		for bufs in held:
+			bufs.Release()
+
+	# the frame as a BGR image, made only when it's asked for.  dst is an optional buffer to write it into
+	def Bgr(self, dst=None):
+		if self.image.ndim == 3:
+			return self.image
+		if self.color is not None:
+			return self.color(dst)
+		# all we have is the luma, so it'll be a gray BGR image
+		return cv2.cvtColor(self.image, cv2.COLOR_GRAY2BGR, dst=dst)
+
+
+# counts the frames that never showed up, from the gaps in their sequence numbers
+class SequenceMonitor(object):
+	def __init__(self):
+		self.last = None	# the last sequence number
+		self.frames = 0		# frames seen
+		self.dropped = 0	# frames missing between them
+		self.gaps = 0		# how many times frames went missing
+
+	# give it each frame's sequence number, returns how many frames are missing right before it
+	def Update(self, seq):
+		missing = 0
+		if self.last is not None and seq > self.last + 1:
+			missing = seq - self.last - 1
+			self.dropped += missing
+			self.gaps += 1
+		self.last = seq
+		self.frames += 1
+		return missing
+
+
+# the base class of all the sources, it handles the iterating, throttling and looping.
+# a subclass only has to implement Read() (and maybe Close())
+class FrameSource(object):
+	live = False	# does the source make frames on it's own (and drop them if we're too slow)?
+
+	def __init__(self, realtime=False, fps=None, loop=False, maxFrames=None, gray=False):
+		self.realtime = realtime	# throttle playback to fps?
+		self.fps = fps				# the playback rate used when realtime is True
+		self.loop = loop			# start over at the end of a recorded source?
+		self.maxFrames = maxFrames	# stop after this many frames (None means no limit)
+		self.gray = gray			# give single channel (luma) frames?
+		self.color = None			# set by Read() for gray frames that can make their color image later
+
+		# set by Read() for sources that know them, see Frame
+		self.seq = None				# the sensor's frame number
+		self.sensorTime = None		# when the sensor captured the frame (in time.time() seconds)
+		self.shutter = None			# the exposure time it was captured with
+		self.frameTime = None		# set by Read() for recordings: when the frame was captured, realtime playback keeps the same spacing
+		self.bufs = None			# set by Read() for sources that capture into FrameBuffers: the set the image is in
+
+	# returns the next image, or None when there are no more
+	def Read(self):
+		raise NotImplementedError
+
+	# go back to the first frame, returns False if the source can't do that
+	def Rewind(self):
+		return False
+
+	# release anything the source is holding on to
+	def Close(self):
+		pass
+
+	def __iter__(self):
+		index = 0
+		start = time.time()
+		firstFrameTime = None	# the recorded capture time of the first frame, and when we played it
+		firstPlayed = None
+		while self.maxFrames is None or index < self.maxFrames:
+			image = self.Read()
+			if image is None:
+				# at the end, start over if we're looping
+				if self.loop and self.Rewind():
+					firstFrameTime = None
+					image = self.Read()
+				if image is None:
+					break
+
+			# wait until it's time for this frame
+			due = None
+			if self.realtime and self.frameTime is not None:
+				if firstFrameTime is None:
+					firstFrameTime, firstPlayed = self.frameTime, time.time()
+				due = firstPlayed + (self.frameTime - firstFrameTime)
+			elif self.realtime and self.fps:
+				due = start + index / float(self.fps)
+			if due is not None:
+				delay = due - time.time()
+				if delay > 0:
+					time.sleep(delay)
+
+			arrival = time.time()
+			timestamp = arrival if self.sensorTime is None else self.sensorTime
+			if self.frameTime is not None and due is not None:
+				timestamp = due		# a recording is "captured" when it's due, so the arrival latency is how late it was
+			frame = Frame(image, index, timestamp, self.color, self.seq, arrival, self.shutter)
+			if self.bufs is not None:
+				frame.held.append(self.bufs)
+			yield frame
+			index += 1
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.Close()
+
+	# for gray sources, convert a color image that was read to gray, keeping the color for Frame.Bgr()
+	def ToGray(self, image):
+		if not self.gray or image.ndim == 2:
+			self.color = None
+			return image
+		self.color = lambda dst, bgr=image: bgr
+		return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+# an output for capture_continuous() that writes each frame straight into the next buffer of a
+# FrameBuffers ring, instead of into a PiRGBArray that gets truncated and a new array made every frame.
+# kind is the buffer to write into, anything the camera sends past the end of it is thrown away (that's
+# how the 'gray' kind keeps only the Y plane of the camera's YUV420 output)
+# with pooled buffers, when they're all still in use the frame goes into a spare set and skipped is True
+class BufferOutput(object):
+	def __init__(self, buffers, kind='bgr'):
+		self.buffers = buffers
+		self.kind = kind
+		self.spare = None
+		self.skipped = False
+		if buffers.pooled:
+			from FrameBuffers import BufferSet
+			self.spare = BufferSet(buffers.resolution, buffers.kinds, buffers.paddedResolution)
+		self.bufs = None
+
+	# get ready to write the next frame
+	def Start(self):
+		self.bufs = self.buffers.Take()
+		self.skipped = self.bufs is None
+		buffer = getattr(self.spare if self.skipped else self.bufs, self.kind + 'Padded')
+		self.flat = buffer.reshape(-1)
+		self.pos = 0
+
+	# the camera calls this with each piece of the frame
+	def write(self, data):
+		n = len(data)
+		keep = min(n, len(self.flat) - self.pos)
+		if keep > 0:
+			self.flat[self.pos:self.pos + keep] = np.frombuffer(data, np.uint8, keep)
+			self.pos += keep
+		return n
+
+	def flush(self):
+		pass
+
+
+# the raspberry pi camera, set up the same way as in the lessons.
+# give it FrameBuffers with a 'bgr' kind (padded with CameraPaddedResolution) to capture without allocating.
+# with pooled FrameBuffers each frame holds on to it's buffer until Frame.Release(), and when they're all
+# held the camera's frames are skipped (counted in skipped) until one is given back.
+# with gray=True it captures YUV and keeps only the Y plane (in a 'gray' kind buffer), or with keepColor=True
+# the whole YUV420 image (in a 'yuv' kind buffer) so Frame.Bgr() can still make the color image.
+class PiCameraSource(FrameSource):
+	live = True
+
+	def __init__(self, resolution=(320,240), shutterSpeed=10000, buffers=None, keepColor=False, **kwargs):
+		FrameSource.__init__(self, **kwargs)
+		from picamera.array import PiRGBArray
+		from picamera import PiCamera
+		from FrameBuffers import FrameBuffers, CameraPaddedResolution
+
+		# initialize the camera and grab a reference to the raw camera capture
+		self.camera = PiCamera()
+		self.camera.resolution = resolution
+		self.camera.shutter_speed = shutterSpeed
+		self.camera.exposure_mode = 'off'
+
+		self.kind = 'bgr'
+		format = 'bgr'
+		if self.gray:
+			self.kind = 'yuv' if keepColor else 'gray'
+			format = 'yuv'
+			if buffers is None:
+				buffers = FrameBuffers(resolution, kinds=(self.kind,), paddedResolution=CameraPaddedResolution(resolution))
+
+		if buffers is None:
+			self.output = self.rawCapture = PiRGBArray(self.camera, size=resolution)
+		else:
+			self.output = BufferOutput(buffers, self.kind)
+			self.rawCapture = None
+
+		# allow the camera to warmup
+		time.sleep(0.1)
+
+		self.stream = self.camera.capture_continuous(self.output, format=format, use_video_port=True)
+		self.realtime = False	# the camera is already realtime
+		self.skipped = 0		# frames captured into the spare buffer and thrown away, because all the pooled ones were held
+
+	def Read(self):
+		if self.rawCapture is None:
+			# move on to the next buffer in the ring (or a free one in the pool), and capture into it
+			self.output.Start()
+			next(self.stream)
+			while self.output.skipped:
+				self.skipped += 1
+				self.output.Start()
+				next(self.stream)
+			self.ReadInfo()
+			bufs = self.bufs = self.output.bufs
+			if self.kind == 'yuv':
+				self.color = lambda dst, bufs=bufs: bufs.Bgr(dst)
+				return bufs.luma
+			return getattr(bufs, self.kind)
+
+		# Important!  Clear the stream in preparation for the next frame
+		self.rawCapture.truncate(0)
+		frame = next(self.stream)
+		self.ReadInfo()
+		return frame.array
+
+	# the sequence number, capture time and exposure of the frame that was just captured.  the camera's
+	# timestamps are microseconds on the GPU's clock, so they're moved to time.time() by how long ago it was.
+	def ReadInfo(self):
+		info = self.camera.frame
+		self.seq = info.index
+		self.sensorTime = None
+		if info.timestamp is not None:
+			self.sensorTime = time.time() - (self.camera.timestamp - info.timestamp) / 1e6
+		self.shutter = self.camera.exposure_speed
+
+	def Close(self):
+		self.stream.close()
+		self.camera.close()
+
+
+# a video file, read with cv2.VideoCapture
+class VideoFileSource(FrameSource):
+	def __init__(self, path, **kwargs):
+		FrameSource.__init__(self, **kwargs)
+		self.path = path
+		self.capture = cv2.VideoCapture(path)
+		if not self.capture.isOpened():
+			raise IOError('could not open video: %s' % path)
+		if self.fps is None:
+			self.fps = self.capture.get(cv2.CAP_PROP_FPS) or None
+
+	def Read(self):
+		ok, image = self.capture.read()
+		if not ok:
+			return None
+		return self.ToGray(image)
+
+	def Rewind(self):
+		self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+		return True
+
+	def Close(self):
+		self.capture.release()
+
+
+# a folder of image files, played back in sorted order
+class ImageFolderSource(FrameSource):
+	extensions = ('.png', '.jpg', '.jpeg', '.bmp')
+
+	def __init__(self, path, flags=None, **kwargs):
+		FrameSource.__init__(self, **kwargs)
+		if flags is None:
+			# decode straight to gray, jpegs don't even decode the color
+			flags = cv2.IMREAD_GRAYSCALE if self.gray else cv2.IMREAD_COLOR
+		self.path = path
+		self.flags = flags
+		self.files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(self.extensions))
+		if len(self.files) == 0:
+			raise IOError('no images found in: %s' % path)
+		self.next = 0
+
+	def Read(self):
+		if self.next >= len(self.files):
+			return None
+		image = cv2.imread(self.files[self.next], self.flags)
+		if image is None:
+			raise IOError('could not read image: %s' % self.files[self.next])
+		self.next += 1
+		return image
+
+	def Rewind(self):
+		self.next = 0
+		return True
+
+
+# a stack of frames saved with np.save(), it's memory mapped so big stacks don't have to fit in memory
+class NumpyStackSource(FrameSource):
+	def __init__(self, path, **kwargs):
+		FrameSource.__init__(self, **kwargs)
+		self.path = path
+		self.stack = np.load(path, mmap_mode='r')
+		if self.stack.ndim not in (3, 4):
+			raise ValueError('expected a (N,H,W,3) or (N,H,W) stack, got shape %s' % (self.stack.shape,))
+		self.next = 0
+
+	def Read(self):
+		if self.next >= len(self.stack):
+			return None
+		# copy out of the memory map, opencv wants a normal contiguous array
+		image = np.array(self.stack[self.next])
+		self.next += 1
+		return self.ToGray(image)
+
+	def Rewind(self):
+		self.next = 0
+		return True
+
+
+# a folder recorded by FrameRecorder, the chunks are read one at a time (the raw ones are memory mapped)
+class RecordingSource(FrameSource):
+	def __init__(self, path, **kwargs):
+		FrameSource.__init__(self, **kwargs)
+		from FrameRecorder import RecordingVersion
+		self.path = path
+		with open(os.path.join(path, 'recording.json')) as f:
+			self.info = json.load(f)
+		if self.info.get('version', 0) > RecordingVersion:
+			raise ValueError('%s is a version %d recording, this version only reads up to %d' % (path, self.info['version'], RecordingVersion))
+		files = sorted(os.listdir(path))
+		if self.info.get('compress'):
+			self.chunks = [os.path.join(path, f) for f in files if f.startswith('chunk_') and f.endswith('.npz')]
+		else:
+			self.chunks = [os.path.join(path, f) for f in files if f.startswith('frames_') and f.endswith('.npy')]
+		self.Rewind()
+
+	# load a chunk's frames and metadata
+	def LoadChunk(self, i):
+		name = self.chunks[i]
+		if name.endswith('.npz'):
+			with np.load(name) as chunk:
+				return chunk['frames'], chunk['meta']
+		return np.load(name, mmap_mode='r'), np.load(name.replace('frames_', 'meta_', 1))
+
+	# start loading chunk i in the background.  decompressing a .npz chunk takes longer than a frame time, so
+	# it's done while the chunk before it plays instead of in Read(), which would make the first frame of
+	# every chunk late
+	def Prefetch(self, i):
+		self.prefetch = None
+		if i >= len(self.chunks):
+			return
+		box = {}
+		def Load():
+			try:
+				box['chunk'] = self.LoadChunk(i)
+			except Exception as e:
+				box['error'] = e
+		thread = threading.Thread(target=Load)
+		thread.daemon = True
+		thread.start()
+		self.prefetch = (i, thread, box)
+
+	# chunk i's frames and metadata, from the prefetch if it's the one being loaded
+	def TakeChunk(self, i):
+		if self.prefetch is None or self.prefetch[0] != i:
+			return self.LoadChunk(i)
+		_, thread, box = self.prefetch
+		self.prefetch = None
+		thread.join()
+		if 'error' in box:
+			raise box['error']
+		return box['chunk']
+
+	def Read(self):
+		while self.frames is None or self.next >= len(self.frames):
+			if self.chunk + 1 >= len(self.chunks):
+				return None
+			self.chunk += 1
+			self.frames, self.meta = self.TakeChunk(self.chunk)
+			self.next = 0
+			self.Prefetch(self.chunk + 1)
+
+		# copy out of the memory map, opencv wants a normal contiguous array
+		image = np.array(self.frames[self.next])
+		meta = self.meta[self.next]
+		self.next += 1
+		self.seq = int(meta['seq'])
+		self.frameTime = float(meta['timestamp'])
+		self.shutter = float(meta['shutter']) or None
+		return self.ToGray(image)
+
+	def Rewind(self):
+		self.chunk = -1
+		self.frames = None
+		self.meta = None
+		self.next = 0
+		self.Prefetch(0)
+		return True
+
+
+# opens the right kind of source for a name:
+#	'picamera'	- the pi camera
+#	a folder	- a recording (if it has a recording.json), or the images in it
+#	*.npy		- a stack of frames
+#	anything else is handed to cv2.VideoCapture
+def OpenFrameSource(name, **kwargs):
+	if name == 'picamera':
+		return PiCameraSource(**kwargs)
+	if os.path.isdir(name):
+		if os.path.exists(os.path.join(name, 'recording.json')):
+			return RecordingSource(name, **kwargs)
+		return ImageFolderSource(name, **kwargs)
+	if name.lower().endswith('.npy'):
+		return NumpyStackSource(name, **kwargs)
+	return VideoFileSource(name, **kwargs)
+
+
+# replay a source through the detector as fast as possible and print the frame rate
+if __name__ == '__main__':
+	from TargetDetector import TargetDetector
+	from StageTimer import StageTimer
+
+	if len(sys.argv) < 2:
+		print('usage: python FrameSource.py <video | image folder | frames.npy | picamera>')
+		sys.exit(1)
+
+	timer = StageTimer(size=1000)
+	detector = TargetDetector(timer=timer)
+	count = 0
+	detections = 0
+	start = time.time()
+	with OpenFrameSource(sys.argv[1]) as source:
+		timer.Reset()
+		for frame in source:
+			timer.Mark('capture')
+			detections += len(detector.Detect(frame.image))
+			timer.EndFrame()
+			count += 1
+	elapsed = time.time() - start
+
+	if count == 0:
+		print('no frames read')
+		sys.exit(1)
+	print('%d frames in %.2f s: %.1f fps, %d detections' % (count, elapsed, count / elapsed, detections))
+	print(timer.Report())
@@ -0,0 +1,292 @@
+#
+#  Headless.py
+#
+#  Runs the detector with no window at all: no trackbars, no drawing and no cv2.imshow().  This is the
+#  way to run it on the robot, where nobody's looking at the screen, and where drawing the annotations
+#  and pushing them through VNC every frame only steals time from the detector.
+#
+#  The parameters come from a DetectorParams (set them in code, from a profile file, or with --set on the
+#  command line) instead of the trackbars, and the loop is only capture, detect and the auto exposure.  Give it an onResult
+#  function to do something with the targets (like send them to the robot).
+#
+#    Example:
+#		runner = HeadlessRunner(OpenFrameSource('picamera', gray=True), DetectorParams(thresh=6))
+#		runner.Run(onResult=SendToRobot)
+#
+#    From the command line (the source is a video, an image folder, a .npy stack of frames or picamera):
+#		python Headless.py picamera --set thresh=6 --set minPerim=120 --print
+#		python Headless.py picamera --profile practice.json		# reloaded whenever practice.json changes
+#		python Headless.py picamera --log match1.log			# see DetectionLog.py
+#		python Headless.py picamera --record match1			# see FrameRecorder.py, replay it with: python Headless.py match1
+#		python Headless.py picamera --mjpeg 5801			# watch the annotated frames at http://<pi>:5801/ (see MjpegStreamer.py)
+#
+#    Compare it with the GUI loop of 10-TargetDetector.py on the same frames:
+#		python Headless.py match1.avi --benchmark
+#
+
+# import the necessary packages
+import argparse
+import collections
+import sys
+import time
+import cv2
+import numpy as np
+from TargetDetector import TargetDetector, DetectorParams, GetCentroid, GetAzEl, ReadTrackbars, CreateTrackbars
+from FrameSource import OpenFrameSource, SequenceMonitor
+from AutoExposure import ExposureController, PiCameraBackend
+from Profile import LoadProfile, SaveProfile, ProfileWatcher, SetParams
+from DetectionResult import DetectionResult
+from DetectionLog import DetectionLog
+from FrameRecorder import FrameRecorder
+from MjpegStreamer import MjpegStreamer
+
+#some color values we'll be using
+red = (0, 0, 255)
+green = (0, 255, 0)
+blue = (255, 0, 0)
+
+
+# the headless loop
+class HeadlessRunner(object):
+	# if the source has a pi camera, the exposure is controlled with the params.autoShutter target.
+	# without a detector one is made for the size of the first frame.
+	# give it a ProfileWatcher to pick up changes to the profile file while it's running.
+	def __init__(self, source, params=None, detector=None, timer=None, watcher=None):
+		if params is None:
+			params = DetectorParams()
+		params.Validate()
+		self.source = source
+		self.params = params
+		self.detector = detector
+		self.timer = timer
+		self.watcher = watcher
+
+		self.exposure = None
+		if hasattr(source, 'camera'):
+			self.exposure = ExposureController(PiCameraBackend(source.camera), target=params.autoShutter)
+
+		self.frames = 0			# frames detected
+		self.detections = 0		# targets found in them
+		self.elapsed = 0.0		# seconds spent in Run()
+
+		self.result = DetectionResult()						# the targets of the current frame (the frame's detections)
+		self.sequence = SequenceMonitor()					# the frames the source dropped
+		self.latencies = collections.deque(maxlen=300)		# ms from each frame's capture until it was detected
+
+	# the p50/p95/p99 ms from capture to detected
+	def Latency(self):
+		if len(self.latencies) == 0:
+			return (0, 0, 0)
+		return tuple(np.percentile(list(self.latencies), [50, 95, 99]))
+
+	# the frame rate of the last Run()
+	def Fps(self):
+		return self.frames / max(self.elapsed, 1e-9)
+
+	# detect the targets in every frame, calls onResult(frame, targets, detector) for each one.  frame.detections
+	# has the targets too, it's the same DetectionResult every frame so keep a Copy() of it if you need it later.
+	# stops at the end of the source, after maxFrames, or when onResult returns False.
+	def Run(self, onResult=None, maxFrames=None):
+		start = time.time()
+		for frame in self.source:
+			if self.watcher is not None and self.watcher.Poll():
+				# the new params are swapped in all at once
+				self.params = self.watcher.params
+				if self.detector is not None:
+					self.detector.params = self.params
+				sys.stderr.write('reloaded %s\n' % self.watcher.path)
+			if self.detector is None:
+				h, w = frame.image.shape[:2]
+				self.detector = TargetDetector(self.params, (w, h), timer=self.timer)
+			detector = self.detector
+			self.sequence.Update(frame.seq)
+			targets = detector.Detect(frame.image)
+			frame.detections = self.result.Fill(targets, detector, frame)
+			frame.Stamp('detected')
+			self.latencies.append(frame.Latency('detected'))
+			self.frames += 1
+			self.detections += len(targets)
+
+			if self.exposure is not None:
+				self.exposure.target = self.params.autoShutter
+				self.exposure.Update(detector.avg)
+
+			if onResult is not None and onResult(frame, targets, detector) is False:
+				break
+			if maxFrames is not None and self.frames >= maxFrames:
+				break
+		self.elapsed += time.time() - start
+		return self.frames
+
+
+# an onResult that prints the az/el of each target
+def PrintTargets(frame, targets, detector):
+	if frame.detections is not None:
+		angles = ['(%.1f,%.1f)' % (az, el) for az, el in frame.detections.targets['azel']]
+	else:
+		angles = ['(%.1f,%.1f)' % detector.GetAzEl(target) for target in targets]
+	print('%d: %s' % (frame.index, ' '.join(angles)))
+
+
+# draw the targets on the detector's annotation image (the binary image, or the frame itself when drawThresh
+# is 0) like 10-TargetDetector.py does, with some lines of status text in the corner
+def Annotate(frame, targets, detector, lines):
+	drawnImage = detector.AnnotationImage(frame)
+	if drawnImage is frame.image:
+		drawnImage = drawnImage.copy()	# don't draw on the recorded frame
+
+	# draw all the detected hulls, and the angles and a crosshair at the center of each target
+	cv2.drawContours(drawnImage, targets, -1, blue, 3)
+	for target in targets:
+		cx, cy = GetCentroid(target)
+		text = '(%.0f,%0.f)' % GetAzEl((cx, cy), detector.resolution)
+		cv2.putText(drawnImage, text, (cx + 5, cy + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.33, green, 1)
+		cv2.line(drawnImage, (cx-2, cy), (cx+2, cy), red, 1)
+		cv2.line(drawnImage, (cx, cy-2), (cx, cy+2), red, 1)
+
+	# draw some text with status...
+	for i, text in enumerate(lines):
+		cv2.putText(drawnImage, text, (10, 10 + 10 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.33, red, 1)
+	return drawnImage
+
+# the image for the MJPEG stream (see MjpegStreamer.py), it's an onResult's arguments
+def DrawTargets(frame, targets, detector):
+	latency = frame.Latency('detected') or 0
+	lines = ['Latency: %.0f ms' % latency, 'Avg Pixel: %.0f' % detector.avg[0], '# Detections: %d' % len(targets)]
+	return Annotate(frame, targets, detector, lines)
+
+
+# the per frame work the GUI loop of 10-TargetDetector.py does on top of the detection: read the
+# trackbars, draw everything, and show it (when there's a window to show it in)
+def GuiFrame(winName, frame, targets, detector, detectTime):
+	params = detector.params
+	if winName is not None:
+		ReadTrackbars(winName, params)
+
+	lines = ['Detect Time: %.0f ms' % detectTime, 'Avg Pixel: %.0f' % detector.avg[0], '# Detections: %d' % len(targets)]
+	drawnImage = Annotate(frame, targets, detector, lines)
+
+	if winName is not None:
+		cv2.imshow(winName, drawnImage)
+		cv2.waitKey(1)
+	return drawnImage
+
+
+# runs the frames through the GUI loop, returns the frame rate.  If there's no display (or opencv was
+# built without one) the window calls are skipped, so it only counts the drawing.
+def RunGui(frames, params, resolution):
+	winName = 'Target Detect'
+	try:
+		cv2.namedWindow(winName)
+		CreateTrackbars(winName, params)
+	except cv2.error:
+		winName = None
+
+	detector = TargetDetector(params, resolution)
+	start = time.time()
+	for frame in frames:
+		t = time.time()
+		targets = detector.Detect(frame.image)
+		GuiFrame(winName, frame, targets, detector, (time.time() - t) * 1000)
+	elapsed = time.time() - start
+
+	if winName is not None:
+		cv2.destroyWindow(winName)
+	return len(frames) / max(elapsed, 1e-9), winName is not None
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Run the target detector without a GUI.')
+	parser.add_argument('source', help='a video, an image folder, a .npy stack of frames, or picamera')
+	parser.add_argument('--profile', help='load the params from this profile file, and reload them when it changes')
+	parser.add_argument('--save-profile', metavar='PATH', help='save the params (after --profile and --set) to a profile file and exit')
+	parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='set a DetectorParams value (can be repeated)')
+	parser.add_argument('--frames', type=int, default=None, help='stop after this many frames')
+	parser.add_argument('--print', dest='printTargets', action='store_true', help='print the az/el of the targets in every frame')
+	parser.add_argument('--log', metavar='PATH', help='log the targets and timings of every frame to a detection log (see DetectionLog.py)')
+	parser.add_argument('--record', metavar='PATH', help='record the raw frames to a folder (see FrameRecorder.py)')
+	parser.add_argument('--mjpeg', type=int, metavar='PORT', help='stream the annotated frames as MJPEG over HTTP on this port (see MjpegStreamer.py)')
+	parser.add_argument('--benchmark', action='store_true', help='compare the frame rate with the GUI loop')
+	args = parser.parse_args(argv)
+
+	params = DetectorParams()
+	watcher = None
+	if args.profile:
+		LoadProfile(args.profile, params)
+		watcher = ProfileWatcher(args.profile, params)
+	try:
+		params = SetParams(params, args.set)
+	except (AttributeError, ValueError) as e:
+		parser.error(str(e))
+	if args.save_profile:
+		SaveProfile(args.save_profile, params)
+		return 0
+
+	kwargs = dict(gray=True) if args.source == 'picamera' else {}
+	source = OpenFrameSource(args.source, **kwargs)
+
+	if not args.benchmark:
+		runner = HeadlessRunner(source, params, watcher=watcher)
+		logs = []
+		recorder = FrameRecorder(args.record) if args.record else None
+		streamer = None
+		stream = None
+		if args.mjpeg is not None:
+			streamer = MjpegStreamer(port=args.mjpeg).Start()
+			stream = streamer.OnResult(DrawTargets)
+			sys.stderr.write('streaming on http://<this computer>:%d/\n' % streamer.port)
+		def OnResult(frame, targets, detector):
+			if recorder is not None:
+				recorder.Record(frame)
+			if stream is not None:
+				stream(frame, targets, detector)
+			if args.printTargets:
+				PrintTargets(frame, targets, detector)
+			if args.log:
+				if not logs:
+					logs.append(DetectionLog(args.log, detector.resolution, detector.cameraFOV))
+				logs[0].Log(frame, targets, detector)
+		runner.Run(OnResult, args.frames)
+		sys.stderr.write('%d frames, %d detections, %.1f fps, %d dropped by the source\n' % (runner.frames, runner.detections, runner.Fps(), runner.sequence.dropped))
+		sys.stderr.write('capture to detected: p50 %.2f ms, p95 %.2f ms, p99 %.2f ms\n' % runner.Latency())
+		for log in logs:
+			log.Close()
+			sys.stderr.write('%d frames logged to %s, %d dropped\n' % (log.logged, log.path, log.dropped))
+		if recorder is not None:
+			recorder.Close()
+			sys.stderr.write('%s\n' % recorder.Report())
+		if streamer is not None:
+			streamer.Stop()
+			sys.stderr.write('%d frames streamed, %d sent to the clients, %d missed by slow clients\n' % (streamer.encoded, streamer.sent, streamer.missed))
+		return 0
+
+	# a live source never runs out, so it needs a limit
+	if source.live and args.frames is None:
+		source.Close()
+		parser.error('--benchmark with a live source needs --frames')
+
+	# read all the frames first, so neither loop waits on the disk.  the images are copied, a camera
+	# source captures into a ring of buffers that it writes over
+	frames = []
+	for frame in source:
+		frame.image = frame.image.copy()
+		frames.append(frame)
+		if args.frames is not None and len(frames) >= args.frames:
+			break
+	if len(frames) == 0:
+		print('no frames read')
+		return 1
+	h, w = frames[0].image.shape[:2]
+
+	headless = HeadlessRunner(frames, params.Copy(), TargetDetector(params.Copy(), (w, h)))
+	headless.Run()
+	guiFps, shown = RunGui(frames, params.Copy(), (w, h))
+
+	print('headless: %.1f fps' % headless.Fps())
+	print('gui:      %.1f fps%s' % (guiFps, '' if shown else ' (no display, drawing only)'))
+	print('headless is %.0f%% faster' % ((headless.Fps() / guiFps - 1) * 100))
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,311 @@
+#
+#  MjpegStreamer.py
+#
+#  Streams the annotated frames to a web browser as MJPEG over HTTP, so the output can be watched from the
+#  driver station without mirroring the pi's whole desktop through VNC.  Open http://<pi>:5801/ to see it.
+#
+#		detect thread --> Offer() --> [queue of 1] --> encode thread --> latest jpeg --> one thread per client
+#
+#  Nothing the stream does can slow the detector down:
+#		* Offer() only shrinks (by scale) and copies the image, the JPEG encoding happens in it's own thread.
+#		* Only every skip'th frame is offered, and if the encoder is still busy the waiting frame is replaced.
+#		* Every client is sent the newest JPEG when it's ready for one, a slow client just misses frames.
+#		* When a client misses frames the JPEG quality is turned down (to minQuality), and it's turned back up
+#		  to quality when they're all keeping up again.
+#
+#    Example:
+#		streamer = MjpegStreamer(port=5801, quality=50, skip=2, scale=0.5)
+#		streamer.Start()
+#		...
+#		streamer.Offer(drawnImage)		# every frame, after drawing on it
+#
+#    Or let it call a draw function only for the frames it's going to stream (HeadlessRunner.Run() or a Pipeline sink):
+#		runner.Run(onResult=streamer.OnResult(DrawTargets))
+#		python Headless.py picamera --mjpeg 5801
+#
+#    Run this file directly to stream synthetic frames, read them back with a local client (and a slow one),
+#    and print how long Offer() takes and how many frames each client got:
+#		python MjpegStreamer.py
+#
+
+# import the necessary packages
+import socket
+import threading
+import time
+import cv2
+import numpy as np
+from Pipeline import DropOldestQueue
+try:
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+	from socketserver import ThreadingMixIn
+except ImportError:
+	from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+	from SocketServer import ThreadingMixIn
+
+Boundary = 'frame'
+
+Page = '''<html><head><title>Target Detect</title></head>
+<body style="margin:0;background:#000"><img src="/stream" style="width:100%"></body></html>'''
+
+
+class StreamServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+
+# serves the page, the stream and single snapshots
+class StreamHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		streamer = self.server.streamer
+		if self.path == '/':
+			body = Page.encode('ascii')
+			self.send_response(200)
+			self.send_header('Content-Type', 'text/html')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+		elif self.path == '/snapshot.jpg':
+			seq, jpeg = streamer.WaitForJpeg(0, 5.0)
+			if jpeg is None:
+				self.send_error(503, 'no frames yet')
+				return
+			self.send_response(200)
+			self.send_header('Content-Type', 'image/jpeg')
+			self.send_header('Content-Length', str(len(jpeg)))
+			self.end_headers()
+			self.wfile.write(jpeg)
+		elif self.path == '/stream':
+			# a small send buffer, so a slow client blocks us (and misses frames) instead of the frames
+			# piling up in the buffer and getting further and further behind
+			self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, streamer.sendBuffer)
+			self.send_response(200)
+			self.send_header('Cache-Control', 'no-cache')
+			self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=%s' % Boundary)
+			self.end_headers()
+			streamer.Stream(self.wfile)
+		else:
+			self.send_error(404)
+
+	# don't print a line for every request
+	def log_message(self, format, *args):
+		pass
+
+
+class MjpegStreamer(object):
+	# quality is the JPEG quality (0 - 100), skip streams every skip'th frame, scale shrinks the frames
+	# (0.5 is half the width and height).  adaptive turns the quality down to minQuality for slow clients.
+	# sendBuffer is the size of each client's socket send buffer, in bytes
+	def __init__(self, port=5801, quality=50, skip=1, scale=1.0, adaptive=True, minQuality=20, host='', sendBuffer=32768):
+		self.host = host
+		self.sendBuffer = sendBuffer
+		self.port = port
+		self.quality = quality
+		self.skip = max(int(skip), 1)
+		self.scale = scale
+		self.adaptive = adaptive
+		self.minQuality = minQuality
+		self.currentQuality = quality
+
+		self.queue = DropOldestQueue(1)		# the frame waiting to be encoded
+		self.condition = threading.Condition()
+		self.jpeg = None					# the newest JPEG
+		self.seq = 0						# it's number, 0 means there isn't one yet
+		self.running = False
+		self.server = None
+		self.threads = []
+
+		# some statistics
+		self.offered = 0		# frames given to Offer()
+		self.encoded = 0		# frames encoded
+		self.sent = 0			# JPEGs sent to all the clients
+		self.missed = 0			# JPEGs the clients missed because they were too slow
+		self.clients = 0		# clients connected now
+		self.behind = False		# did a client miss a frame since the last encode?
+		self.caughtUp = 0		# encodes in a row with every client keeping up
+
+	# start the encoder and the web server, each in their own thread
+	def Start(self):
+		self.running = True
+		self.server = StreamServer((self.host, self.port), StreamHandler)
+		self.server.streamer = self
+		self.port = self.server.server_address[1]
+		for target in (self.EncodeLoop, self.server.serve_forever):
+			thread = threading.Thread(target=target)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+		return self
+
+	def Stop(self):
+		self.running = False
+		self.queue.Close()
+		with self.condition:
+			self.condition.notify_all()
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
+		for thread in self.threads:
+			thread.join()
+		self.threads = []
+
+	# counts a frame as offered, returns True if it's one to stream (every skip'th one is)
+	def Due(self):
+		self.offered += 1
+		return (self.offered - 1) % self.skip == 0
+
+	# give it an image to stream, call it from the detector's thread.  it never waits.
+	def Offer(self, image):
+		if self.Due():
+			self.Put(image)
+
+	# queue an image for the encoder, without the skip check
+	def Put(self, image):
+		if self.scale != 1.0:
+			image = cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+		else:
+			image = image.copy()	# the caller will draw on it's buffer again
+		self.queue.Put(image)
+
+	# use it as a Pipeline sink, draw(result) returns the image to stream (it's only called for the frames that are)
+	def Sink(self, draw):
+		def Stream(result):
+			if self.Due():
+				self.Put(draw(result))
+		return Stream
+
+	# use it as a HeadlessRunner onResult, draw(frame, targets, detector) returns the image to stream
+	def OnResult(self, draw):
+		def Stream(frame, targets, detector):
+			if self.Due():
+				self.Put(draw(frame, targets, detector))
+		return Stream
+
+	def EncodeLoop(self):
+		while self.running:
+			image = self.queue.Get()
+			if image is None:
+				break
+			with self.condition:
+				self.AdaptQuality()
+			ok, jpeg = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), int(self.currentQuality)])
+			if not ok:
+				continue
+			with self.condition:
+				self.jpeg = jpeg.tobytes()
+				self.seq += 1
+				self.encoded += 1
+				self.condition.notify_all()
+
+	# down 5 when a client fell behind, back up 1 after 10 frames with everyone keeping up (hold the condition)
+	def AdaptQuality(self):
+		if not self.adaptive:
+			self.currentQuality = self.quality
+			return
+		if self.behind:
+			self.behind = False
+			self.caughtUp = 0
+			self.currentQuality = max(self.currentQuality - 5, self.minQuality)
+		else:
+			self.caughtUp += 1
+			if self.caughtUp >= 10:
+				self.caughtUp = 0
+				self.currentQuality = min(self.currentQuality + 1, self.quality)
+
+	# wait up to timeout seconds for a JPEG newer than seq, returns (seq, jpeg), jpeg is None if there wasn't one
+	def WaitForJpeg(self, seq, timeout=None):
+		with self.condition:
+			if timeout is not None:
+				end = time.time() + timeout
+			while self.seq <= seq and self.running:
+				if timeout is None:
+					self.condition.wait()
+				else:
+					remaining = end - time.time()
+					if remaining <= 0:
+						break
+					self.condition.wait(remaining)
+			if self.seq <= seq:
+				return seq, None
+			return self.seq, self.jpeg
+
+	# send the newest JPEG to a client every time there's a new one, until it disconnects
+	def Stream(self, wfile):
+		with self.condition:
+			self.clients += 1
+		seq = 0
+		try:
+			while self.running:
+				newSeq, jpeg = self.WaitForJpeg(seq, 1.0)
+				if jpeg is None:
+					continue
+				# the counters are shared by all the client threads and the encoder
+				if seq and newSeq > seq + 1:
+					with self.condition:
+						self.missed += newSeq - seq - 1
+						self.behind = True
+				seq = newSeq
+				header = '--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % (Boundary, len(jpeg))
+				wfile.write(header.encode('ascii') + jpeg + b'\r\n')
+				wfile.flush()
+				with self.condition:
+					self.sent += 1
+		except (socket.error, IOError):
+			pass	# the client went away
+		finally:
+			with self.condition:
+				self.clients -= 1
+
+
+# reads the JPEGs out of an MJPEG stream, delay is how long to sleep after each one (to act like a slow client)
+def ReadStream(port, frames, delay=0.0, timeout=10.0):
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 32768)	# a small buffer, like a slow network
+	sock.settimeout(timeout)
+	sock.connect(('127.0.0.1', port))
+	sock.sendall(b'GET /stream HTTP/1.0\r\n\r\n')
+	stream = sock.makefile('rb')
+	count = 0
+	while count < frames:
+		line = stream.readline()
+		if not line:
+			break
+		if line.lower().startswith(b'content-length:'):
+			length = int(line.split(b':')[1])
+			stream.readline()
+			jpeg = stream.read(length)
+			if cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR) is not None:
+				count += 1
+			time.sleep(delay)
+	sock.close()
+	return count
+
+
+# stream synthetic frames to a fast and a slow local client
+if __name__ == '__main__':
+	from Benchmark import SyntheticFrames
+
+	images = [image for image, truth in SyntheticFrames((640,480), 'cluttered', 30)]
+	streamer = MjpegStreamer(port=0, quality=60, scale=0.5).Start()
+
+	results = {}
+	def Client(name, frames, delay):
+		results[name] = ReadStream(streamer.port, frames, delay)
+	clients = [threading.Thread(target=Client, args=('fast', 100, 0.0)), threading.Thread(target=Client, args=('slow', 10, 0.2))]
+	for client in clients:
+		client.start()
+
+	# the "detector", offering a frame every 1/30th of a second
+	offerTimes = []
+	for i in range(150):
+		t = time.time()
+		streamer.Offer(images[i % len(images)])
+		offerTimes.append((time.time() - t) * 1000)
+		time.sleep(1 / 30.0)
+	for client in clients:
+		client.join()
+	streamer.Stop()
+
+	print('Offer(): mean %.2f ms, max %.2f ms' % (sum(offerTimes) / len(offerTimes), max(offerTimes)))
+	print('%d offered, %d encoded, %d sent, %d missed by slow clients, quality now %d' %
+		(streamer.offered, streamer.encoded, streamer.sent, streamer.missed, streamer.currentQuality))
+	print('fast client got %d frames, slow client got %d frames' % (results.get('fast', 0), results.get('slow', 0)))
@@ -0,0 +1,267 @@
+#
+#  Pipeline.py
+#
+#  Runs capture, detection and display in their own threads instead of one after another, so the frame
+#  rate is limited by the slowest stage instead of the sum of all of them.  Most of the opencv calls
+#  release the GIL, so the threads really do run at the same time.
+#
+#		capture thread --> [queue] --> detect thread --> [queue] --> sinks (display, network...)
+#
+#  The queues between the stages are small and drop the oldest frame when they're full.  A slow stage
+#  never makes the frames pile up, it just skips the stale ones, so the latency stays bounded.
+#  (recorded sources replaying as fast as they can don't drop frames, capture just waits for detect instead)
+#
+#  Each frame is Release()d once the sinks are done with it (or when it's dropped), which gives back the
+#  pooled FrameBuffers (see FrameBuffers.py) the camera captured it into and the detector drew it's binary
+#  image in.  A slow stage can't have it's frame written over that way, the camera skips frames instead.
+#
+#    Example:
+#		def Show(result):
+#			cv2.imshow('Target Detect', result.frame.image)
+#			return cv2.waitKey(1) & 0xFF != ord('q')		# return False to stop
+#
+#		pipeline = Pipeline(OpenFrameSource('picamera'), TargetDetector(), [Show])
+#		pipeline.Run()		# the sinks run in this thread (cv2.imshow wants the main thread)
+#
+#    Run this file directly to push a recorded source through the pipeline as fast as it can go:
+#		python Pipeline.py match1.avi
+#
+
+# import the necessary packages
+import collections
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+from FrameSource import SequenceMonitor
+from DetectionResult import DetectionResult
+
+
+# a thread safe queue that never blocks the producer.  when it's full, putting a new item drops the oldest one.
+class DropOldestQueue(object):
+	def __init__(self, maxsize=1):
+		self.items = collections.deque()
+		self.maxsize = maxsize
+		self.condition = threading.Condition()
+		self.closed = False
+		self.dropped = 0	# how many items were thrown away because the queue was full
+
+	# add an item, dropping the oldest one if we're full. returns the dropped item (or None)
+	# if block is True it waits for room instead of dropping anything
+	def Put(self, item, block=False):
+		with self.condition:
+			old = None
+			while block and len(self.items) >= self.maxsize and not self.closed:
+				self.condition.wait()
+			if len(self.items) >= self.maxsize:
+				old = self.items.popleft()
+				self.dropped += 1
+			self.items.append(item)
+			self.condition.notify()
+			return old
+
+	# get the oldest item, waiting up to timeout seconds (None waits forever).
+	# returns None if the queue was closed (and is empty) or the timeout ran out
+	def Get(self, timeout=None):
+		with self.condition:
+			if timeout is not None:
+				end = time.time() + timeout
+			while not self.items and not self.closed:
+				if timeout is None:
+					self.condition.wait()
+				else:
+					remaining = end - time.time()
+					if remaining <= 0:
+						return None
+					self.condition.wait(remaining)
+			if self.items:
+				item = self.items.popleft()
+				self.condition.notify_all()		# wake up a blocked Put()
+				return item
+			return None
+
+	# no more items will be put, wakes up everyone waiting in Get()
+	def Close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
+
+	def __len__(self):
+		with self.condition:
+			return len(self.items)
+
+
+# what the detect thread hands to the sinks
+class FrameResult(object):
+	def __init__(self, frame, targets, avg, threshImg, detectTime):
+		self.frame = frame				# the Frame from the source
+		self.targets = targets			# the targets the detector found
+		self.avg = avg					# the average pixel value of the grayscale image
+		self.threshImg = threshImg		# the binary image
+		self.detectTime = detectTime	# how long the detector took in ms
+
+
+# the pipeline.  sinks are functions that take a FrameResult, if one returns False the pipeline stops.
+# result.frame.detections is reused once the sinks are done with it, keep a Copy() if you need it later,
+# and so are the frame's image and result.threshImg when they're in pooled FrameBuffers.
+# queueSize is how many frames can wait between stages (1 keeps the latency lowest)
+# dropFrames says if stale frames are dropped, by default they are for live (or realtime) sources only.
+# latencies is how many frames' capture to detect and capture to sink latencies to keep for LatencyReport().
+class Pipeline(object):
+	def __init__(self, source, detector, sinks=(), queueSize=1, dropFrames=None, latencies=300):
+		if dropFrames is None:
+			dropFrames = source.live or source.realtime
+		self.source = source
+		self.detector = detector
+		self.sinks = list(sinks)
+		self.dropFrames = dropFrames
+
+		self.frames = DropOldestQueue(queueSize)	# capture -> detect
+		self.results = DropOldestQueue(queueSize)	# detect -> sinks
+
+		# the DetectionResults that aren't in use, one for each frame that can be between the detector and the
+		# sinks being done.  they're given back when the sinks are done with them or the frame is dropped.
+		self.freeDetections = collections.deque(DetectionResult() for i in range(queueSize + 2))
+
+		self.stopping = threading.Event()
+		self.threads = []
+
+		self.captured = 0	# frames read from the source
+		self.detected = 0	# frames run through the detector
+		self.sunk = 0		# results handed to the sinks
+
+		# the gaps in the frames' sequence numbers: the ones the source dropped, and the ones that
+		# didn't make it to the sinks (the source's and ours)
+		self.sourceSequence = SequenceMonitor()
+		self.sinkSequence = SequenceMonitor()
+
+		# the ms from each frame's capture until it was detected, and until the sinks were done with it
+		self.detectLatency = collections.deque(maxlen=latencies)
+		self.sinkLatency = collections.deque(maxlen=latencies)
+
+	# how many frames were dropped because a later stage was too slow
+	def Dropped(self):
+		return self.frames.dropped + self.results.dropped
+
+	# the p50/p95/p99 latencies from capture to detected and to the sinks being done, and the dropped frames
+	def LatencyReport(self):
+		lines = []
+		for name, latencies in (('capture -> detected', self.detectLatency), ('capture -> sinks done', self.sinkLatency)):
+			if latencies:
+				p50, p95, p99 = np.percentile(list(latencies), [50, 95, 99])
+				lines.append('%-22s p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms' % (name, p50, p95, p99))
+		lines.append('dropped by the source: %d, before the sinks: %d' % (self.sourceSequence.dropped, self.sinkSequence.dropped))
+		return '\n'.join(lines)
+
+	# the capture thread: reads frames as fast as the source gives them to us
+	def CaptureLoop(self):
+		try:
+			for frame in self.source:
+				if self.stopping.is_set():
+					break
+				self.sourceSequence.Update(frame.seq)
+				dropped = self.frames.Put(frame, block=not self.dropFrames)
+				if dropped is not None:
+					dropped.Release()
+				self.captured += 1
+		finally:
+			self.frames.Close()
+
+	# the detect thread: runs the detector on the newest frame
+	def DetectLoop(self):
+		timer = self.detector.timer
+		try:
+			while not self.stopping.is_set():
+				frame = self.frames.Get()
+				if frame is None:
+					break
+				timer.Mark('capture')
+
+				t = cv2.getTickCount()
+				targets = self.detector.Detect(frame.image)
+				t = cv2.getTickCount() - t
+				detector = self.detector
+				bufs = getattr(detector, 'bufs', None)
+				if bufs is not None:
+					frame.held.append(bufs)
+				detections = self.freeDetections.popleft() if self.freeDetections else DetectionResult()
+				frame.detections = detections.Fill(targets, detector, frame)
+				frame.Stamp('detected')
+				timer.EndFrame()
+
+				result = FrameResult(frame, targets, detector.avg, detector.threshImg, t / cv2.getTickFrequency() * 1000)
+				dropped = self.results.Put(result, block=not self.dropFrames)
+				if dropped is not None:
+					self.freeDetections.append(dropped.frame.detections)
+					dropped.frame.Release()
+				self.detected += 1
+		finally:
+			self.results.Close()
+
+	# start the capture and detect threads
+	def Start(self):
+		self.stopping.clear()
+		for loop in (self.CaptureLoop, self.DetectLoop):
+			thread = threading.Thread(target=loop)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+	# ask the threads to stop and wait for them
+	def Stop(self):
+		self.stopping.set()
+		self.frames.Close()
+		self.results.Close()
+		for thread in self.threads:
+			thread.join()
+		self.threads = []
+		self.source.Close()
+
+	# start the threads and run the sinks in this thread until the source runs out or a sink returns False
+	def Run(self):
+		self.Start()
+		try:
+			while True:
+				result = self.results.Get()
+				if result is None:
+					break
+				keepGoing = True
+				for sink in self.sinks:
+					if sink(result) is False:
+						keepGoing = False
+				self.sunk += 1
+
+				frame = result.frame
+				frame.Stamp('sunk')
+				self.sinkSequence.Update(frame.seq)
+				self.detectLatency.append(frame.Latency('detected'))
+				self.sinkLatency.append(frame.Latency('sunk'))
+				self.freeDetections.append(frame.detections)
+				frame.Release()
+				if not keepGoing:
+					break
+		finally:
+			self.Stop()
+
+
+# push a recorded source through the pipeline as fast as possible and print the frame rate
+if __name__ == '__main__':
+	from FrameSource import OpenFrameSource
+	from TargetDetector import TargetDetector
+	from StageTimer import StageTimer
+
+	if len(sys.argv) < 2:
+		print('usage: python Pipeline.py <video | image folder | frames.npy | picamera>')
+		sys.exit(1)
+
+	timer = StageTimer(size=1000)
+	pipeline = Pipeline(OpenFrameSource(sys.argv[1]), TargetDetector(timer=timer))
+	start = time.time()
+	pipeline.Run()
+	elapsed = time.time() - start
+
+	print('%d captured, %d detected, %d dropped in %.2f s: %.1f fps detected' %
+		(pipeline.captured, pipeline.detected, pipeline.Dropped(), elapsed, pipeline.detected / max(elapsed, 1e-9)))
+	print(timer.Report())
+	print(pipeline.LatencyReport())
@@ -0,0 +1,250 @@
+#
+#  ProcessPoolDetector.py
+#
+#  Runs the detector in several worker processes at once so all the pi's cores are used, which is what
+#  it takes to keep up at high resolutions like 1296x972.
+#
+#  The frames are not pickled and sent to the workers.  Instead they're copied into a block of shared
+#  memory that every worker can see, and only the frame's slot number goes through the queue.  The frames
+#  are handed out round robin (frame 0 to worker 0, frame 1 to worker 1, ...) and the results are put back
+#  in the order the frames were given to us, no matter which worker finishes first.
+#
+#  If the detector raises in a worker, the error is sent back and raised in our process as a WorkerError
+#  (that frame's result is skipped), and if a worker process dies we raise instead of waiting for it forever.
+#
+#    Example:
+#		pool = ProcessPoolDetector(DetectorParams(), resolution=(1296,972), workers=4)
+#		for result in pool.DetectAll(OpenFrameSource('picamera', resolution=(1296,972))):
+#			print(result.frame.index, len(result.targets))
+#		pool.Close()
+#
+#    Run this file directly to compare it with a single process on a recorded source:
+#		python ProcessPoolDetector.py match1.avi 4
+#
+
+# import the necessary packages
+import multiprocessing
+import sys
+import time
+import traceback
+import cv2
+import numpy as np
+try:
+	from queue import Empty
+except ImportError:
+	from Queue import Empty
+from TargetDetector import TargetDetector, DetectorParams
+from Pipeline import FrameResult
+
+
+# raised in our process for an exception in a worker, or a worker that died
+class WorkerError(RuntimeError):
+	pass
+
+
+# the worker process: waits for slot numbers, and runs the detector on the frame in that slot.
+# an exception is sent back as ('error', seq, slot, the traceback) instead of a result.
+def Worker(shared, shape, params, resolution, tasks, results):
+	# opencv's own threads would just fight with the other workers
+	cv2.setNumThreads(1)
+
+	slots = np.frombuffer(shared, np.uint8).reshape(shape)
+	try:
+		detector = TargetDetector(params, resolution)
+	except Exception:
+		results.put(('error', None, None, traceback.format_exc()))
+		return
+
+	while True:
+		task = tasks.get()
+		if task is None:
+			break
+
+		# new parameters
+		if task[0] == 'params':
+			detector.params = task[1]
+			continue
+
+		seq, slot, height, width, channels = task
+		image = slots[slot, :height * width * channels].reshape((height, width, channels) if channels > 1 else (height, width))
+
+		t = cv2.getTickCount()
+		try:
+			targets = detector.Detect(image)
+		except Exception:
+			# bad params can make opencv raise, keep going with the next frame (maybe with new params)
+			results.put(('error', seq, slot, traceback.format_exc()))
+			continue
+		t = cv2.getTickCount() - t
+
+		results.put((seq, slot, targets, detector.avg, t / cv2.getTickFrequency() * 1000))
+
+
+class ProcessPoolDetector(object):
+	# resolution and channels size the shared frame slots, slotsPerWorker is how many frames can be
+	# waiting for each worker (2 lets us copy in the next frame while the worker is busy with this one)
+	def __init__(self, params=None, resolution=(1296,972), workers=None, channels=3, slotsPerWorker=2):
+		if params is None:
+			params = DetectorParams()
+		if workers is None:
+			workers = multiprocessing.cpu_count()
+		self.params = params
+		self.resolution = resolution
+		self.workers = workers
+		self.slotsPerWorker = slotsPerWorker
+
+		# the shared memory, one slot for each frame that can be in flight
+		self.slotSize = resolution[0] * resolution[1] * channels
+		nSlots = workers * slotsPerWorker
+		self.shared = multiprocessing.RawArray('B', nSlots * self.slotSize)
+		self.slots = np.frombuffer(self.shared, np.uint8).reshape((nSlots, self.slotSize))
+
+		# the slots each worker owns that aren't in use
+		self.free = [list(range(w * slotsPerWorker, (w + 1) * slotsPerWorker)) for w in range(workers)]
+
+		self.results = multiprocessing.Queue()
+		self.tasks = []
+		self.processes = []
+		for w in range(workers):
+			tasks = multiprocessing.Queue()
+			process = multiprocessing.Process(target=Worker, args=(self.shared, self.slots.shape, params, resolution, tasks, self.results))
+			process.daemon = True
+			process.start()
+			self.tasks.append(tasks)
+			self.processes.append(process)
+
+		self.nextSeq = 0		# the sequence number of the next frame submitted
+		self.nextResult = 0		# the sequence number of the next result to hand back
+		self.frames = {}		# seq -> the frame, for the frames in flight
+		self.done = {}			# seq -> FrameResult, for results that came back out of order
+
+	# how many frames are in the workers
+	def InFlight(self):
+		return len(self.frames)
+
+	# send new parameters to all the workers, they use them starting with their next frame
+	def SetParams(self, params):
+		self.params = params
+		for tasks in self.tasks:
+			tasks.put(('params', params))
+
+	# wait for one result from the workers (up to timeout seconds), returns False if none came.
+	# raises WorkerError if the detector raised in a worker, or a worker died.
+	def Collect(self, timeout=None):
+		end = None if timeout is None else time.time() + timeout
+		while True:
+			# wait a little at a time, so a dead worker is noticed
+			wait = 0.5 if end is None else max(0, min(0.5, end - time.time()))
+			try:
+				result = self.results.get(timeout=wait)
+				break
+			except Empty:
+				dead = [w for w, process in enumerate(self.processes) if not process.is_alive()]
+				if dead:
+					raise WorkerError('worker %d died (exit code %s)' % (dead[0], self.processes[dead[0]].exitcode))
+				if end is not None and time.time() >= end:
+					return False
+
+		if result[0] == 'error':
+			error, seq, slot, text = result
+			if seq is not None:
+				# give back the slot, and skip the frame's result so the ones after it still come out
+				self.free[seq % self.workers].append(slot)
+				self.frames.pop(seq)
+				self.done[seq] = None
+			raise WorkerError('the detector raised in a worker:\n%s' % text.rstrip())
+
+		seq, slot, targets, avg, detectTime = result
+		self.free[seq % self.workers].append(slot)
+		self.done[seq] = FrameResult(self.frames.pop(seq), targets, avg, None, detectTime)
+		return True
+
+	# give a frame to the next worker. if all of that worker's slots are busy we wait for it
+	def Submit(self, frame):
+		seq = self.nextSeq
+		worker = seq % self.workers
+		while not self.free[worker]:
+			self.Collect()
+		slot = self.free[worker].pop()
+
+		# copy the image into the shared slot
+		image = frame.image
+		size = image.size
+		if size > self.slotSize:
+			raise ValueError('frame of shape %s is bigger than the %s resolution the pool was made for' % (image.shape, self.resolution))
+		np.copyto(self.slots[slot, :size], image.reshape(-1))
+
+		channels = image.shape[2] if image.ndim == 3 else 1
+		self.frames[seq] = frame
+		self.tasks[worker].put((seq, slot, image.shape[0], image.shape[1], channels))
+		self.nextSeq += 1
+
+	# the results that are ready, in order
+	def Ready(self):
+		while self.nextResult in self.done:
+			result = self.done.pop(self.nextResult)
+			self.nextResult += 1
+			if result is not None:
+				yield result
+
+	# wait for every frame in flight, and return their results in order
+	def Flush(self):
+		while self.frames:
+			self.Collect()
+		return list(self.Ready())
+
+	# run every frame of a source through the pool, yields the FrameResults in order
+	def DetectAll(self, source):
+		for frame in source:
+			self.Submit(frame)
+			# grab anything that's finished without waiting
+			while self.Collect(timeout=0):
+				pass
+			for result in self.Ready():
+				yield result
+		for result in self.Flush():
+			yield result
+
+	# stop the workers
+	def Close(self):
+		for tasks in self.tasks:
+			tasks.put(None)
+		for process in self.processes:
+			process.join()
+		self.processes = []
+
+
+# compare one process with a pool on a recorded source
+if __name__ == '__main__':
+	from FrameSource import OpenFrameSource
+
+	if len(sys.argv) < 2:
+		print('usage: python ProcessPoolDetector.py <video | image folder | frames.npy> [workers]')
+		sys.exit(1)
+	workers = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+
+	# read all the frames first, so we only time the detecting
+	frames = list(OpenFrameSource(sys.argv[1]))
+	if len(frames) == 0:
+		print('no frames read')
+		sys.exit(1)
+	h, w = frames[0].image.shape[:2]
+	channels = frames[0].image.shape[2] if frames[0].image.ndim == 3 else 1
+	params = DetectorParams(minPerim=int(100 * w / 320.0))
+
+	detector = TargetDetector(params, (w, h))
+	start = time.time()
+	single = [detector.Detect(frame.image) for frame in frames]
+	elapsed = time.time() - start
+	print('1 process:   %d frames in %.2f s, %.1f fps' % (len(frames), elapsed, len(frames) / elapsed))
+
+	pool = ProcessPoolDetector(params, (w, h), workers, channels)
+	start = time.time()
+	results = list(pool.DetectAll(frames))
+	elapsed = time.time() - start
+	pool.Close()
+	print('%d processes: %d frames in %.2f s, %.1f fps' % (workers, len(results), elapsed, len(results) / elapsed))
+
+	# make sure we got the same answers, in the same order
+	same = all(r.frame is f and len(r.targets) == len(t) for r, f, t in zip(results, frames, single))
+	print('results match: %s' % same)
@@ -0,0 +1,138 @@
+#
+#  Profile.py
+#
+#  Saves the tuned DetectorParams to a JSON file, so the values found with the trackbars aren't lost when
+#  the program exits, and the headless runtime can use them without any trackbars at all.
+#
+#  A profile file looks like this (any parameter that's left out keeps it's default):
+#		{
+#		  "version": 1,
+#		  "name": "practice field",
+#		  "params": {"thresh": 6, "minPerim": 120, "aspect": 1.6, ...}
+#		}
+#
+#  LoadProfile() sets the values of the DetectorParams that's passed in, and SetParams() does the same for
+#  the name=value strings of the --set command line options (with the same checks).  A ProfileWatcher reloads the file
+#  whenever it changes into a new DetectorParams (watcher.params), checked and fixed up before anything sees
+#  it, so hand it to the detector with one assignment (detector.params = watcher.params) and a detector
+#  running in another thread (like the pipeline's) never sees half of the new values.
+#
+#    Example:
+#		params = LoadProfile('practice.json')
+#		watcher = ProfileWatcher('practice.json', params)
+#		...
+#		if watcher.Poll():	# every frame, it only looks at the file once a second
+#			detector.params = watcher.params
+#
+#		SaveProfile('practice.json', params, 'practice field')
+#
+
+# import the necessary packages
+import json
+import os
+import time
+from TargetDetector import DetectorParams
+
+# the version of the profile files we write, and the newest one we can read
+ProfileVersion = 1
+
+
+# set the values in params (in place) from a dict of parameter names and values
+def ApplyParams(params, values):
+	for name, value in values.items():
+		if not hasattr(params, name):
+			raise AttributeError('unknown detector parameter: %s' % name)
+	for name, value in values.items():
+		setattr(params, name, value)
+	return params.Validate()
+
+
+# set the values in params (in place) from a list of 'name=value' strings, like the --set arguments.
+# values with a '.' are floats, the rest are ints
+def SetParams(params, settings):
+	values = {}
+	for setting in settings:
+		if '=' not in setting:
+			raise ValueError('expected name=value, got %s' % setting)
+		name, value = setting.split('=', 1)
+		values[name] = float(value) if '.' in value else int(value)
+	return ApplyParams(params, values)
+
+
+# read a profile file, returns it's name and parameter values
+def ReadProfile(path):
+	with open(path) as f:
+		profile = json.load(f)
+	if not isinstance(profile, dict):
+		raise ValueError('%s is not a profile' % path)
+
+	# version 0 is just the parameters, with no version or name
+	version = profile.get('version', 0)
+	if version == 0:
+		return os.path.basename(path), profile
+	if version > ProfileVersion:
+		raise ValueError('%s is a version %d profile, this version only reads up to %d' % (path, version, ProfileVersion))
+	return profile.get('name', os.path.basename(path)), profile.get('params', {})
+
+
+# load a profile into params (or new default params), returns the params
+def LoadProfile(path, params=None):
+	if params is None:
+		params = DetectorParams()
+	name, values = ReadProfile(path)
+	return ApplyParams(params, values)
+
+
+# save the params to a profile file.  it's written to a temporary file first and then renamed, so a
+# ProfileWatcher (or a crash) never sees half a file.
+def SaveProfile(path, params, name=None):
+	profile = dict(version=ProfileVersion, name=name or os.path.basename(path), params=dict(params.__dict__))
+	temp = path + '.tmp'
+	with open(temp, 'w') as f:
+		json.dump(profile, f, indent=2, sort_keys=True)
+		f.write('\n')
+	os.rename(temp, path)
+
+
+# reloads a profile whenever the file changes, into a copy of params with the new values (watcher.params)
+class ProfileWatcher(object):
+	# interval is how often (in seconds) to look at the file's modification time
+	def __init__(self, path, params, interval=1.0):
+		self.path = path
+		self.params = params
+		self.interval = interval
+		self.mtime = self.ModificationTime()
+		self.lastCheck = time.time()
+
+		self.reloads = 0		# how many times it was reloaded
+		self.error = None		# why the last reload failed (the old values are kept)
+
+	def ModificationTime(self):
+		try:
+			return os.stat(self.path).st_mtime
+		except OSError:
+			return None
+
+	# call it every frame, returns True when the params were reloaded (watcher.params is then a new object)
+	def Poll(self):
+		now = time.time()
+		if now - self.lastCheck < self.interval:
+			return False
+		self.lastCheck = now
+
+		mtime = self.ModificationTime()
+		if mtime is None or mtime == self.mtime:
+			return False
+		self.mtime = mtime
+
+		# check the whole file before changing anything, so a bad edit doesn't leave half the values changed
+		try:
+			name, values = ReadProfile(self.path)
+			params = ApplyParams(self.params.Copy(), values)
+		except (IOError, OSError, ValueError, AttributeError) as e:
+			self.error = str(e)
+			return False
+		self.params = params
+		self.error = None
+		self.reloads += 1
+		return True
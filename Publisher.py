@@ -0,0 +1,199 @@
+#
+#  Publisher.py
+#
+#  Sends the targets found in every frame to the robot controller over UDP, one small binary packet per
+#  frame.  UDP because a late packet is worthless to the robot: it's never resent, and sending never
+#  waits on the network (if the network can't take it right now the packet is dropped and counted).
+#
+#  A packet is the bytes of a DetectionResult (see DetectionResult.py), sent just as they are: a header with
+#  the frame sequence number, capture time, send time and the number of targets, followed by a record for
+#  each target with it's corners, centroid, az/el, width, height, aspect, angle error and a score from 0 to 1
+#  of how well it matches the angle and aspect tests.  Everything is little endian and packed.
+#
+#  The UdpReceiver is the other end, for testing without a robot (or for a coprocessor of your own).
+#
+#    Example:
+#		publisher = UdpPublisher(('10.1.2.2', 5800))
+#		runner = HeadlessRunner(source, params)
+#		runner.Run(onResult=publisher.Publish)
+#
+#    From the command line:
+#		python Publisher.py receive 5800						# print the packets sent to port 5800
+#		python Publisher.py match1.avi 10.1.2.2:5800			# publish the targets from a recording
+#		python Publisher.py match1.avi							# publish to a local receiver, and time it
+#
+
+# import the necessary packages
+import collections
+import errno
+import socket
+import sys
+import threading
+import time
+import numpy as np
+from FrameSource import SequenceMonitor
+from DetectionResult import DetectionResult, FromBytes, HeaderDtype, TargetDtype
+
+# the most targets in one packet, it keeps the packet under the 576 bytes every network will carry
+MaxTargets = (576 - 28 - HeaderDtype.itemsize) // TargetDtype.itemsize
+
+# the port the robot listens on, the FRC rules leave 5800 - 5810 open for teams
+DefaultPort = 5800
+
+
+# makes a packet out of a DetectionResult, sendTime (which is written into it's header) defaults to now.
+# the packet is a view of the result's buffer, unless it has more than MaxTargets targets.
+def Pack(detections, sendTime=None):
+	if sendTime is None:
+		sendTime = time.time()
+	if detections.count > MaxTargets:
+		detections = detections.Copy()
+		detections.header['count'] = MaxTargets
+	detections.header['sendTime'] = sendTime
+	return detections.ToBytes()
+
+
+# reads a packet back into a dict with the frame's index, captureTime, sendTime, and it's targets (a
+# structured array, see DetectionResult.py).  raises ValueError if it isn't one of ours
+def Unpack(data):
+	detections = FromBytes(data)
+	return dict(index=detections.seq, captureTime=detections.timestamp, sendTime=detections.sendTime,
+		targets=detections.targets, detections=detections)
+
+
+# sends a packet for every frame
+class UdpPublisher(object):
+	# latencies is how many capture to send latencies to keep
+	def __init__(self, address=('127.0.0.1', DefaultPort), latencies=300):
+		self.address = address
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.setblocking(False)
+
+		self.sent = 0			# packets sent
+		self.dropped = 0		# packets the network wouldn't take
+		self.latencies = collections.deque(maxlen=latencies)	# capture to send, in ms
+		self.detections = DetectionResult(MaxTargets)	# for frames that don't have their detections yet
+
+	# publish a frame's targets, use it as a HeadlessRunner onResult.  it sends frame.detections, the
+	# targets are only used if the frame doesn't have them.  the frame is stamped 'published'.
+	def Publish(self, frame, targets, detector):
+		detections = frame.detections
+		if detections is None:
+			detections = self.detections.Fill(targets, detector, frame)
+		sendTime = time.time()
+		try:
+			self.sock.sendto(Pack(detections, sendTime), self.address)
+		except socket.error as e:
+			if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+				raise
+			self.dropped += 1
+			return
+		self.sent += 1
+		frame.Stamp('published', sendTime)
+		self.latencies.append(frame.Latency('published'))
+
+	# use it as a Pipeline sink, detector is needed for the params and the az/el
+	def Sink(self, detector):
+		def Publish(result):
+			self.Publish(result.frame, result.targets, detector)
+		return Publish
+
+	# the p50/p95/p99 capture to send latency, in ms
+	def Latency(self):
+		if len(self.latencies) == 0:
+			return (0, 0, 0)
+		return tuple(np.percentile(list(self.latencies), [50, 95, 99]))
+
+	def Close(self):
+		self.sock.close()
+
+
+# receives the packets, to test the publisher without a robot
+class UdpReceiver(object):
+	def __init__(self, port=DefaultPort, host=''):
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.sock.bind((host, port))
+		self.port = self.sock.getsockname()[1]
+
+		self.received = 0		# good packets
+		self.bad = 0			# packets that weren't ours
+		self.sequence = SequenceMonitor()	# the gaps in the frame sequence numbers
+
+	# the next packet as a dict (see Unpack), with the time it was received added as 'receiveTime',
+	# or None if nothing came within timeout seconds
+	def Receive(self, timeout=None):
+		self.sock.settimeout(timeout)
+		while True:
+			try:
+				data = self.sock.recv(65536)
+			except socket.timeout:
+				return None
+			receiveTime = time.time()
+			try:
+				packet = Unpack(data)
+			except ValueError:
+				self.bad += 1
+				continue
+			packet['receiveTime'] = receiveTime
+			self.sequence.Update(packet['index'])
+			self.received += 1
+			return packet
+
+	def Close(self):
+		self.sock.close()
+
+
+# a receiver that prints every packet
+def ReceiveForever(port):
+	receiver = UdpReceiver(port)
+	print('listening on port %d' % receiver.port)
+	while True:
+		packet = receiver.Receive()
+		targets = packet['targets']
+		angles = ' '.join('(%.1f,%.1f %.2f)' % (az, el, score) for (az, el), score in zip(targets['azel'], targets['score']))
+		print('%d: %.1f ms capture to receive, %d frames dropped so far: %s' % (packet['index'],
+			(packet['receiveTime'] - packet['captureTime']) * 1000, receiver.sequence.dropped, angles))
+
+
+if __name__ == '__main__':
+	from FrameSource import OpenFrameSource
+	from Headless import HeadlessRunner
+
+	if len(sys.argv) < 2:
+		print('usage: python Publisher.py receive [port]')
+		print('       python Publisher.py <video | image folder | frames.npy | picamera> [host:port]')
+		sys.exit(1)
+
+	if sys.argv[1] == 'receive':
+		ReceiveForever(int(sys.argv[2]) if len(sys.argv) > 2 else DefaultPort)
+
+	# with no address, publish to a receiver in this process on a free port
+	receiver = None
+	if len(sys.argv) > 2:
+		host, port = sys.argv[2].rsplit(':', 1)
+		address = (host, int(port))
+	else:
+		receiver = UdpReceiver(0, '127.0.0.1')
+		address = ('127.0.0.1', receiver.port)
+		received = []
+		def Receive():
+			while True:
+				packet = receiver.Receive(1.0)
+				if packet is None:
+					break
+				received.append((packet['receiveTime'] - packet['captureTime']) * 1000)
+		thread = threading.Thread(target=Receive)
+		thread.daemon = True
+		thread.start()
+
+	publisher = UdpPublisher(address)
+	source = OpenFrameSource(sys.argv[1], realtime=True, fps=30)
+	runner = HeadlessRunner(source)
+	runner.Run(onResult=publisher.Publish)
+
+	print('%d packets sent, %d dropped, capture to send p50 %.2f ms, p95 %.2f ms, p99 %.2f ms' % ((publisher.sent, publisher.dropped) + publisher.Latency()))
+	if receiver is not None:
+		thread.join()
+		if received:
+			print('%d packets received, %d lost, capture to receive p50 %.2f ms, p95 %.2f ms, p99 %.2f ms' %
+				((receiver.received, receiver.sequence.dropped) + tuple(np.percentile(received, [50, 95, 99]))))
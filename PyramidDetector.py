@@ -0,0 +1,200 @@
+#
+#  PyramidDetector.py
+#
+#  A two level, coarse to fine detector.  Picking a resolution is a trade off: 240x180 is fast but each
+#  pixel is a big chunk of angle in GetAzEl, 1296x972 is precise but slow.  This gets the best of both:
+#
+#		1. Shrink the frame (by scale) and run the normal detector on it to find the candidate targets
+#		2. For each one, cut a padded crop around it out of the full resolution frame
+#		3. Run the detector again on just that crop to get full resolution corners and centroid
+#
+#  The expensive whole frame search runs at the low resolution, and only a few small crops run at the
+#  full resolution.  If a target isn't found again in it's crop, the coarse corners are scaled up instead.
+#
+#  The adaptive threshold is only used at the low resolution.  On a full resolution crop it turns the
+#  sensor noise into hundreds of thousands of specks a second, and finding and rejecting their contours
+#  cost more than the rest of the pyramid put together (35 ms a frame at 1296x972).  A crop is mostly
+#  tape and the dark background around it, so it gets a global threshold picked by Otsu's method instead.
+#  With the global threshold (useAdaptive 0) the crops use params.thresh like the rest of the detector.
+#
+#  On the synthetic 1296x972 frames (python PyramidDetector.py adaptive, on a desktop) the pyramid takes
+#  about 4 ms a frame, against 0.6 ms for the low resolution search and 145 ms for the full resolution
+#  one, with the full resolution az/el error.  So it's not quite the low resolution cost, most of the
+#  difference is converting and shrinking the full resolution frame.  With the global threshold a full
+#  resolution search is already cheap, and the pyramid is a little slower than it.
+#
+#    Example:
+#		detector = PyramidDetector(DetectorParams(), resolution=(1296,972), scale=0.25)
+#		targets = detector.Detect(image)		# full resolution corners
+#
+#    Run this file directly to compare the accuracy and speed of the low resolution, pyramid and full
+#    resolution detectors on synthetic frames (with the global threshold, or the adaptive one):
+#		python PyramidDetector.py [adaptive]
+#
+
+# import the necessary packages
+import sys
+import time
+import cv2
+import numpy as np
+from TargetDetector import TargetDetector, DetectorParams, CameraFOV, GetCentroid, GetAzEl, FindContours
+
+
+class PyramidDetector(object):
+	# params are for the full resolution, the coarse level gets a copy scaled down to it's size.
+	# padding is how much bigger than the coarse target the full resolution crop is (as a fraction of it's size)
+	def __init__(self, params=None, resolution=(1296,972), scale=0.25, padding=0.2, cameraFOV=CameraFOV):
+		if params is None:
+			params = DetectorParams()
+		self._params = params
+		self.resolution = resolution
+		self.scale = scale
+		self.padding = padding
+		self.cameraFOV = cameraFOV
+
+		self.coarseResolution = (int(round(resolution[0] * scale)), int(round(resolution[1] * scale)))
+		self.coarse = TargetDetector(self.CoarseParams(), self.coarseResolution, cameraFOV)
+		self.fine = TargetDetector(params, resolution, cameraFOV)
+		self.timer = self.fine.timer	# the runtimes expect a timer, this one doesn't time anything
+
+		# the full resolution gray image and the shrunk one are written into the same buffers every frame
+		self.gray = None
+		self.small = None
+
+		# the results of the last frame
+		self.coarseTargets = []		# the targets found at the low resolution (in low resolution pixels)
+		self.regions = []			# the full resolution crops that were searched
+		self.refined = 0			# how many of the targets were found again at full resolution
+		self.threshImg = None		# the low resolution binary image
+		self.avg = None				# the average pixel value of the low resolution gray image
+
+	# the parameters for the low resolution level: the sizes scaled down, everything else the same
+	def CoarseParams(self):
+		coarse = self.params.Copy()
+		coarse.minPerim = self.params.minPerim * self.scale
+		coarse.adaptiveSize = int(round(self.params.adaptiveSize * self.scale))
+		return coarse.Validate()
+
+	# setting new params (like HeadlessRunner and the pipeline do) updates both levels
+	@property
+	def params(self):
+		return self._params
+
+	@params.setter
+	def params(self, params):
+		self._params = params
+		self.UpdateParams()
+
+	# call this after changing params in place, so the low resolution level gets the changes too
+	def UpdateParams(self):
+		self.coarse.params = self.CoarseParams()
+		self.fine.params = self.params
+
+	# the full resolution crop (x, y, w, h) to search for a coarse target
+	def Region(self, target, imageSize):
+		x, y, w, h = cv2.boundingRect(target)
+		s = 1.0 / self.scale
+		pad = self.padding * max(w, h) + 1
+		x0 = max(0, int((x - pad) * s))
+		y0 = max(0, int((y - pad) * s))
+		x1 = min(imageSize[0], int((x + w + pad) * s) + 1)
+		y1 = min(imageSize[1], int((y + h + pad) * s) + 1)
+		return (x0, y0, x1 - x0, y1 - y0)
+
+	# find the targets in a full resolution crop (x, y, w, h), returns them and the crop's binary image
+	def DetectIn(self, gray, rect):
+		if self.params.useAdaptive == 0:
+			return self.fine.DetectIn(gray, rect)
+		x, y, w, h = rect
+		ret, threshImg = cv2.threshold(gray[y:y+h, x:x+w], 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+		contours = FindContours(threshImg, (x, y))
+		return self.fine.FilterContours(contours), threshImg
+
+	def Detect(self, image):
+		h, w = image.shape[:2]
+
+		# 1. find the candidates at the low resolution (shrinking the gray image is a lot cheaper than the color one)
+		gray = self.fine.ToGray(image, self.gray)
+		if image.ndim == 3:
+			self.gray = gray
+		self.small = cv2.resize(gray, self.coarseResolution, dst=self.small, interpolation=cv2.INTER_AREA)
+		self.coarseTargets = self.coarse.Detect(self.small)
+		self.threshImg = self.coarse.threshImg
+		self.avg = self.coarse.avg
+
+		# 2 & 3. find each one again in a full resolution crop around it
+		finalTargets = []
+		self.regions = []
+		self.refined = 0
+		for target in self.coarseTargets:
+			region = self.Region(target, (w, h))
+			self.regions.append(region)
+
+			# the coarse centroid in full resolution pixels
+			cx, cy = GetCentroid(target)
+			cx, cy = cx / self.scale, cy / self.scale
+
+			found, threshImg = self.DetectIn(gray, region)
+			if found:
+				# there might be more than one (the inside and outside edge of the tape), use the closest
+				best = min(found, key=lambda t: abs(GetCentroid(t)[0] - cx) + abs(GetCentroid(t)[1] - cy))
+				finalTargets.append(best)
+				self.refined += 1
+			else:
+				# it wasn't found again, so the best we've got is the coarse corners scaled up
+				finalTargets.append(np.round(target / self.scale).astype(np.int32))
+
+		return finalTargets
+
+	# the azmuith and elevation of a target in degrees
+	def GetAzEl(self, target):
+		return GetAzEl(GetCentroid(target), self.resolution, self.cameraFOV)
+
+
+# compare the low resolution, pyramid and full resolution detectors on synthetic frames
+if __name__ == '__main__':
+	from Benchmark import SyntheticFrames
+
+	resolution = (1296,972)
+	scale = 0.25
+	frames = SyntheticFrames(resolution, 'posed', 30)
+	# the synthetic targets are drawn with the real 20" x 14" shape
+	params = DetectorParams(useAdaptive=int(len(sys.argv) > 1 and sys.argv[1] == 'adaptive'), thresh=128, minPerim=400, aspect=20 / 14.0, aspectTol=0.3)
+	if params.useAdaptive:
+		params.thresh = 4
+		params.adaptiveSize = 45
+
+	# the az/el errors of the targets that were found (within 2 degrees of the truth), and how many were
+	def AzElErrors(detector, targets, truth):
+		errors = []
+		azels = [detector.GetAzEl(t) for t in targets]
+		for corners in truth:
+			trueAzEl = GetAzEl(corners.mean(axis=0), resolution)
+			error = [max(abs(a[0] - trueAzEl[0]), abs(a[1] - trueAzEl[1])) for a in azels]
+			if error and min(error) < 2:
+				errors.append(min(error))
+		return errors
+
+	pyramid = PyramidDetector(params, resolution, scale)
+	full = TargetDetector(params, resolution)
+
+	# the low resolution detector gets frames that were already shrunk, like a 240x180 camera would give it
+	low = pyramid.coarse
+	smallFrames = [cv2.resize(image, pyramid.coarseResolution, interpolation=cv2.INTER_AREA) for image, truth in frames]
+
+	total = sum(len(truth) for image, truth in frames)
+	for name, detector in (('low', low), ('pyramid', pyramid), ('full', full)):
+		errors = []
+		elapsed = 0.0
+		for i, (image, truth) in enumerate(frames):
+			if name == 'low':
+				image = smallFrames[i]
+			t = time.time()
+			targets = detector.Detect(image)
+			elapsed += time.time() - t
+			errors += AzElErrors(detector, targets, truth)
+		if errors:
+			print('%-8s %6.2f ms per frame, found %d of %d, az/el error: mean %.3f deg, max %.3f deg' %
+				(name, elapsed / len(frames) * 1000, len(errors), total, np.mean(errors), np.max(errors)))
+		else:
+			print('%-8s %6.2f ms per frame, nothing found' % (name, elapsed / len(frames) * 1000))
@@ -0,0 +1,117 @@
+#
+#  Regression.py
+#
+#  Replays a labeled dataset (see Dataset.py) through the detector and fails if it got worse, so a change
+#  to CheckAnglesAndAspect, the approxPolyDP epsilon or anything else can be checked before it goes on
+#  the robot.  It reports precision, recall, the centroid error (pixels) and az/el error (degrees) of the
+#  targets it found, and the p50/p95 ms per frame.
+#
+#  It fails (exits with 1) when:
+#		* precision or recall are below --min-precision / --min-recall,
+#		* the p95 centroid or az/el error is above --max-centroid-error / --max-azel-error,
+#		* the p95 ms per frame is above --max-ms,
+#		* or, given an older run with --baseline, precision or recall dropped by more than --accuracy-tolerance,
+#		  the p95 centroid error grew by more than --error-tolerance pixels, the p95 az/el error grew by more
+#		  than --azel-tolerance degrees, or the p50 ms per frame grew by more than --latency-tolerance (0.2 is 20%).
+#
+#    Example:
+#		python Regression.py practice --out base.json                # before the change
+#		python Regression.py practice --baseline base.json           # after the change
+#
+
+# import the necessary packages
+import argparse
+import json
+import sys
+from TargetDetector import TargetDetector, DetectorParams
+from Dataset import Dataset, Evaluate
+from Profile import LoadProfile, SetParams
+
+
+# the reasons a run fails the absolute limits, an empty list if it passed
+def CheckLimits(run, args):
+	failures = []
+	if run['precision'] < args.min_precision:
+		failures.append('precision %.3f is below %.3f' % (run['precision'], args.min_precision))
+	if run['recall'] < args.min_recall:
+		failures.append('recall %.3f is below %.3f' % (run['recall'], args.min_recall))
+	if args.max_centroid_error is not None and run['centroidError']['p95'] > args.max_centroid_error:
+		failures.append('p95 centroid error %.2f px is above %.2f px' % (run['centroidError']['p95'], args.max_centroid_error))
+	if args.max_azel_error is not None and run['azElError']['p95'] > args.max_azel_error:
+		failures.append('p95 az/el error %.3f deg is above %.3f deg' % (run['azElError']['p95'], args.max_azel_error))
+	if args.max_ms is not None and run['latency']['p95'] > args.max_ms:
+		failures.append('p95 latency %.2f ms is above %.2f ms' % (run['latency']['p95'], args.max_ms))
+	return failures
+
+
+# the reasons a run is worse than the baseline, an empty list if it isn't
+def CheckBaseline(run, baseline, args):
+	failures = []
+	for name in ('precision', 'recall'):
+		if run[name] < baseline[name] - args.accuracy_tolerance:
+			failures.append('%s dropped from %.3f to %.3f' % (name, baseline[name], run[name]))
+	if run['centroidError']['p95'] > baseline['centroidError']['p95'] + args.error_tolerance:
+		failures.append('p95 centroid error grew from %.2f px to %.2f px' % (baseline['centroidError']['p95'], run['centroidError']['p95']))
+	if run['azElError']['p95'] > baseline['azElError']['p95'] + args.azel_tolerance:
+		failures.append('p95 az/el error grew from %.3f deg to %.3f deg' % (baseline['azElError']['p95'], run['azElError']['p95']))
+	if run['latency']['p50'] > baseline['latency']['p50'] * (1 + args.latency_tolerance):
+		failures.append('p50 latency grew from %.2f ms to %.2f ms' % (baseline['latency']['p50'], run['latency']['p50']))
+	return failures
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Check the detector for accuracy and latency regressions on a labeled dataset.')
+	parser.add_argument('dataset', help='the dataset folder (see Dataset.py)')
+	parser.add_argument('--profile', help='load the params from this profile file')
+	parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='set a DetectorParams value (can be repeated)')
+	parser.add_argument('--out', help='write the results as JSON to this file (to use as a --baseline later)')
+	parser.add_argument('--baseline', help='an older run to compare against')
+	parser.add_argument('--min-precision', type=float, default=0.0)
+	parser.add_argument('--min-recall', type=float, default=0.0)
+	parser.add_argument('--max-centroid-error', type=float, default=None, help='p95, in pixels')
+	parser.add_argument('--max-azel-error', type=float, default=None, help='p95, in degrees')
+	parser.add_argument('--max-ms', type=float, default=None, help='p95 ms per frame')
+	parser.add_argument('--accuracy-tolerance', type=float, default=0.02, help='allowed drop in precision or recall from the baseline')
+	parser.add_argument('--error-tolerance', type=float, default=0.5, help='allowed growth in p95 centroid error from the baseline, in pixels')
+	parser.add_argument('--azel-tolerance', type=float, default=0.1, help='allowed growth in p95 az/el error from the baseline, in degrees')
+	parser.add_argument('--latency-tolerance', type=float, default=0.20, help='allowed p50 slow down from the baseline (0.2 = 20%%)')
+	args = parser.parse_args(argv)
+
+	params = DetectorParams()
+	if args.profile:
+		LoadProfile(args.profile, params)
+	try:
+		params = SetParams(params, args.set)
+	except (AttributeError, ValueError) as e:
+		parser.error(str(e))
+
+	dataset = Dataset(args.dataset)
+	run = Evaluate(TargetDetector(params, dataset.resolution), dataset)
+	run['params'] = dict(params.__dict__)
+	run['frames'] = len(dataset)
+
+	print('%d frames: precision %.3f, recall %.3f (%d found, %d missed, %d false, %d duplicates)' % (len(dataset),
+		run['precision'], run['recall'], run['truePositives'], run['falseNegatives'], run['falsePositives'], run['duplicates']))
+	print('centroid error: p50 %.2f px, p95 %.2f px    az/el error: p50 %.3f deg, p95 %.3f deg' % (run['centroidError']['p50'],
+		run['centroidError']['p95'], run['azElError']['p50'], run['azElError']['p95']))
+	print('latency: p50 %.2f ms, p95 %.2f ms' % (run['latency']['p50'], run['latency']['p95']))
+
+	if args.out:
+		with open(args.out, 'w') as f:
+			json.dump(run, f, indent=2, sort_keys=True)
+
+	failures = CheckLimits(run, args)
+	if args.baseline:
+		with open(args.baseline) as f:
+			failures += CheckBaseline(run, json.load(f), args)
+
+	for failure in failures:
+		print('FAIL: %s' % failure)
+	if failures:
+		return 1
+	print('PASS')
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,259 @@
+#
+#  RoiTracker.py
+#
+#  Once we've found a target it doesn't move far from one frame to the next, so there's no need to
+#  threshold the whole image and check every contour in it again.  The tracker remembers where each
+#  target's centroid has been, predicts where it's bounding box will be in the next frame, and only runs
+#  the detector on those (padded) regions of interest.
+#
+#  It falls back to searching the whole frame when:
+#		* there's nothing being tracked,
+#		* a target isn't found in it's region (it's lost),
+#		* or every fullSearchEvery frames, so new targets that show up are found too.
+#
+#    Example:
+#		tracker = RoiTracker(TargetDetector(params, resolution))
+#		for frame in source:
+#			targets = tracker.Detect(frame.image)
+#
+#    Run this file directly to compare it with searching the whole frame every time:
+#		python RoiTracker.py match1.avi
+#
+
+# import the necessary packages
+import collections
+import sys
+import time
+import cv2
+import numpy as np
+from DetectionResult import DetectionResult
+
+
+# the history of one target that's being tracked
+class Track(object):
+	def __init__(self, center, rect, history=3):
+		self.centers = collections.deque(maxlen=history)	# the last few centroids
+		self.Update(center, rect)
+
+	def Update(self, center, rect):
+		self.centers.append(center)
+		self.rect = rect	# the last bounding box (x, y, w, h)
+
+	# how far the centroid moved in the last frame
+	def Velocity(self):
+		if len(self.centers) < 2:
+			return (0, 0)
+		return (self.centers[-1][0] - self.centers[-2][0], self.centers[-1][1] - self.centers[-2][1])
+
+	# the region to search in the next frame: the last bounding box moved by the velocity, and padded
+	# by padding times the size of the target, plus how far it moved
+	def PredictRegion(self, padding, imageSize):
+		x, y, w, h = self.rect
+		vx, vy = self.Velocity()
+		padX = int(padding * max(w, h) + abs(vx)) + 2
+		padY = int(padding * max(w, h) + abs(vy)) + 2
+
+		x0 = max(0, x + vx - padX)
+		y0 = max(0, y + vy - padY)
+		x1 = min(imageSize[0], x + vx + w + padX)
+		y1 = min(imageSize[1], y + vy + h + padY)
+		if x1 <= x0 or y1 <= y0:
+			return None
+		return (int(x0), int(y0), int(x1 - x0), int(y1 - y0))
+
+
+# merges the regions that overlap into one region that covers both, so no pixel is searched twice
+def MergeRegions(regions):
+	regions = list(regions)
+	merged = True
+	while merged:
+		merged = False
+		for i in range(len(regions)):
+			for j in range(i + 1, len(regions)):
+				ax, ay, aw, ah = regions[i]
+				bx, by, bw, bh = regions[j]
+				if ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah:
+					x0, y0 = min(ax, bx), min(ay, by)
+					x1, y1 = max(ax + aw, bx + bw), max(ay + ah, by + bh)
+					regions[i] = (x0, y0, x1 - x0, y1 - y0)
+					del regions[j]
+					merged = True
+					break
+			if merged:
+				break
+	return regions
+
+
+class RoiTracker(object):
+	# padding is how much bigger than the target the region is (0.25 is a quarter the target's size on each side),
+	# fullSearchEvery is how often the whole frame is searched even if nothing was lost
+	def __init__(self, detector, padding=0.25, fullSearchEvery=30, avgStride=8):
+		self.detector = detector
+		self.padding = padding
+		self.fullSearchEvery = fullSearchEvery
+		self.avgStride = avgStride		# only every avgStride'th pixel is used for the average in ROI frames
+
+		self.tracks = []
+		self.frames = 0			# frames since the last full search
+		self.threshImg = None	# the binary image, only the regions are filled in when we're tracking
+		self.regions = []		# the regions searched in the last frame (empty when it was a full search)
+		self.result = DetectionResult()	# the last frame's targets
+
+		# some statistics
+		self.fullSearches = 0	# frames the whole image was searched
+		self.roiFrames = 0		# frames only the regions were searched
+		self.pixels = 0			# how many pixels were thresholded
+		self.totalPixels = 0	# how many pixels there were
+
+	# the detector's params, resolution and so on, so the tracker can be used anywhere a detector is
+	@property
+	def params(self):
+		return self.detector.params
+
+	@params.setter
+	def params(self, params):
+		self.detector.params = params
+
+	@property
+	def resolution(self):
+		return self.detector.resolution
+
+	@property
+	def cameraFOV(self):
+		return self.detector.cameraFOV
+
+	@property
+	def timer(self):
+		return self.detector.timer
+
+	@property
+	def avg(self):
+		return self.detector.avg
+
+	def GetAzEl(self, target):
+		return self.detector.GetAzEl(target)
+
+	# what fraction of the pixels we actually had to look at
+	def PixelFraction(self):
+		return self.pixels / float(max(self.totalPixels, 1))
+
+	# forget all the tracks, the next frame is a full search
+	def Reset(self):
+		self.tracks = []
+		self.frames = 0
+
+	# match the targets to the tracks (nearest centroid), anything not matched starts a new track
+	def UpdateTracks(self, targets):
+		result = self.result.Fill(targets, self.detector)
+		corners = result.targets['corners']
+		topLefts = corners.min(axis=1)
+		sizes = corners.max(axis=1) - topLefts + 1		# the same as cv2.boundingRect()
+
+		tracks = []
+		unmatched = list(self.tracks)
+		for center, (x, y), (w, h) in zip(result.targets['centroid'].tolist(), topLefts.tolist(), sizes.tolist()):
+			rect = (x, y, w, h)
+			gate = max(w, h)
+
+			best = None
+			bestDist = gate
+			for track in unmatched:
+				last = track.centers[-1]
+				dist = abs(last[0] - center[0]) + abs(last[1] - center[1])
+				if dist <= bestDist:
+					best, bestDist = track, dist
+			if best is None:
+				best = Track(center, rect)
+			else:
+				unmatched.remove(best)
+				best.Update(center, rect)
+			tracks.append(best)
+		self.tracks = tracks
+
+	# search the whole frame
+	def FullSearch(self, image):
+		self.frames = 0
+		self.regions = []
+		self.fullSearches += 1
+		self.pixels += image.shape[0] * image.shape[1]
+		targets = self.detector.Detect(image)
+		self.threshImg = self.detector.threshImg
+		return targets
+
+	# search only the predicted regions, returns None if a target was lost
+	def RegionSearch(self, image):
+		h, w = image.shape[:2]
+		regions = []
+		for track in self.tracks:
+			region = track.PredictRegion(self.padding, (w, h))
+			if region is None:
+				return None
+			regions.append(region)
+		regions = MergeRegions(regions)
+
+		# the binary image for drawing, everything outside the regions is black
+		if self.threshImg is None or self.threshImg.shape != (h, w) or self.threshImg is self.detector.threshImg:
+			self.threshImg = np.zeros((h, w), np.uint8)
+		else:
+			self.threshImg[:] = 0
+
+		targets = []
+		for (x, y, rw, rh) in regions:
+			found, threshImg = self.detector.DetectIn(image, (x, y, rw, rh))
+			if len(found) == 0:
+				return None
+			self.threshImg[y:y+rh, x:x+rw] = threshImg
+			self.pixels += rw * rh
+			targets.extend(found)
+
+		# the auto exposure still needs the average pixel value, a strided sample is plenty
+		s = self.avgStride
+		self.detector.avg = cv2.mean(self.detector.ToGray(image[::s, ::s]))
+
+		self.regions = regions
+		self.roiFrames += 1
+		return targets
+
+	# find the targets in a frame, searching only near the tracked targets when we can
+	def Detect(self, image):
+		self.totalPixels += image.shape[0] * image.shape[1]
+		targets = None
+		if self.tracks and self.frames < self.fullSearchEvery:
+			targets = self.RegionSearch(image)
+		if targets is None:
+			# nothing tracked, a target was lost or it's time for a full search
+			targets = self.FullSearch(image)
+		self.frames += 1
+		self.UpdateTracks(targets)
+		return targets
+
+
+# compare tracking with searching the whole frame every time
+if __name__ == '__main__':
+	from FrameSource import OpenFrameSource
+	from TargetDetector import TargetDetector, DetectorParams
+
+	if len(sys.argv) < 2:
+		print('usage: python RoiTracker.py <video | image folder | frames.npy>')
+		sys.exit(1)
+
+	frames = [frame.image for frame in OpenFrameSource(sys.argv[1])]
+	if len(frames) == 0:
+		print('no frames read')
+		sys.exit(1)
+	h, w = frames[0].shape[:2]
+	params = DetectorParams(minPerim=int(100 * w / 320.0))
+
+	detector = TargetDetector(params, (w, h))
+	start = time.time()
+	full = sum(len(detector.Detect(image)) for image in frames)
+	fullTime = time.time() - start
+
+	tracker = RoiTracker(TargetDetector(params, (w, h)))
+	start = time.time()
+	tracked = sum(len(tracker.Detect(image)) for image in frames)
+	trackTime = time.time() - start
+
+	print('full frame: %d detections, %.2f ms per frame' % (full, fullTime / len(frames) * 1000))
+	print('tracking:   %d detections, %.2f ms per frame, %d full searches, %d roi frames, %.1f%% of the pixels' %
+		(tracked, trackTime / len(frames) * 1000, tracker.fullSearches, tracker.roiFrames, tracker.PixelFraction() * 100))
@@ -0,0 +1,167 @@
+#
+#  StageTimer.py
+#
+#  Low overhead timing of each stage of the frame loop, so we can see where the milliseconds go.
+#
+#  Each stage keeps it's last `size` times (in ms) in a preallocated NumPy ring buffer, so recording a
+#  time never allocates anything.  Call Mark() at the end of each stage and it records the time since
+#  the previous Mark(), then EndFrame() at the end of the loop to record the time of the whole frame:
+#
+#		timer = StageTimer()
+#		for frame in source:
+#			timer.Mark('capture')			# time spent waiting for the frame
+#			...
+#			timer.Mark('display')
+#			timer.EndFrame()
+#		print(timer.Report())
+#
+#  When timing is turned off use a NullStageTimer instead, all of it's methods do nothing, so the cost
+#  of leaving the Mark() calls in the loop is just an empty function call.
+#
+#  StageTotals is for stages that run many times in a frame (like the tests on each contour): Mark() adds
+#  the time to the stage's total for the frame instead of recording it as a time of it's own.
+#
+
+# import the necessary packages
+import cv2
+import numpy as np
+
+# the stages of the frame loop, in the order they run
+Stages = ['capture', 'gray', 'threshold', 'contours', 'hulls', 'centroids', 'annotate', 'display']
+
+
+class StageTimer(object):
+	enabled = True
+
+	def __init__(self, stages=Stages, size=300):
+		self.stages = list(stages) + ['frame']
+		self.size = size
+
+		self.index = dict((stage, i) for i, stage in enumerate(self.stages))	# the row for each stage
+		self.times = np.zeros((len(self.stages), size), np.float64)				# the ring buffer of times in ms
+		self.next = [0] * len(self.stages)		# where the next time for each stage goes
+		self.count = [0] * len(self.stages)		# how many times are in the buffer for each stage
+
+		self.msPerTick = 1000.0 / cv2.getTickFrequency()
+		self.Reset()
+
+	# forget all the times, and start timing from now
+	def Reset(self):
+		self.times[:] = 0
+		self.next = [0] * len(self.stages)
+		self.count = [0] * len(self.stages)
+		self.last = self.frameStart = cv2.getTickCount()
+
+	# add a time (in ms) for a stage
+	def Record(self, stage, ms):
+		i = self.index[stage]
+		n = self.next[i]
+		self.times[i, n] = ms
+		self.next[i] = (n + 1) % self.size
+		if self.count[i] < self.size:
+			self.count[i] += 1
+
+	# the end of a stage, records the time since the last mark
+	def Mark(self, stage):
+		now = cv2.getTickCount()
+		self.Record(stage, (now - self.last) * self.msPerTick)
+		self.last = now
+
+	# the end of a frame, records the time since the last EndFrame() as the 'frame' stage
+	def EndFrame(self):
+		now = cv2.getTickCount()
+		self.Record('frame', (now - self.frameStart) * self.msPerTick)
+		self.frameStart = now
+
+	# the times recorded for a stage (oldest first isn't guaranteed)
+	def Times(self, stage):
+		i = self.index[stage]
+		return self.times[i, :self.count[i]]
+
+	# the rolling percentiles of a stage, returns None if it hasn't been recorded yet
+	def Percentiles(self, stage, q=(50, 95, 99)):
+		times = self.Times(stage)
+		if len(times) == 0:
+			return None
+		return np.percentile(times, q)
+
+	# a dict of stage -> dict(p50, p95, p99, mean, count) for all the stages that have been recorded
+	def Summary(self):
+		summary = {}
+		for stage in self.stages:
+			times = self.Times(stage)
+			if len(times) == 0:
+				continue
+			p50, p95, p99 = np.percentile(times, (50, 95, 99))
+			summary[stage] = dict(p50=p50, p95=p95, p99=p99, mean=times.mean(), count=len(times))
+		return summary
+
+	# a table of the rolling percentiles, one line per stage
+	def Report(self):
+		summary = self.Summary()
+		lines = ['%-10s %8s %8s %8s %8s' % ('stage', 'p50 ms', 'p95 ms', 'p99 ms', 'mean ms')]
+		for stage in self.stages:
+			if stage in summary:
+				s = summary[stage]
+				lines.append('%-10s %8.2f %8.2f %8.2f %8.2f' % (stage, s['p50'], s['p95'], s['p99'], s['mean']))
+		if 'frame' in summary:
+			lines.append('%.1f fps' % (1000.0 / max(summary['frame']['mean'], 1e-6)))
+		return '\n'.join(lines)
+
+
+# adds up the time spent in each stage, for stages that run many times in one frame.
+#		totals = StageTotals()
+#		totals.Start()
+#		for cnt in contours:
+#			...
+#			totals.Mark('convexHull')
+#		totals.totals['convexHull']		# ms spent in convexHull since Start()
+class StageTotals(object):
+	def __init__(self, stages=()):
+		self.stages = list(stages)
+		self.msPerTick = 1000.0 / cv2.getTickFrequency()
+		self.Start()
+
+	# zero the totals, and start timing from now
+	def Start(self):
+		self.totals = dict((stage, 0.0) for stage in self.stages)
+		self.last = cv2.getTickCount()
+
+	# the end of a stage, adds the time since the last mark to it's total
+	def Mark(self, stage):
+		now = cv2.getTickCount()
+		self.totals[stage] = self.totals.get(stage, 0.0) + (now - self.last) * self.msPerTick
+		self.last = now
+
+
+# a timer that does nothing, used when timing is turned off
+class NullStageTimer(object):
+	enabled = False
+
+	def Reset(self):
+		pass
+
+	def Record(self, stage, ms):
+		pass
+
+	def Mark(self, stage):
+		pass
+
+	def EndFrame(self):
+		pass
+
+	def Percentiles(self, stage, q=(50, 95, 99)):
+		return None
+
+	def Summary(self):
+		return {}
+
+	def Report(self):
+		return 'timing is off'
+
+
+# a StageTimer if enabled, otherwise a NullStageTimer
+def MakeStageTimer(enabled=True, stages=Stages, size=300):
+	if enabled:
+		return StageTimer(stages, size)
+	return NullStageTimer()
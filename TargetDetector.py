@@ -0,0 +1,430 @@
+#
+#  TargetDetector.py
+#
+#  The target detection algorithim from 09-AspectRatio.py pulled out of the camera loop so it can be
+#  imported and run on any BGR image, without a camera or a window.  This lets us time it, profile it
+#  and reuse it from the other scripts.
+#
+#    The algorithim follows these steps:
+#		1. Uses a threshold or an optional adaptive threshold to create a binary image
+#		2. Finds the contours of the binary image
+#		3. Gets the convex hull of each contour
+#		4. Checks to see that the hull has a sufficently large hull
+#		5. Approximates the hull in order to get only 4 points (mostly a rectangle)
+#		6. Checks each side to make sure they are mostly horizontal or vertical
+#		7. Checks the aspect ratio, to ensure it's correct.
+#		8. Find the center of the target and measure it's angle in the field of view of the camera.
+#
+#    Before step 3 each contour goes through a cascade of cheap tests, so the tiny specks that the
+#    adaptive threshold makes never get to the expensive convexHull and approxPolyDP calls:
+#		a. it needs at least 4 points (or it's hull can't have 4 verticies)
+#		b. it's bounding box has to be big enough to hold a hull with the minimum perimiter
+#		c. (optional) it has to fill at least minFill of it's bounding box
+#    The detector counts how many contours each test rejects (see RejectionReport()).
+#
+#    Example:
+#		detector = TargetDetector(DetectorParams(), resolution=(320,240))
+#		targets = detector.Detect(image)
+#		for target in targets:
+#			print(GetAzEl(GetCentroid(target), detector.resolution))
+#
+
+# import the necessary packages
+import math
+import cv2
+import numpy as np
+from StageTimer import NullStageTimer
+
+# Camera's field of view in horizontal and vertical in degrees:
+# the raspberry pi's camera has 53.50 horizontal and 41.41 vertical (https://www.raspberrypi.org/documentation/hardware/camera.md)
+CameraFOV = (53.5, 41.41)
+
+# the default resoultion of the camera... common values: (1296,972), (640,480), (320,240), (240, 180)
+resolution = (320,240)
+
+
+# all the values that used to come from the trackbars in 09-AspectRatio.py, with the same defaults.
+# the detector only uses the threshold, perimiter, angle and aspect values, the rest are here so that
+# one object holds everything that can be tuned.
+class DetectorParams(object):
+	def __init__(self, **kwargs):
+		self.drawThresh = 1			# draw the binary threshold image? 1 means yes, 0 means no
+		self.useAdaptive = 1		# use an adaptive threshold? 1 means yes, 0 means normal threshold
+		self.adaptiveSize = 11		# the adaptive threshold size, must be odd and greater than or equal to 3
+		self.thresh = 4				# the threshold value
+		self.minPerim = 100			# the minimum perimiter of a valid target (in pixel length)
+		self.autoShutter = 22		# the target average pixel value in the image, used to set the shutter speed
+		self.eps = 20				# max angle we can be off for horizontal and vertical sides
+		self.aspect = 1.60			# the aspect ratio of the target (width / height)
+		self.aspectTol = 0.20		# the aspect ratio tolerance in percetage
+		self.minFill = 0.0			# the fraction of it's bounding box a contour's area has to fill (0 turns the test off)
+
+		# override any of the defaults
+		for name, value in kwargs.items():
+			if not hasattr(self, name):
+				raise AttributeError('unknown detector parameter: %s' % name)
+			setattr(self, name, value)
+
+		self.Validate()
+
+	# make sure the values are usable by opencv, the same way the lesson fixed up the trackbar values
+	def Validate(self):
+		if self.aspect == 0: self.aspect = 0.00001					# make sure we don't have an aspect ratio of zero
+		if self.adaptiveSize < 3: self.adaptiveSize = 3				# the adaptive threshold filter size must be 3 or greater
+		if self.adaptiveSize % 2 == 0: self.adaptiveSize += 1		# and it must also be odd
+		return self
+
+	# a copy of these parameters
+	def Copy(self):
+		return DetectorParams(**self.__dict__)
+
+	def __repr__(self):
+		values = ', '.join('%s=%r' % (k, v) for k, v in sorted(self.__dict__.items()))
+		return 'DetectorParams(%s)' % values
+
+
+# a call back function for the trackbars... it does nothing...
+def nothing(jnk):
+	pass
+
+# create the same trackbars as 09-AspectRatio.py, starting them at the given parameters
+def CreateTrackbars(winName, params=None):
+	if params is None:
+		params = DetectorParams()
+	cv2.createTrackbar('showThreshold', winName, params.drawThresh, 1, nothing)
+	cv2.createTrackbar('useAdaptiveThresh', winName, params.useAdaptive, 1, nothing)
+	cv2.createTrackbar('adaptiveThreshSize', winName, params.adaptiveSize, 55, nothing)
+	cv2.createTrackbar('threshold', winName, params.thresh, 255, nothing)
+	cv2.createTrackbar('minPerim', winName, params.minPerim, 1000, nothing)
+	cv2.createTrackbar('autoShutter', winName, params.autoShutter, 255, nothing)
+	cv2.createTrackbar('angleOffHoriz', winName, params.eps, 45, nothing)
+	cv2.createTrackbar('aspectRatio', winName, int(round(params.aspect * 100)), 300, nothing)
+	cv2.createTrackbar('aspectRatioTolerance%', winName, int(round(params.aspectTol * 100)), 100, nothing)
+
+# read the trackbars into a parameter object (a new one, or update the one passed in)
+def ReadTrackbars(winName, params=None):
+	if params is None:
+		params = DetectorParams()
+	params.drawThresh = cv2.getTrackbarPos('showThreshold', winName)
+	params.useAdaptive = cv2.getTrackbarPos('useAdaptiveThresh', winName)
+	params.thresh = cv2.getTrackbarPos('threshold', winName)
+	params.minPerim = cv2.getTrackbarPos('minPerim', winName)
+	params.autoShutter = cv2.getTrackbarPos('autoShutter', winName)
+	params.eps = cv2.getTrackbarPos('angleOffHoriz', winName)
+	params.aspect = cv2.getTrackbarPos('aspectRatio', winName) / 100.0
+	params.aspectTol = cv2.getTrackbarPos('aspectRatioTolerance%', winName) / 100.0
+	params.adaptiveSize = cv2.getTrackbarPos('adaptiveThreshSize', winName)
+	return params.Validate()
+
+
+# a function that checks the 4 sides of a quadrilatal.
+# If all 4 sides are close to horizontal or vertical (+/- epsilon)
+# AND make sure that the aspect ratio is within the tolerance
+def CheckAnglesAndAspect(corners, epsilon, aspectRatio, aspectTolerance):
+	# require 4 corners
+	if len(corners) != 4:
+		return False
+
+	sumWidth = 0	# sum of the two horizontal sides
+	sumHeight = 0	# sum of the two vertical sides
+
+	# loop through each corner
+	for i in range(4):
+		i0 = i 				# index to the first corner
+		i1 = (i + 1) % 4	# index to the next corner
+
+		x = abs(corners[i1][0][0] - corners[i0][0][0])	# the difference in x
+		y = abs(corners[i1][0][1] - corners[i0][0][1])	# the difference in y
+		length = math.sqrt(x**2 + y**2)					# the length of this side
+
+		# if x > y, then it's mostly horizontal
+		if x > y:
+			# the angle off horizontal
+			theta = math.atan2(y,x) * 180 / math.pi
+			# add length to the sum of the width
+			sumWidth += length
+		else:
+			# the angle off vertical
+			theta = math.atan2(x,y) * 180 / math.pi
+			# add length to the sum of the height
+			sumHeight += length
+
+		# if the angle is greater than epsilon, then it's not vertical or horizontal, so return false
+		if abs(theta) > epsilon:
+			return False
+
+	# calculate the average width and height
+	avgWidth = sumWidth / 2
+	avgHeight = sumHeight / 2
+
+	# calculate the expected height using the expected aspect ratio and the measured width
+	expectedHeight = avgWidth / aspectRatio
+
+	# check that the difference between the expected height and the actual height is less than the tolerance
+	if abs(expectedHeight - avgHeight) > (aspectTolerance * expectedHeight):
+		return False
+
+	# if we get here then all corners have been checked and are okay.
+	return True
+
+# the same checks as CheckAnglesAndAspect, but for all the 4 cornered candidates of a frame at once.
+# corners is a (N,4,2) array (or (N,4,1,2), like a stack of approxPolyDP results).
+# returns a boolean mask of the candidates that pass, and each candidate's average width, average
+# height and it's worst side's angle off horizontal or vertical (in degrees)
+def CheckAnglesAndAspectBatch(corners, epsilon, aspectRatio, aspectTolerance):
+	corners = np.asarray(corners, np.float64).reshape(-1, 4, 2)
+
+	# the difference in x and y along each side, side i goes from corner i to corner i + 1
+	d = np.abs(np.roll(corners, -1, axis=1) - corners)
+	x = d[:, :, 0]
+	y = d[:, :, 1]
+	lengths = np.sqrt(x**2 + y**2)
+
+	# if x > y, then it's mostly horizontal, and we want the angle off horizontal.  otherwise off vertical
+	horizontal = x > y
+	theta = np.where(horizontal, np.arctan2(y, x), np.arctan2(x, y)) * 180 / np.pi
+	angleErrors = theta.max(axis=1)
+
+	# the average width and height
+	widths = np.where(horizontal, lengths, 0).sum(axis=1) / 2
+	heights = np.where(horizontal, 0, lengths).sum(axis=1) / 2
+
+	# the expected height from the expected aspect ratio and the measured width
+	expectedHeights = widths / aspectRatio
+
+	mask = (angleErrors <= epsilon) & (np.abs(expectedHeights - heights) <= aspectTolerance * expectedHeights)
+	return mask, widths, heights, angleErrors
+
+# gets the azmuith and elevation angles from a point in the image in degrees
+def GetAzEl(point, resolution=resolution, cameraFOV=CameraFOV):
+	az = point[0]/float(resolution[0]) - 0.5
+	el = (1 - point[1]/float(resolution[1])) - 0.5
+	return (az * cameraFOV[0], el * cameraFOV[1])
+
+# gets the center of a target from it's moments (https://en.wikipedia.org/wiki/Image_moment)
+def GetCentroid(target):
+	M = cv2.moments(target)
+	if M['m00'] == 0:
+		# a degenerate target, just use the average of the corners
+		center = target.reshape(-1, 2).mean(axis=0)
+		return (int(center[0]), int(center[1]))
+	return (int(M['m10']/M['m00']), int(M['m01']/M['m00']))
+
+# find the contours in a binary image, works with opencv 3 (which returns 3 values) and opencv 2 & 4 (which return 2)
+# offset is added to every point, for when the binary image is a piece cut out of a bigger one
+# before opencv 3.2 findContours() also scribbles on the image it's given, so it gets a copy and the binary
+# image stays good for drawing (the lessons convert it for display before findContours() for the same reason)
+def FindContours(threshImg, offset=(0,0)):
+	if FindContoursModifiesInput:
+		threshImg = threshImg.copy()
+	return cv2.findContours(threshImg, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE, offset=offset)[-2]
+
+# the major and minor opencv version, as numbers
+OpenCVVersion = tuple(int(''.join(c for c in part if c.isdigit()) or 0) for part in cv2.__version__.split('.')[:2])
+FindContoursModifiesInput = OpenCVVersion < (3, 2)
+
+
+# the tests in the order the contours go through them, used to count which test rejected each contour
+Rejections = ['points', 'boundingRect', 'area', 'perimiter', 'verticies', 'anglesAndAspect']
+
+
+# the detector, it holds the parameters and the images from the last call to Detect()
+# so they can be drawn or used for the auto exposure.
+# give it a StageTimer to time the gray, threshold, contours and hulls stages of each Detect(),
+# and FrameBuffers to write the gray, binary and annotation images into instead of allocating new ones.
+# adaptiveThreshold is the function used for the adaptive threshold, it takes the same arguments as
+# cv2.adaptiveThreshold (see AdaptiveThreshold.py for one that costs the same at any adaptiveSize).
+class TargetDetector(object):
+	def __init__(self, params=None, resolution=resolution, cameraFOV=CameraFOV, timer=None, buffers=None, adaptiveThreshold=None):
+		if params is None:
+			params = DetectorParams()
+		if timer is None:
+			timer = NullStageTimer()
+		self.params = params
+		self.resolution = resolution
+		self.cameraFOV = cameraFOV
+		self.timer = timer
+		self.buffers = buffers
+		self.adaptiveThreshold = adaptiveThreshold or cv2.adaptiveThreshold
+
+		# the intermediate results of the last frame
+		self.candidates = []	# the 4 cornered hulls that were checked
+		self.metrics = None		# (mask, widths, heights, angleErrors) of the candidates from CheckAnglesAndAspectBatch
+		self.candidateCorners = None	# the (N,4,1,2) stack of the candidates they were computed from
+		self.targets = None		# the last targets FilterContours returned, the ones that passed
+		self.bufs = None		# the set of buffers it was written into (if we have buffers)
+
+		# how many contours each test rejected, and how many there were in total, since ResetRejections()
+		self.ResetRejections()
+		self.gray = None		# the grayscale image
+		self.threshImg = None	# the binary image
+		self.avg = None			# the average pixel value of the grayscale image
+		self.avgStride = 4		# only every avgStride'th pixel (in each direction) is used for the average
+
+	# move on to the next set of buffers, returns None if we don't have any (or they're pooled and all in use,
+	# then the frame's images are allocated).  pooled buffers have to be given back with self.bufs.Release()
+	# when the frame is done with (Pipeline.py does that)
+	def NextBuffers(self):
+		if self.buffers is not None:
+			self.bufs = self.buffers.Take()
+		return self.bufs
+
+	# convert to a grayscale image (a single channel image is used as is)
+	def ToGray(self, image, dst=None):
+		if image.ndim == 2:
+			return image
+		return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
+
+	# threshold the grayscale image
+	def Threshold(self, gray, dst=None):
+		p = self.params
+		if p.useAdaptive == 0:
+			#use the simple global threshold routine
+			ret, threshImg = cv2.threshold(gray, p.thresh, 255, cv2.THRESH_BINARY, dst=dst)
+		else:
+			# use the fancy adaptive threshold routine
+			threshImg = self.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, p.adaptiveSize, p.thresh, dst=dst)
+		return threshImg
+
+	# approximate each contour's hull with 4 points and keep the ones that look like a target.
+	# totals is an optional StageTotals, it gets the time spent in the earlyReject, convexHull, approxPolyDP
+	# and CheckAnglesAndAspect stages added to it (Benchmark.py times the tests this way)
+	def FilterContours(self, contours, totals=None):
+		p = self.params
+
+		minPerim = p.minPerim
+		minFill = p.minFill
+
+		# the hulls with 4 verticies, they're empty now, but we'll fill them next.
+		candidates = []
+
+		# how many contours each test rejected in this frame
+		points = boundingRect = area = perimiter = verticies = 0
+
+		# for each contour we found...
+		for cnt in contours:
+			# the cheapest test first: the hull can't have 4 verticies if the contour has less than 4 points
+			if len(cnt) < 4:
+				points += 1
+				if totals is not None: totals.Mark('earlyReject')
+				continue
+
+			# the hull fits inside the bounding box, so it's perimiter can't be bigger than the box's
+			x, y, w, h = cv2.boundingRect(cnt)
+			if 2 * (w + h) < minPerim:
+				boundingRect += 1
+				if totals is not None: totals.Mark('earlyReject')
+				continue
+
+			# the contour has to fill enough of it's bounding box
+			if minFill > 0 and cv2.contourArea(cnt) < minFill * w * h:
+				area += 1
+				if totals is not None: totals.Mark('earlyReject')
+				continue
+			if totals is not None: totals.Mark('earlyReject')
+
+			# get the convexHull
+			hull = cv2.convexHull(cnt)
+
+			# get the perimiter of the hull
+			perim = cv2.arcLength(hull, True)
+			if totals is not None: totals.Mark('convexHull')
+
+			# is the the perimiter of the hull is > than the minimum allowed?
+			if perim < minPerim:
+				perimiter += 1
+				continue
+
+			#approximate the hull:
+			aproxHull = cv2.approxPolyDP(hull, 0.1 * perim, True)
+			if totals is not None: totals.Mark('approxPolyDP')
+
+			# only add this candidate if it has 4 verticies
+			if len(aproxHull) != 4:
+				verticies += 1
+				continue
+			candidates.append(aproxHull)
+
+		self.candidates = candidates
+		finalTargets = []
+		self.metrics = None
+		self.candidateCorners = None
+		if len(candidates) > 0:
+			# check all the candidates at once to see if the 4 sides are near horizontal or vertical, and check the aspect ratio
+			self.candidateCorners = np.array(candidates)
+			self.metrics = CheckAnglesAndAspectBatch(self.candidateCorners, p.eps, p.aspect, p.aspectTol)
+			finalTargets = [c for c, ok in zip(candidates, self.metrics[0]) if ok]
+		self.targets = finalTargets
+		if totals is not None: totals.Mark('CheckAnglesAndAspect')
+
+		# add up the rejections
+		r = self.rejections
+		r['points'] += points
+		r['boundingRect'] += boundingRect
+		r['area'] += area
+		r['perimiter'] += perimiter
+		r['verticies'] += verticies
+		r['anglesAndAspect'] += len(candidates) - len(finalTargets)
+		self.contourCount += len(contours)
+		self.acceptedCount += len(finalTargets)
+
+		return finalTargets
+
+	# start counting the rejections over
+	def ResetRejections(self):
+		self.rejections = dict((name, 0) for name in Rejections)
+		self.contourCount = 0
+		self.acceptedCount = 0
+
+	# a table of how many contours each test rejected, and what share of all the contours that is
+	def RejectionReport(self):
+		total = max(self.contourCount, 1)
+		lines = ['%-16s %10s %7s' % ('test', 'rejected', 'share')]
+		for name in Rejections:
+			lines.append('%-16s %10d %6.1f%%' % (name, self.rejections[name], self.rejections[name] * 100.0 / total))
+		lines.append('%-16s %10d %6.1f%%' % ('accepted', self.acceptedCount, self.acceptedCount * 100.0 / total))
+		lines.append('%-16s %10d' % ('contours', self.contourCount))
+		return '\n'.join(lines)
+
+	# run the whole algorithim on a BGR image, returns a list of targets (each one a (4,1,2) array of corners)
+	def Detect(self, image):
+		timer = self.timer
+		bufs = self.NextBuffers()
+		self.gray = self.ToGray(image, bufs and bufs.gray)
+		s = self.avgStride
+		self.avg = cv2.mean(self.gray[::s, ::s])
+		timer.Mark('gray')
+		self.threshImg = self.Threshold(self.gray, bufs and bufs.binary)
+		timer.Mark('threshold')
+		contours = FindContours(self.threshImg)
+		timer.Mark('contours')
+		finalTargets = self.FilterContours(contours)
+		timer.Mark('hulls')
+		return finalTargets
+
+	# run the algorithim on just one rectangle (x, y, w, h) of the image.  returns the targets (in the
+	# coordinates of the whole image) and the binary image of the rectangle.  it doesn't touch self.gray,
+	# self.threshImg or self.avg, those are still from the last Detect()
+	def DetectIn(self, image, rect):
+		x, y, w, h = rect
+		gray = self.ToGray(image[y:y+h, x:x+w])
+		threshImg = self.Threshold(gray)
+		contours = FindContours(threshImg, (x, y))
+		return self.FilterContours(contours), threshImg
+
+	# the image to draw the last frame's targets on: the threshold image in color if
+	# drawThresh is 1 (written into the annotation buffer if we have one), otherwise the image itself.
+	# image can also be a Frame, then it's color image is only made when it's needed
+	def AnnotationImage(self, image):
+		dst = self.bufs and self.bufs.annotation
+		if self.params.drawThresh == 1:
+			return cv2.cvtColor(self.threshImg, cv2.COLOR_GRAY2BGR, dst=dst)
+		if hasattr(image, 'Bgr'):
+			return image.Bgr(dst)
+		if image.ndim == 2:
+			return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR, dst=dst)
+		return image
+
+	# the azmuith and elevation of a target in degrees
+	def GetAzEl(self, target):
+		return GetAzEl(GetCentroid(target), self.resolution, self.cameraFOV)
@@ -0,0 +1,235 @@
+#
+#  TargetFilter.py
+#
+#  Smooths the targets over time.  GetAzEl turns each frame's centroid into angles on it's own, so the
+#  angles jitter by a pixel or so from frame to frame, and by the time the robot gets them they're already
+#  old: the frame was captured a while ago, and detecting and sending it took some more time.
+#
+#  The filter keeps a track for each target, and follows it's az/el (and centroid) with an alpha-beta
+#  filter (https://en.wikipedia.org/wiki/Alpha_beta_filter), which also estimates how fast it's moving in
+#  degrees per second.  That velocity is used to predict where the target is now, instead of where it
+#  was when the frame was captured.
+#
+#  It takes each frame's DetectionResult (see DetectionResult.py), the az/el and centroids are already in it.
+#  The inside and outside edges of the tape are often both found, so targets closer than mergeGate degrees
+#  to a bigger one are dropped first.  Then each frame's targets are matched to the tracks by predicting each track to the frame's time and pairing
+#  the closest ones first (within gate degrees).  A target that doesn't match a track starts a new one with
+#  a new id, a track is only reported once it's been seen minHits times, and it's dropped after it's been
+#  missed maxMisses frames in a row.  So the ids stay the same for as long as each target is in view.
+#
+#    Example:
+#		targetFilter = TargetFilter(resolution)
+#		result = DetectionResult()
+#		for frame in source:
+#			targets = detector.Detect(frame.image)
+#			targetFilter.Update(result.Fill(targets, detector, frame))
+#			for track in targetFilter.Output():		# predicted to right now
+#				print(track.id, track.az, track.el)
+#
+#    Run this file directly to see how much closer to the truth the filtered, predicted angles are than
+#    the raw ones, for a couple of simulated targets moving across the frame:
+#		python TargetFilter.py
+#
+
+# import the necessary packages
+import math
+import time
+import numpy as np
+from TargetDetector import CameraFOV, GetAzEl, DetectorParams, resolution as DefaultResolution
+from DetectionResult import DetectionResult
+
+
+# an alpha-beta filter of a 2d position and it's velocity (per second)
+class AlphaBeta(object):
+	def __init__(self, position, timestamp, alpha, beta):
+		self.position = np.array(position, np.float64)
+		self.velocity = np.zeros(2)
+		self.timestamp = timestamp
+		self.alpha = alpha
+		self.beta = beta
+
+	# where it will be at time t
+	def Predict(self, t):
+		return self.position + self.velocity * (t - self.timestamp)
+
+	# a new measurement at time t
+	def Update(self, measured, t):
+		dt = t - self.timestamp
+		predicted = self.Predict(t)
+		residual = np.asarray(measured, np.float64) - predicted
+		self.position = predicted + self.alpha * residual
+		if dt > 0:
+			self.velocity = self.velocity + self.beta * residual / dt
+		self.timestamp = t
+
+
+# one target being followed
+class Track(object):
+	def __init__(self, id, azel, center, timestamp, alpha, beta):
+		self.id = id
+		self.angles = AlphaBeta(azel, timestamp, alpha, beta)
+		self.centroid = AlphaBeta(center, timestamp, alpha, beta)
+		self.hits = 1			# how many frames it was found in
+		self.misses = 0			# how many frames in a row it wasn't found in
+		self.target = None		# the (4,2) corners it was last found with
+
+	def Update(self, azel, center, timestamp):
+		self.angles.Update(azel, timestamp)
+		self.centroid.Update(center, timestamp)
+		self.hits += 1
+		self.misses = 0
+
+	# the angles (degrees) and centroid (pixels) at time t
+	def Predict(self, t):
+		return self.angles.Predict(t), self.centroid.Predict(t)
+
+
+# what Output() gives for each track
+class FilteredTarget(object):
+	def __init__(self, track, t):
+		self.id = track.id
+		self.timestamp = t			# the time it was predicted to
+		(self.az, self.el), (self.cx, self.cy) = track.Predict(t)
+		self.azRate, self.elRate = track.angles.velocity	# degrees per second
+		self.age = t - track.angles.timestamp				# how old the last measurement is, in seconds
+		self.target = track.target
+
+	def __repr__(self):
+		return 'FilteredTarget(id=%d, az=%.2f, el=%.2f, azRate=%.2f, elRate=%.2f)' % (self.id, self.az, self.el, self.azRate, self.elRate)
+
+
+class TargetFilter(object):
+	# alpha and beta are how much of each new measurement goes into the position and velocity (smaller is
+	# smoother but slower to follow), gate is the farthest (in degrees) a target can be from a track's
+	# prediction to match it, and targets closer than mergeGate degrees to a bigger one are the same target
+	def __init__(self, resolution=DefaultResolution, cameraFOV=CameraFOV, alpha=0.5, beta=0.2, gate=3.0, mergeGate=1.0, minHits=2, maxMisses=5):
+		self.resolution = resolution
+		self.cameraFOV = cameraFOV
+		self.alpha = alpha
+		self.beta = beta
+		self.gate = gate
+		self.mergeGate = mergeGate
+		self.minHits = minHits
+		self.maxMisses = maxMisses
+
+		self.tracks = []
+		self.nextId = 1
+		self.timestamp = None	# the capture time of the last frame
+
+	# the indexes of the targets that aren't the same as a bigger one (the inside edge of the tape)
+	def Merge(self, targets):
+		kept = []
+		azels = targets['azel']
+		for j in np.argsort(-targets['width'] * targets['height'], kind='stable'):
+			az, el = azels[j]
+			if all(math.hypot(az - azels[k][0], el - azels[k][1]) > self.mergeGate for k in kept):
+				kept.append(j)
+		return kept
+
+	# match a frame's targets (a DetectionResult) to the tracks, update them, start new tracks and drop the lost
+	# ones.  timestamp is when the frame was captured, the detections' timestamp if it isn't given.  returns
+	# the confirmed tracks.
+	def Update(self, detections, timestamp=None):
+		if timestamp is None:
+			timestamp = detections.timestamp
+		self.timestamp = timestamp
+		targets = detections.targets
+		kept = self.Merge(targets)
+		azels = targets['azel'][kept].astype(np.float64)
+		centers = targets['centroid'][kept].astype(np.float64)
+		corners = targets['corners'][kept]
+
+		# every track and target pair within the gate, the closest first
+		pairs = []
+		for i, track in enumerate(self.tracks):
+			predicted = track.angles.Predict(timestamp)
+			for j, azel in enumerate(azels):
+				distance = math.hypot(azel[0] - predicted[0], azel[1] - predicted[1])
+				if distance <= self.gate:
+					pairs.append((distance, i, j))
+		pairs.sort()
+
+		matchedTracks = set()
+		matchedTargets = set()
+		for distance, i, j in pairs:
+			if i in matchedTracks or j in matchedTargets:
+				continue
+			matchedTracks.add(i)
+			matchedTargets.add(j)
+			self.tracks[i].Update(azels[j], centers[j], timestamp)
+			self.tracks[i].target = corners[j]
+
+		# the tracks that weren't found are dropped after maxMisses frames
+		for i, track in enumerate(self.tracks):
+			if i not in matchedTracks:
+				track.misses += 1
+		self.tracks = [track for track in self.tracks if track.misses <= self.maxMisses]
+
+		# the targets that weren't matched are new
+		for j in range(len(kept)):
+			if j not in matchedTargets:
+				track = Track(self.nextId, azels[j], centers[j], timestamp, self.alpha, self.beta)
+				track.target = corners[j]
+				self.tracks.append(track)
+				self.nextId += 1
+
+		return self.Confirmed()
+
+	# the tracks that have been seen enough times to report
+	def Confirmed(self):
+		return [track for track in self.tracks if track.hits >= self.minHits]
+
+	# the confirmed tracks predicted to time t (now, if it isn't given), so the latency of capturing,
+	# detecting and sending is made up for.  use latency instead to predict that many seconds past
+	# the last frame's capture time.  it's empty until the first Update().
+	def Output(self, t=None, latency=None):
+		if self.timestamp is None:
+			return []
+		if latency is not None:
+			t = self.timestamp + latency
+		elif t is None:
+			t = time.time()
+		return [FilteredTarget(track, t) for track in self.Confirmed()]
+
+
+# simulate two targets moving across the frame, measured with a pixel of jitter, and compare the raw angles
+# with the filtered ones predicted forward by the latency
+if __name__ == '__main__':
+	rng = np.random.RandomState(0)
+	fps = 30.0
+	latency = 0.080		# capture to output
+	w, h = DefaultResolution
+
+	# the true centroid of each target at time t (pixels)
+	def Truth(t):
+		return [(w * 0.3 + 60 * math.sin(0.8 * t), h * 0.5 + 20 * math.cos(0.5 * t)),
+			(w * 0.7 + 40 * math.sin(1.3 * t), h * 0.4 + 10 * t)]
+
+	def Square(center, size=20):
+		cx, cy = center
+		return np.array([[[cx - size, cy - size]], [[cx + size, cy - size]], [[cx + size, cy + size]], [[cx - size, cy + size]]], np.int32)
+
+	targetFilter = TargetFilter()
+	result = DetectionResult()
+	params = DetectorParams()
+	rawErrors = []
+	filteredErrors = []
+	ids = set()
+	for n in range(300):
+		t = n / fps
+		# the measured targets, a pixel of jitter (and a missed detection now and then)
+		targets = [Square((x + rng.normal(0, 1.0), y + rng.normal(0, 1.0))) for x, y in Truth(t) if rng.uniform() > 0.05]
+		result.FillCorners(targets, params)
+		targetFilter.Update(result, t)
+
+		# the truth when the output is used, latency seconds after the capture
+		truth = [GetAzEl(center) for center in Truth(t + latency)]
+		for az, el in result.targets['azel']:
+			rawErrors.append(min(math.hypot(az - a, el - e) for a, e in truth))
+		for output in targetFilter.Output(latency=latency):
+			filteredErrors.append(min(math.hypot(output.az - a, output.el - e) for a, e in truth))
+			ids.add(output.id)
+
+	print('raw angles:      mean error %.3f deg, p95 %.3f deg' % (np.mean(rawErrors), np.percentile(rawErrors, 95)))
+	print('filtered angles: mean error %.3f deg, p95 %.3f deg' % (np.mean(filteredErrors), np.percentile(filteredErrors, 95)))
+	print('%d track ids were used for 2 targets' % len(ids))
@@ -0,0 +1,134 @@
+#
+#  Tuner.py
+#
+#  Finds good detector parameters on a labeled dataset (see Dataset.py) instead of wiggling the trackbars
+#  on a live camera.  Every setting is scored for precision and recall (and the f1 score that combines
+#  them), and for how many ms a frame it takes.  The settings run in parallel in a pool of processes.
+#
+#  There's usually no single best setting: the most accurate one is often slower.  So it prints the
+#  Pareto front, the settings that no other setting beats on both f1 and ms.  Pick from those.
+#
+#  The search is either a grid, every combination of the values in Space, or random samples of them.
+#
+#    Example:
+#		python Dataset.py make synthetic --scene posed --frames 100
+#		python Tuner.py synthetic                                  # the whole grid
+#		python Tuner.py synthetic --random 200 --set useAdaptive=0 --out tuned.json
+#
+
+# import the necessary packages
+import argparse
+import itertools
+import json
+import multiprocessing
+import sys
+import cv2
+import numpy as np
+from TargetDetector import TargetDetector, DetectorParams
+from Dataset import Dataset, Evaluate
+from Profile import SetParams
+
+# the values to try for each parameter
+Space = {
+	'thresh': [2, 4, 6, 8, 10],
+	'adaptiveSize': [7, 11, 15, 21, 31],
+	'minPerim': [60, 100, 140],
+	'eps': [10, 15, 20, 25],
+	'aspect': [1.3, 1.45, 1.6],
+	'aspectTol': [0.1, 0.2, 0.3],
+}
+
+
+# every combination of the values in space, as a list of dicts
+def Grid(space):
+	names = sorted(space)
+	return [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+
+
+# count random combinations of the values in space (without repeats)
+def RandomSamples(space, count, seed=0):
+	grid = Grid(space)
+	rng = np.random.RandomState(seed)
+	order = rng.permutation(len(grid))[:count]
+	return [grid[i] for i in order]
+
+
+# each worker process loads the dataset once
+workerDataset = None
+workerParams = None
+
+def InitWorker(path, params):
+	global workerDataset, workerParams
+	cv2.setNumThreads(1)	# the processes are the parallelism, one opencv thread each
+	workerDataset = Dataset(path)
+	workerParams = params
+
+# score one setting, values is a dict of the params to change from the base params
+def Score(values):
+	params = DetectorParams(**workerParams)
+	for name, value in values.items():
+		setattr(params, name, value)
+	params.Validate()
+	result = Evaluate(TargetDetector(params, workerDataset.resolution), workerDataset)
+	result['params'] = values
+	return result
+
+
+# the results that no other result beats on both f1 (higher is better) and ms (lower is better)
+def ParetoFront(results):
+	front = []
+	best = -1.0
+	for result in sorted(results, key=lambda r: (r['ms'], -r['f1'])):
+		if result['f1'] > best:
+			front.append(result)
+			best = result['f1']
+	return front
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Search for the best detector parameters on a labeled dataset.')
+	parser.add_argument('dataset', help='the dataset folder (see Dataset.py)')
+	parser.add_argument('--random', type=int, default=None, metavar='N', help='try N random settings instead of the whole grid')
+	parser.add_argument('--seed', type=int, default=0, help='the seed for --random')
+	parser.add_argument('--workers', type=int, default=None, help='the number of processes (default is one per core)')
+	parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='change a base parameter that is not searched')
+	parser.add_argument('--out', help='write all the results as JSON to this file')
+	args = parser.parse_args(argv)
+
+	# a misspelled name is caught here, not as a traceback from a worker
+	try:
+		base = SetParams(DetectorParams(), args.set)
+	except (AttributeError, ValueError) as e:
+		parser.error(str(e))
+
+	settings = RandomSamples(Space, args.random, args.seed) if args.random else Grid(Space)
+	sys.stderr.write('trying %d settings\n' % len(settings))
+
+	pool = multiprocessing.Pool(args.workers, InitWorker, (args.dataset, dict(base.__dict__)))
+	try:
+		results = []
+		for i, result in enumerate(pool.imap_unordered(Score, settings, chunksize=4)):
+			results.append(result)
+			if (i + 1) % 50 == 0:
+				sys.stderr.write('%d of %d\n' % (i + 1, len(settings)))
+	finally:
+		pool.close()
+		pool.join()
+
+	front = ParetoFront(results)
+	names = sorted(Space)
+	widths = [max(len(name), 6) for name in names]
+	print('Pareto front (f1 vs ms per frame):')
+	print('%8s %6s %9s %7s  %s' % ('ms', 'f1', 'precision', 'recall', '  '.join('%*s' % (w, name) for w, name in zip(widths, names))))
+	for r in front:
+		print('%8.3f %6.3f %9.3f %7.3f  %s' % (r['ms'], r['f1'], r['precision'], r['recall'],
+			'  '.join('%*s' % (w, r['params'][name]) for w, name in zip(widths, names))))
+
+	if args.out:
+		with open(args.out, 'w') as f:
+			json.dump(dict(base=dict(base.__dict__), results=results, front=front), f, indent=2, sort_keys=True)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())